@@ -1,7 +1,8 @@
 class Backend(object):
     """
     Generic backend base class. Provides an interface to use the cache
-    with any backend
+    with any backend. Values are bytes-like objects: backends accept bytes,
+    bytearray and memoryview and may return any of them
     """
 
     def __init__(self, *args, **kwargs):
@@ -43,6 +44,173 @@ class Backend(object):
         """
         raise NotImplementedError()
 
+    def get_many(self, keys):
+        """
+        Gets several keys from the cache backend. Backends that support
+        multi-key reads should override this, by default each key is
+        fetched with get_cache
+        :param keys: The cache keys to get
+        :return: List of values in the order of keys, with None for misses
+        """
+        return [self.get_cache(key) for key in keys]
+
+    def set_many_and_expire(self, mapping, expiration):
+        """
+        Sets several key/value pairs with the same expiration TTL. By
+        default each pair is set with set_cache_and_expire
+        :param mapping: Dictionary of cache keys to cache values
+        :param expiration: The time to live (ttl) in seconds
+        """
+        for key, value in mapping.items():
+            self.set_cache_and_expire(key, value, expiration)
+
+    def invalidate_many(self, keys):
+        """
+        Removes several keys from the cache. By default each key is removed
+        with invalidate_key
+        :param keys: The cache keys
+        """
+        for key in keys:
+            self.invalidate_key(key)
+
+    def incr(self, key):
+        """
+        Increments the integer stored at key, starting from 0, without an
+        expiration. Used for generation counters. By default this reads and
+        writes the key, which is not atomic, so backends shared between
+        processes should override it
+        :param key: The counter key
+        :return: The new value
+        """
+        value = int(self.get_cache(key) or 0) + 1
+        self.set_cache(key, str(value).encode('ascii'))
+        return value
+
+    def get_counters(self, keys):
+        """
+        Reads counters written with incr. Unlike get_many, backends that
+        may answer a miss for a key they can't reach, like ShardedBackend,
+        must raise instead, since a missing counter reads as 0
+        :param keys: The counter keys
+        :return: List of values in the order of keys, with None for
+        counters never incremented
+        :raises BackendException: If a counter can't be read
+        """
+        return self.get_many(keys)
+
+    def acquire_lock(self, key, timeout):
+        """
+        Takes a lock shared by every client of the backend, used to make
+        sure only one process recomputes an expired value
+        :param key: The lock key
+        :param timeout: Seconds after which the lock is released even if
+        its holder never releases it
+        :return: A token to release the lock with, or None if the lock is
+        held by someone else
+        """
+        raise NotImplementedError()
+
+    def release_lock(self, key, token):
+        """
+        Releases a lock if it is still held with the given token
+        :param key: The lock key
+        :param token: The token returned by acquire_lock
+        """
+        raise NotImplementedError()
+
+
+class AsyncBackend(object):
+    """
+    Generic asyncio backend base class. Same interface as Backend, with
+    every method a coroutine
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def get_cache(self, key):
+        """
+        Gets the given key from the cache backend
+        :param key: The cache key to get
+        :return: The value in the cache in the case of a cache hit,
+        otherwise None
+        """
+        raise NotImplementedError()
+
+    async def set_cache(self, key, value):
+        """
+        Sets the given key/value pair in the cache backend
+        :param key: The cache key
+        :param value: The cache value
+        :return: Response from cache backend
+        """
+        raise NotImplementedError()
+
+    async def set_cache_and_expire(self, key, value, expiration):
+        """
+        Sets the key/value pair in the cache backend with an expiration TTL
+        :param key: The cache key
+        :param value: The cache value
+        :param expiration: The time to live (ttl) in seconds
+        :return: Response from cache backend
+        """
+        raise NotImplementedError()
+
+    async def invalidate_key(self, key):
+        """
+        Removes the key from the cache
+        :param key: The cache key
+        :return: Response from cache Backend
+        """
+        raise NotImplementedError()
+
+    async def get_many(self, keys):
+        """
+        Gets several keys from the cache backend, by default one at a time
+        :param keys: The cache keys to get
+        :return: List of values in the order of keys, with None for misses
+        """
+        return [await self.get_cache(key) for key in keys]
+
+    async def set_many_and_expire(self, mapping, expiration):
+        """
+        Sets several key/value pairs with the same expiration TTL, by
+        default one at a time
+        :param mapping: Dictionary of cache keys to cache values
+        :param expiration: The time to live (ttl) in seconds
+        """
+        for key, value in mapping.items():
+            await self.set_cache_and_expire(key, value, expiration)
+
+    async def invalidate_many(self, keys):
+        """
+        Removes several keys from the cache, by default one at a time
+        :param keys: The cache keys
+        """
+        for key in keys:
+            await self.invalidate_key(key)
+
+    async def incr(self, key):
+        """
+        Increments the integer stored at key, starting from 0, without an
+        expiration. By default this reads and writes the key, which is not
+        atomic
+        :param key: The counter key
+        :return: The new value
+        """
+        value = int(await self.get_cache(key) or 0) + 1
+        await self.set_cache(key, str(value).encode('ascii'))
+        return value
+
+    async def get_counters(self, keys):
+        """
+        Reads counters written with incr, see Backend.get_counters
+        :param keys: The counter keys
+        :return: List of values in the order of keys, with None for
+        counters never incremented
+        """
+        return await self.get_many(keys)
+
 
 class BackendException(Exception):
     """
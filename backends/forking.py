@@ -0,0 +1,34 @@
+"""
+Helpers keeping objects usable in a child process after fork. Locks held
+by other threads, sockets shared with the parent and worker threads, which
+don't survive a fork, must all be rebuilt in the child
+"""
+import os
+import weakref
+
+# object -> list of callables rebuilding its state. Entries go away with
+# their object, so a single fork hook serves every object for the life of
+# the process
+_resets = weakref.WeakKeyDictionary()
+
+
+def _reset_in_child():
+    for obj, resets in list(_resets.items()):
+        for reset in resets:
+            reset(obj)
+
+
+def after_fork(obj, reset):
+    """
+    Calls reset(obj) in the child process after every fork, for as long as
+    obj is alive
+    :param obj: The object owning process specific state
+    :param reset: Callable taking the object and rebuilding that state
+    """
+    resets = _resets.setdefault(obj, [])
+    if reset not in resets:
+        resets.append(reset)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
@@ -0,0 +1,238 @@
+from backends.backend_base import Backend
+from backends.forking import after_fork
+from collections import OrderedDict
+import binascii
+import heapq
+import os
+import sys
+import threading
+import time
+
+# Default upper bound on the total size of stored values
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def _reset_lock_after_fork(backend):
+    # Another thread may have held the lock when the process forked. The
+    # child keeps its own copy of the keys
+    backend._lock = threading.Lock()
+
+
+class MemoryBackend(Backend):
+    """
+    In-process backend for single process workers and tests. Keys expire
+    lazily when read, and a min-heap of expiry times is swept on every write
+    so expired keys that are never read again don't pile up. When the stored
+    values exceed max_bytes the least recently used keys are evicted
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param max_bytes: Maximum total size of stored values in bytes,
+        None for no limit
+        """
+        super(MemoryBackend, self).__init__()
+        self.max_bytes = max_bytes
+        # key -> (value, size, expires_at or None), in LRU order
+        self._entries = OrderedDict()
+        # (expires_at, key) for every key set with a TTL. Entries become
+        # stale when their key is overwritten or deleted and are skipped
+        self._expiry_heap = []
+        self._bytes = 0
+        self._lock = threading.Lock()
+        after_fork(self, _reset_lock_after_fork)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """
+        Total size in bytes of the stored values
+        """
+        return self._bytes
+
+    def _sizeof(self, value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return len(value)
+        return sys.getsizeof(value)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        return entry
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, _, expires_at = entry
+        if expires_at is not None and expires_at <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key, value, expires_at):
+        """
+        :return: False if the value is larger than max_bytes, in which case
+        the key is only removed, so storing it doesn't evict every other key
+        """
+        self._remove(key)
+        size = self._sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False
+        self._entries[key] = (value, size, expires_at)
+        self._bytes += size
+        if expires_at is not None:
+            heapq.heappush(self._expiry_heap, (expires_at, key))
+        return True
+
+    def _sweep(self, now):
+        """
+        Drops every key whose expiry time has passed, then evicts least
+        recently used keys until the size limit is respected
+        """
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] == expires_at:
+                self._remove(key)
+        # Overwritten keys leave stale heap entries behind, rebuild the heap
+        # once they outnumber the live keys
+        if len(heap) > 2 * len(self._entries) + 64:
+            self._expiry_heap = [
+                (entry[2], key) for key, entry in self._entries.items()
+                if entry[2] is not None]
+            heapq.heapify(self._expiry_heap)
+        if self.max_bytes is not None:
+            while self._bytes > self.max_bytes and self._entries:
+                key = next(iter(self._entries))
+                self._remove(key)
+
+    def get_cache(self, key):
+        """
+        Gets the given key from memory
+        :param key: The cache key to get
+        :return: The stored value, or None if missing or expired
+        """
+        with self._lock:
+            return self._get(key, time.monotonic())
+
+    def set_cache(self, key, value):
+        """
+        Stores the key/value pair without expiration
+        :param key: The cache key
+        :param value: The cache value
+        :return: False if the value is larger than max_bytes
+        """
+        with self._lock:
+            stored = self._set(key, value, None)
+            self._sweep(time.monotonic())
+        return stored
+
+    def set_cache_and_expire(self, key, value, expiration):
+        """
+        Stores the key/value pair with an expiration TTL
+        :param key: The cache key
+        :param value: The cache value
+        :param expiration: The time to live (ttl) in seconds
+        :return: False if the value is larger than max_bytes
+        """
+        with self._lock:
+            now = time.monotonic()
+            stored = self._set(key, value, now + expiration)
+            self._sweep(now)
+        return stored
+
+    def invalidate_key(self, key):
+        """
+        Removes the key
+        :param key: The cache key
+        :return: Number of keys removed
+        """
+        with self._lock:
+            return int(self._remove(key) is not None)
+
+    def get_many(self, keys):
+        """
+        Gets several keys under a single lock acquisition
+        :param keys: The cache keys to get
+        :return: List of values in the order of keys, with None for misses
+        """
+        with self._lock:
+            now = time.monotonic()
+            return [self._get(key, now) for key in keys]
+
+    def set_many_and_expire(self, mapping, expiration):
+        """
+        Stores several key/value pairs with the same expiration TTL
+        :param mapping: Dictionary of cache keys to cache values
+        :param expiration: The time to live (ttl) in seconds
+        """
+        with self._lock:
+            now = time.monotonic()
+            for key, value in mapping.items():
+                self._set(key, value, now + expiration)
+            self._sweep(now)
+        return True
+
+    def invalidate_many(self, keys):
+        """
+        Removes several keys
+        :param keys: The cache keys
+        :return: Number of keys removed
+        """
+        with self._lock:
+            return sum(self._remove(key) is not None for key in keys)
+
+    def incr(self, key):
+        """
+        Increments the counter at key, stored as ASCII digits like Redis
+        does, without an expiration
+        :param key: The counter key
+        :return: The new value
+        """
+        with self._lock:
+            now = time.monotonic()
+            value = int(self._get(key, now) or 0) + 1
+            self._set(key, str(value).encode('ascii'), None)
+            self._sweep(now)
+        return value
+
+    def acquire_lock(self, key, timeout):
+        """
+        Takes the lock unless a live lock is already stored at key
+        :param key: The lock key
+        :param timeout: Seconds after which the lock expires
+        :return: The lock token, or None if the lock is already held
+        """
+        token = binascii.hexlify(os.urandom(16))
+        with self._lock:
+            now = time.monotonic()
+            if self._get(key, now) is not None:
+                return None
+            self._set(key, token, now + timeout)
+            self._sweep(now)
+        return token
+
+    def release_lock(self, key, token):
+        """
+        Removes the lock if it still holds the token
+        :param key: The lock key
+        :param token: The token returned by acquire_lock
+        """
+        with self._lock:
+            if self._get(key, time.monotonic()) == token:
+                self._remove(key)
+
+    def clear(self):
+        """
+        Removes every key
+        """
+        with self._lock:
+            self._entries.clear()
+            self._expiry_heap = []
+            self._bytes = 0
@@ -0,0 +1,179 @@
+from backends.memory.memory_backend import MemoryBackend
+from unittest import TestCase
+from mock import patch
+import threading
+
+
+class TestMemoryBackend(TestCase):
+    """
+    Test cases for memory_backend.py
+    """
+    def setUp(self):
+        self.backend = MemoryBackend()
+
+    def test_get_set(self):
+        """
+        Tests GET, SET and a miss
+        """
+        self.backend.set_cache('key', b'value')
+        self.assertEqual(self.backend.get_cache('key'), b'value')
+        self.assertIsNone(self.backend.get_cache('missing'))
+        self.assertEqual(self.backend.size, 5)
+
+    def test_invalidate(self):
+        """
+        Tests removing keys
+        """
+        self.backend.set_cache('key', b'value')
+        self.assertEqual(self.backend.invalidate_key('key'), 1)
+        self.assertEqual(self.backend.invalidate_key('key'), 0)
+        self.assertIsNone(self.backend.get_cache('key'))
+        self.assertEqual(self.backend.size, 0)
+
+    def test_incr(self):
+        """
+        Tests that counters start from 0 and are stored as digits
+        """
+        self.assertEqual(self.backend.incr('counter'), 1)
+        self.assertEqual(self.backend.incr('counter'), 2)
+        self.assertEqual(self.backend.get_cache('counter'), b'2')
+
+    @patch('backends.memory.memory_backend.time')
+    def test_lazy_expiry(self, mock_time):
+        """
+        Tests that an expired key is a miss when read
+        """
+        mock_time.monotonic.return_value = 100
+        self.backend.set_cache_and_expire('key', b'value', 10)
+
+        mock_time.monotonic.return_value = 109
+        self.assertEqual(self.backend.get_cache('key'), b'value')
+        mock_time.monotonic.return_value = 110
+        self.assertIsNone(self.backend.get_cache('key'))
+        self.assertEqual(len(self.backend), 0)
+
+    @patch('backends.memory.memory_backend.time')
+    def test_sweep(self, mock_time):
+        """
+        Tests that expired keys are dropped on write without being read
+        """
+        mock_time.monotonic.return_value = 100
+        for i in range(10):
+            self.backend.set_cache_and_expire(i, b'value', 5)
+        self.backend.set_cache('forever', b'value')
+
+        mock_time.monotonic.return_value = 200
+        self.backend.set_cache_and_expire('new', b'value', 5)
+
+        self.assertEqual(len(self.backend), 2)
+        self.assertEqual(self.backend.size, 10)
+
+    @patch('backends.memory.memory_backend.time')
+    def test_overwrite_extends_ttl(self, mock_time):
+        """
+        Tests that a stale heap entry does not expire a rewritten key
+        """
+        mock_time.monotonic.return_value = 100
+        self.backend.set_cache_and_expire('key', b'old', 5)
+        self.backend.set_cache_and_expire('key', b'new', 50)
+
+        mock_time.monotonic.return_value = 110
+        self.backend.set_cache_and_expire('other', b'value', 5)
+        self.assertEqual(self.backend.get_cache('key'), b'new')
+
+    def test_heap_compaction(self):
+        """
+        Tests that rewriting the same key does not grow the heap forever
+        """
+        for _ in range(1000):
+            self.backend.set_cache_and_expire('key', b'value', 60)
+        self.assertLess(len(self.backend._expiry_heap), 100)
+
+    def test_lru_eviction(self):
+        """
+        Tests that least recently used keys are evicted over max_bytes
+        """
+        backend = MemoryBackend(max_bytes=30)
+        backend.set_cache_and_expire('a', b'x' * 10, 60)
+        backend.set_cache_and_expire('b', b'x' * 10, 60)
+        backend.set_cache_and_expire('c', b'x' * 10, 60)
+        backend.get_cache('a')
+        backend.set_cache_and_expire('d', b'x' * 10, 60)
+
+        self.assertIsNone(backend.get_cache('b'))
+        self.assertIsNotNone(backend.get_cache('a'))
+        self.assertIsNotNone(backend.get_cache('c'))
+        self.assertIsNotNone(backend.get_cache('d'))
+        self.assertEqual(backend.size, 30)
+
+    def test_oversized_value(self):
+        """
+        Tests that a value larger than max_bytes is rejected without
+        evicting the other keys
+        """
+        backend = MemoryBackend(max_bytes=100)
+        for key in 'abcde':
+            backend.set_cache_and_expire(key, b'x' * 10, 60)
+        backend.set_cache('big', b'old')
+
+        self.assertFalse(backend.set_cache_and_expire('big', b'y' * 200, 60))
+        self.assertFalse(backend.set_cache('big', b'y' * 200))
+        backend.set_many_and_expire({'big': b'y' * 200}, 60)
+        self.assertEqual(len(backend), 5)
+        self.assertIsNone(backend.get_cache('big'))
+        self.assertEqual(backend.size, 50)
+
+    def test_many(self):
+        """
+        Tests the multi-key methods
+        """
+        self.backend.set_many_and_expire({'a': b'1', 'b': b'2'}, 60)
+        self.assertEqual(self.backend.get_many(['a', 'x', 'b']),
+                         [b'1', None, b'2'])
+        self.assertEqual(self.backend.invalidate_many(['a', 'x']), 1)
+        self.assertEqual(self.backend.get_many(['a', 'b']), [None, b'2'])
+
+    def test_threads(self):
+        """
+        Tests concurrent writers and readers keep the size accounting exact
+        """
+        backend = MemoryBackend(max_bytes=1000)
+
+        def worker(offset):
+            for i in range(500):
+                key = (offset + i) % 150
+                backend.set_cache_and_expire(key, b'x' * 10, 60)
+                backend.get_cache(key - 1)
+                if i % 7 == 0:
+                    backend.invalidate_key(key)
+
+        workers = [threading.Thread(target=worker, args=(n * 13,))
+                   for n in range(8)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        self.assertLessEqual(backend.size, 1000)
+        self.assertEqual(backend.size, 10 * len(backend))
+
+    @patch('backends.memory.memory_backend.time')
+    def test_lock(self, mock_time):
+        """
+        Tests acquiring, releasing and expiring locks
+        """
+        mock_time.monotonic.return_value = 100
+        token = self.backend.acquire_lock('lock', 10)
+        self.assertIsNotNone(token)
+        self.assertIsNone(self.backend.acquire_lock('lock', 10))
+
+        # Releasing with the wrong token does nothing
+        self.backend.release_lock('lock', b'wrong')
+        self.assertIsNone(self.backend.acquire_lock('lock', 10))
+        self.backend.release_lock('lock', token)
+        token = self.backend.acquire_lock('lock', 10)
+        self.assertIsNotNone(token)
+
+        # An abandoned lock expires
+        mock_time.monotonic.return_value = 111
+        self.assertIsNotNone(self.backend.acquire_lock('lock', 10))
@@ -0,0 +1,232 @@
+from backends.backend_base import AsyncBackend, BackendException
+from backends.forking import after_fork
+from backends.redis.connection_pool import (
+    DEFAULT_MAX_CONNECTIONS, DEFAULT_IDLE_TIMEOUT)
+from backends.redis.resp import (
+    ResponseError, build_command_buffers, join_commands, read_reply_async)
+import asyncio
+import socket
+import time
+
+
+class _StreamConnection(object):
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.uses = 0
+        self.last_used = time.monotonic()
+
+    def is_usable(self, idle_timeout):
+        if self.writer.is_closing() or self.reader.at_eof():
+            return False
+        if idle_timeout is None:
+            return True
+        return time.monotonic() - self.last_used <= idle_timeout
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncRedisBackend(AsyncBackend):
+    """
+    asyncio Redis backend keeping a pool of persistent stream connections
+    """
+
+    def __init__(self, address, port,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 connect_timeout=None, timeout=None):
+        """
+        :param address: Address of the Redis server
+        :param port: Port of the Redis server
+        :param max_connections: Maximum number of open connections
+        :param idle_timeout: Seconds after which an idle connection is closed
+        :param connect_timeout: Seconds allowed to open a connection
+        :param timeout: Seconds allowed for a request, from taking a
+        connection to reading the last reply
+        """
+        super(AsyncRedisBackend, self).__init__()
+        self.address = address
+        self.port = port
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self._reset_after_fork()
+        after_fork(self, AsyncRedisBackend._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # Connections opened by the parent belong to its event loop and
+        # share sockets with it
+        self._idle = []
+        self._slots = asyncio.Semaphore(self.max_connections)
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.address, int(self.port)),
+            self.connect_timeout)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return _StreamConnection(reader, writer)
+
+    async def _get_connection(self):
+        """
+        Takes an idle connection or opens a new one. The caller must hold
+        one of the pool's slots
+        """
+        while self._idle:
+            connection = self._idle.pop()
+            if connection.is_usable(self.idle_timeout):
+                return connection
+            connection.close()
+        return await self._connect()
+
+    async def _send_and_recv(self, connection, payload, reply_count):
+        connection.writer.writelines(payload)
+        await connection.writer.drain()
+        responses = [await read_reply_async(connection.reader)
+                     for _ in range(reply_count)]
+        connection.uses += 1
+        return responses
+
+    async def _attempt(self, payload, reply_count):
+        for attempt in range(2):
+            connection = await self._get_connection()
+            try:
+                responses = await self._send_and_recv(
+                    connection, payload, reply_count)
+            except asyncio.CancelledError:
+                # Timed out or cancelled part way through a reply
+                connection.close()
+                raise
+            except Exception:
+                connection.close()
+                # The server may have dropped a connection that sat in the
+                # pool, so retry once on a fresh one before giving up
+                if attempt or connection.uses == 0:
+                    raise
+                continue
+            connection.last_used = time.monotonic()
+            self._idle.append(connection)
+            return responses
+
+    async def _request(self, payload, reply_count):
+        async with self._slots:
+            try:
+                return await asyncio.wait_for(
+                    self._attempt(payload, reply_count), self.timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                raise BackendException(
+                    'Unable to make request to Redis: %s' % (
+                        str(e) or e.__class__.__name__))
+
+    async def _make_request(self, command):
+        """
+        Makes the request to the Redis Server
+        :param command: Raw Redis command
+        :return: Parsed reply from Redis Server
+        """
+        response = (await self._request(command, 1))[0]
+        if isinstance(response, ResponseError):
+            raise response
+        return response
+
+    async def _make_pipelined_request(self, commands):
+        """
+        Sends several commands in a single write and reads all the replies
+        :param commands: List of raw Redis commands
+        :return: List of parsed replies in command order
+        """
+        responses = await self._request(
+            join_commands(commands), len(commands))
+        for response in responses:
+            if isinstance(response, ResponseError):
+                raise response
+        return responses
+
+    async def disconnect(self):
+        """
+        Closes all idle pooled connections
+        """
+        while self._idle:
+            connection = self._idle.pop()
+            connection.close()
+            await connection.writer.wait_closed()
+
+    async def invalidate_key(self, key):
+        """
+        DEL method
+        :param key: The key to delete
+        """
+        return await self._make_request(build_command_buffers('DEL', key))
+
+    async def get_cache(self, key):
+        """
+        GET method
+        :param key: The key to GET
+        :return: The cached value, or None if the key does not exist
+        """
+        return await self._make_request(build_command_buffers('GET', key))
+
+    async def set_cache(self, key, value):
+        """
+        SET method
+        :param key: The key to SET
+        :param value: The value of the key to SET
+        """
+        return await self._make_request(
+            build_command_buffers('SET', key, value))
+
+    async def set_cache_and_expire(self, key, value, expiration):
+        """
+        SETEX command
+        :param key: The key to SET
+        :param value: The value of the key to SET
+        :param expiration: TTL in seconds
+        """
+        return await self._make_request(
+            build_command_buffers('SETEX', key, expiration, value))
+
+    async def get_many(self, keys):
+        """
+        MGET method
+        :param keys: The keys to GET
+        :return: List of values in the order of keys, with None for misses
+        """
+        if not keys:
+            return []
+        return await self._make_request(build_command_buffers('MGET', *keys))
+
+    async def set_many_and_expire(self, mapping, expiration):
+        """
+        Pipelined SETEX commands, sent in a single round trip
+        :param mapping: Dictionary of keys to values to SET
+        :param expiration: TTL in seconds
+        """
+        if not mapping:
+            return []
+        return await self._make_pipelined_request(
+            [build_command_buffers('SETEX', key, expiration, value)
+             for key, value in mapping.items()])
+
+    async def invalidate_many(self, keys):
+        """
+        Multi-key DEL method
+        :param keys: The keys to delete
+        :return: Number of keys deleted
+        """
+        if not keys:
+            return 0
+        return await self._make_request(build_command_buffers('DEL', *keys))
+
+    async def incr(self, key):
+        """
+        INCR method
+        :param key: The counter key
+        :return: The new value
+        """
+        return await self._make_request(build_command_buffers('INCR', key))
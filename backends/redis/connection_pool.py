@@ -0,0 +1,249 @@
+from backends.backend_base import BackendException
+from backends.forking import after_fork
+from backends.redis.resp import RespReader
+from collections import deque
+from itertools import islice
+import select
+import socket
+import threading
+import time
+
+# Default upper bound on open sockets held by a single pool
+DEFAULT_MAX_CONNECTIONS = 16
+# Idle sockets older than this (in seconds) are closed instead of reused
+DEFAULT_IDLE_TIMEOUT = 300
+# Reused sockets idle for longer than this (in seconds) are health checked
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+# Most buffers passed to a single sendmsg call, below every platform's
+# IOV_MAX
+MAX_SEND_BUFFERS = 512
+
+
+def send_buffers(sock, buffers):
+    """
+    Sends buffers in order with scatter-gather writes, so they are not
+    copied into a single buffer first
+    :param sock: A connected socket
+    :param buffers: List of bytes-like objects
+    """
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return
+    views = deque(memoryview(buffer) for buffer in buffers if len(buffer))
+    while views:
+        sent = sock.sendmsg(list(islice(views, MAX_SEND_BUFFERS)))
+        while sent:
+            first = views[0]
+            if sent < len(first):
+                views[0] = first[sent:]
+                break
+            sent -= len(first)
+            views.popleft()
+
+
+class Connection(object):
+    """
+    A single TCP connection to a Redis server
+    """
+
+    def __init__(self, address, port, connect_timeout=None, timeout=None):
+        """
+        :param address: Address of the Redis server
+        :param port: Port of the Redis server
+        :param connect_timeout: Seconds allowed to open the connection, None
+        to block
+        :param timeout: Seconds allowed for each send or receive once
+        connected, None to block
+        """
+        self.address = address
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.uses = 0
+        self.last_used = time.time()
+
+    def connect(self):
+        """
+        Opens the underlying socket
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.sock.settimeout(self.connect_timeout)
+            self.sock.connect((self.address, int(self.port)))
+            self.sock.settimeout(self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except Exception:
+            self.close()
+            raise
+        self.reader = RespReader(self)
+        self.last_used = time.time()
+
+    def send(self, data):
+        """
+        :param data: bytes, or a list of bytes-like buffers sent without
+        being joined
+        """
+        if not isinstance(data, list):
+            self.sock.sendall(data)
+        elif len(data) == 1:
+            self.sock.sendall(data[0])
+        else:
+            send_buffers(self.sock, data)
+
+    def recv_into(self, buffer):
+        return self.sock.recv_into(buffer)
+
+    def read_reply(self):
+        return self.reader.read_reply()
+
+    def is_alive(self):
+        """
+        Checks that the server has not closed the connection. An idle Redis
+        connection should never be readable, so a readable socket means
+        either EOF or unsolicited data, and the connection is unusable
+        :return: True if the connection can be reused
+        """
+        if self.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (ValueError, select.error, socket.error):
+            return False
+        return not readable
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+            self.reader = None
+
+
+class ConnectionPool(object):
+    """
+    Thread safe pool of persistent connections to a single Redis server
+    """
+
+    def __init__(self, address, port,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL,
+                 wait_timeout=None, connect_timeout=None,
+                 socket_timeout=None):
+        """
+        :param address: Address of the Redis server
+        :param port: Port of the Redis server
+        :param max_connections: Maximum number of open connections
+        :param idle_timeout: Seconds after which an idle connection is closed
+        :param health_check_interval: Seconds of idleness after which a
+        connection is checked before being handed out again
+        :param wait_timeout: Seconds to wait for a free connection when the
+        pool is exhausted, None to wait forever
+        :param connect_timeout: Seconds allowed to open a connection
+        :param socket_timeout: Seconds allowed for each send or receive
+        """
+        if max_connections < 1:
+            raise ValueError('max_connections must be at least 1')
+        self.address = address
+        self.port = port
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.wait_timeout = wait_timeout
+        self.connect_timeout = connect_timeout
+        self.socket_timeout = socket_timeout
+        self._reset_after_fork()
+        after_fork(self, ConnectionPool._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # After a fork the idle sockets are shared with the parent, which
+        # may be using them, so the child forgets them and opens its own
+        self._idle = deque()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    def _make_connection(self):
+        return Connection(self.address, self.port, self.connect_timeout,
+                          self.socket_timeout)
+
+    def _is_usable(self, connection, now):
+        idle_for = now - connection.last_used
+        if self.idle_timeout is not None and idle_for > self.idle_timeout:
+            return False
+        if idle_for > self.health_check_interval:
+            return connection.is_alive()
+        return True
+
+    def get_connection(self):
+        """
+        Takes a connection out of the pool, opening a new one if none are
+        idle and the pool is not full
+        :return: A connected Connection
+        """
+        deadline = None
+        if self.wait_timeout is not None:
+            deadline = time.time() + self.wait_timeout
+        with self._available:
+            while True:
+                now = time.time()
+                # Most recently used connections are the least likely to
+                # have been dropped by the server
+                while self._idle:
+                    connection = self._idle.pop()
+                    if self._is_usable(connection, now):
+                        return connection
+                    connection.close()
+                    self._created -= 1
+                if self._created < self.max_connections:
+                    self._created += 1
+                    break
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise BackendException(
+                            'Timed out waiting for a Redis connection')
+                self._available.wait(remaining)
+
+        connection = self._make_connection()
+        try:
+            connection.connect()
+        except Exception:
+            self.discard(connection)
+            raise
+        return connection
+
+    def release(self, connection):
+        """
+        Returns a healthy connection to the pool
+        :param connection: The connection to return
+        """
+        connection.last_used = time.time()
+        with self._available:
+            self._idle.append(connection)
+            self._available.notify()
+
+    def discard(self, connection):
+        """
+        Closes a broken connection and frees its slot in the pool
+        :param connection: The connection to drop
+        """
+        connection.close()
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    def disconnect(self):
+        """
+        Closes every idle connection held by the pool
+        """
+        with self._available:
+            while self._idle:
+                self._idle.pop().close()
+                self._created -= 1
+            self._available.notify_all()
@@ -1,52 +1,131 @@
 from backends.backend_base import Backend, BackendException
+from backends.redis.connection_pool import (
+    Connection, ConnectionPool, DEFAULT_MAX_CONNECTIONS, DEFAULT_IDLE_TIMEOUT,
+    DEFAULT_HEALTH_CHECK_INTERVAL)
+from backends.redis.resp import (
+    ResponseError, build_command_buffers, join_commands)
+import binascii
+import os
 import socket
 
+# Deletes a lock only if it still holds the caller's token
+RELEASE_LOCK_SCRIPT = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('del', KEYS[1]) else return 0 end")
+
 
 class RedisBackend(Backend):
 
-    def __init__(self, address, port):
+    def __init__(self, address, port, use_pool=True,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL,
+                 pool_wait_timeout=None, connect_timeout=None, timeout=None):
+        """
+        :param connect_timeout: Seconds allowed to open a connection, None
+        to block
+        :param timeout: Seconds allowed for each send or receive, None to
+        block. A request that times out is not retried
+        """
         super(RedisBackend, self).__init__()
-        self.delimiter = '\r\n'
+        self.delimiter = b'\r\n'
         self.address = address
         self.port = port
-        self.RECV_SIZE = 2048
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.pool = None
+        if use_pool:
+            self.pool = ConnectionPool(
+                address, port, max_connections=max_connections,
+                idle_timeout=idle_timeout,
+                health_check_interval=health_check_interval,
+                wait_timeout=pool_wait_timeout,
+                connect_timeout=connect_timeout, socket_timeout=timeout)
 
     def _make_request(self, command):
         """
         Makes the request to the Redis Server
         :param command: Raw Redis command
-        :return: Response from Redis Server
+        :return: Parsed reply from Redis Server
+        """
+        response = self._request(command, 1)[0]
+        if isinstance(response, ResponseError):
+            raise response
+        return response
+
+    def _make_pipelined_request(self, commands):
+        """
+        Sends several commands in a single write and reads all the replies,
+        paying one round trip instead of one per command
+        :param commands: List of raw Redis commands
+        :return: List of parsed replies in command order
         """
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        responses = self._request(join_commands(commands), len(commands))
+        for response in responses:
+            if isinstance(response, ResponseError):
+                raise response
+        return responses
+
+    def _request(self, payload, reply_count):
+        if self.pool is None:
+            return self._make_unpooled_request(payload, reply_count)
+        return self._make_pooled_request(payload, reply_count)
+
+    def _make_pooled_request(self, payload, reply_count):
+        for attempt in range(2):
+            try:
+                connection = self.pool.get_connection()
+            except Exception as e:
+                raise BackendException(
+                    'Unable to make request to Redis: %s' % str(e))
+            try:
+                responses = self._send_and_recv(
+                    connection, payload, reply_count)
+            except Exception as e:
+                self.pool.discard(connection)
+                # The server may have dropped a connection that sat in the
+                # pool, so retry once on a fresh one before giving up. A slow
+                # server is not retried, that would double the wait
+                if attempt or connection.uses == 0 or \
+                        isinstance(e, socket.timeout):
+                    raise BackendException(
+                        'Unable to make request to Redis: %s' % str(e))
+                continue
+            self.pool.release(connection)
+            return responses
+
+    def _make_unpooled_request(self, payload, reply_count):
+        connection = Connection(self.address, self.port,
+                                self.connect_timeout, self.timeout)
         try:
-            s.connect((self.address, int(self.port)))
-            s.send(command)
-            response = self._recv_data(s)
-            return response
+            connection.connect()
+            return self._send_and_recv(connection, payload, reply_count)
         except Exception as e:
             raise BackendException(
                 'Unable to make request to Redis: %s' % str(e))
         finally:
-            s.close()
+            connection.close()
 
-    def _recv_data(self, sock):
-        data = ''
-        while True:
-            received = sock.recv(self.RECV_SIZE)
-            data += received
-            if len(received) <= self.RECV_SIZE:
-                break
-        return data
+    def _send_and_recv(self, connection, payload, reply_count):
+        connection.send(payload)
+        responses = [connection.read_reply() for _ in range(reply_count)]
+        connection.uses += 1
+        return responses
 
     def _build_command(self, *args):
         """
-        Builds a Redis command
-        :return: Raw Redis command
+        Builds a Redis command. Values are bytes-like objects and are sent
+        without being copied when large
+        :return: Raw Redis command, as a list of buffers
+        """
+        return build_command_buffers(*args)
+
+    def disconnect(self):
+        """
+        Closes all idle pooled connections
         """
-        command_args = ['*%s' % len(args)]
-        for arg in args:
-            command_args.extend(['$%s' % len(str(arg)), str(arg)])
-        return self.delimiter.join(command_args) + self.delimiter
+        if self.pool is not None:
+            self.pool.disconnect()
 
     def invalidate_key(self, key):
         """
@@ -54,17 +133,16 @@ class RedisBackend(Backend):
         :param key: The key to delete
         """
         command = self._build_command('DEL', key)
-        response = self._make_request(command)
-        return response.split(self.delimiter)[0]
+        return self._make_request(command)
 
     def get_cache(self, key):
         """
         GET method
         :param key: The key to GET
+        :return: The cached value, or None if the key does not exist
         """
         command = self._build_command('GET', key)
-        response = self._make_request(command)
-        return response.split(self.delimiter)[1]
+        return self._make_request(command)
 
     def set_cache(self, key, value, **kwargs):
         """
@@ -73,8 +151,7 @@ class RedisBackend(Backend):
         :param value: The value of the key to SET
         """
         command = self._build_command('SET', key, value)
-        response = self._make_request(command)
-        return response.split(self.delimiter)[0]
+        return self._make_request(command)
 
     def set_cache_and_expire(self, key, value, expiration):
         """
@@ -84,6 +161,70 @@ class RedisBackend(Backend):
         :param expiration: TTL in seconds
         """
         command = self._build_command('SETEX', key, expiration, value)
-        response = self._make_request(command)
-        return response.split(self.delimiter)[0]
+        return self._make_request(command)
+
+    def get_many(self, keys):
+        """
+        MGET method
+        :param keys: The keys to GET
+        :return: List of values in the order of keys, with None for misses
+        """
+        if not keys:
+            return []
+        command = self._build_command('MGET', *keys)
+        return self._make_request(command)
 
+    def set_many_and_expire(self, mapping, expiration):
+        """
+        Pipelined SETEX commands, sent in a single round trip
+        :param mapping: Dictionary of keys to values to SET
+        :param expiration: TTL in seconds
+        """
+        if not mapping:
+            return []
+        commands = [self._build_command('SETEX', key, expiration, value)
+                    for key, value in mapping.items()]
+        return self._make_pipelined_request(commands)
+
+    def invalidate_many(self, keys):
+        """
+        Multi-key DEL method
+        :param keys: The keys to delete
+        :return: Number of keys deleted
+        """
+        if not keys:
+            return 0
+        command = self._build_command('DEL', *keys)
+        return self._make_request(command)
+
+    def incr(self, key):
+        """
+        INCR method
+        :param key: The counter key
+        :return: The new value
+        """
+        return self._make_request(self._build_command('INCR', key))
+
+    def acquire_lock(self, key, timeout):
+        """
+        SET NX PX method
+        :param key: The lock key
+        :param timeout: Seconds after which the lock expires
+        :return: The lock token, or None if the lock is already held
+        """
+        token = binascii.hexlify(os.urandom(16))
+        command = self._build_command(
+            'SET', key, token, 'NX', 'PX', max(1, int(timeout * 1000)))
+        if self._make_request(command) is None:
+            return None
+        return token
+
+    def release_lock(self, key, token):
+        """
+        Deletes the lock key if it still holds the token
+        :param key: The lock key
+        :param token: The token returned by acquire_lock
+        """
+        command = self._build_command(
+            'EVAL', RELEASE_LOCK_SCRIPT, 1, key, token)
+        return self._make_request(command)
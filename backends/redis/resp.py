@@ -0,0 +1,228 @@
+from backends.backend_base import BackendException
+import asyncio
+
+# Initial size of the per-connection read buffer
+DEFAULT_BUFFER_SIZE = 16 * 1024
+DELIMITER = b'\r\n'
+# Command arguments from this size are written from their own buffer
+# instead of being copied into the command
+SCATTER_THRESHOLD = 16 * 1024
+
+
+class ResponseError(BackendException):
+    """
+    Error reply sent by the Redis server
+    """
+    pass
+
+
+class ProtocolError(BackendException):
+    """
+    Malformed or truncated reply from the Redis server
+    """
+    pass
+
+
+class RespReader(object):
+    """
+    Incremental RESP2 reply parser reading from a connection. Bytes that
+    arrive past the end of one reply are kept for the next one, so several
+    pipelined replies can be read back to back
+    """
+
+    def __init__(self, connection, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        :param connection: Object exposing recv_into(buffer)
+        :param buffer_size: Initial size of the read buffer in bytes
+        """
+        self.connection = connection
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        # Unconsumed data lives in self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = 0
+
+    def _recv_into(self, view):
+        received = self.connection.recv_into(view)
+        if not received:
+            raise ProtocolError('Connection closed by Redis server')
+        return received
+
+    def _fill(self):
+        """
+        Reads more data from the connection into the buffer, compacting or
+        growing it first if there is no room left at the end
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            pending = self._end - self._start
+            if self._start == 0:
+                # A single line fills the whole buffer, so double it
+                grown = bytearray(len(self._buffer) * 2)
+                grown[:pending] = self._view[:pending]
+                self._view.release()
+                self._buffer = grown
+                self._view = memoryview(self._buffer)
+            else:
+                self._buffer[:pending] = self._buffer[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        self._end += self._recv_into(self._view[self._end:])
+
+    def _read_line(self):
+        while True:
+            index = self._buffer.find(b'\r\n', self._start, self._end)
+            if index >= 0:
+                line = bytes(self._buffer[self._start:index])
+                self._start = index + 2
+                return line
+            self._fill()
+
+    def _read_bulk(self, length):
+        """
+        Reads exactly `length` bytes followed by CRLF. The payload is copied
+        into a buffer allocated once at its announced size, with large
+        payloads received straight into it from the socket
+        :return: bytearray holding the payload
+        """
+        payload = bytearray(length)
+        view = memoryview(payload)
+        buffered = min(length, self._end - self._start)
+        view[:buffered] = self._view[self._start:self._start + buffered]
+        self._start += buffered
+        position = buffered
+        while position < length:
+            position += self._recv_into(view[position:])
+        view.release()
+        if self._read_line() != b'':
+            raise ProtocolError('Bulk string longer than announced length')
+        return payload
+
+    def read_reply(self):
+        """
+        Reads one complete reply
+        :return: bytes for status replies, int for integer replies,
+        bytearray for bulk strings, list for arrays, None for nil replies
+        and a ResponseError instance for error replies
+        """
+        line = self._read_line()
+        if not line:
+            raise ProtocolError('Empty reply from Redis server')
+        prefix, rest = line[:1], line[1:]
+        if prefix == b'+':
+            return rest
+        if prefix == b'-':
+            return ResponseError(rest.decode('utf-8', 'replace'))
+        if prefix == b':':
+            return int(rest)
+        if prefix == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return self._read_bulk(length)
+        if prefix == b'*':
+            count = int(rest)
+            if count < 0:
+                return None
+            return [self.read_reply() for _ in range(count)]
+        raise ProtocolError('Unknown reply type: %r' % line)
+
+
+def _encode(arg):
+    if isinstance(arg, (bytes, bytearray)):
+        return arg
+    if isinstance(arg, memoryview):
+        return arg if arg.format == 'B' and arg.ndim == 1 else arg.cast('B')
+    return str(arg).encode('utf-8')
+
+
+def build_command_buffers(*args):
+    """
+    Builds a Redis command as a RESP array of bulk strings, split into
+    buffers to send in order. Arguments of at least SCATTER_THRESHOLD bytes
+    get a buffer of their own so they are never copied, the rest is joined
+    :return: List of bytes-like objects
+    """
+    buffers = []
+    pending = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        arg = _encode(arg)
+        pending.append(b'$%d\r\n' % len(arg))
+        if len(arg) >= SCATTER_THRESHOLD:
+            buffers.append(b''.join(pending))
+            buffers.append(arg)
+            pending = [DELIMITER]
+        else:
+            pending.append(arg)
+            pending.append(DELIMITER)
+    buffers.append(b''.join(pending))
+    return buffers
+
+
+def build_command(*args):
+    """
+    Builds a Redis command as a RESP array of bulk strings
+    :return: Raw Redis command
+    """
+    return b''.join(build_command_buffers(*args))
+
+
+def join_commands(commands):
+    """
+    Joins commands built by build_command_buffers for a pipelined write.
+    Small buffers are copied together, large ones are kept as they are
+    :param commands: List of lists of buffers
+    :return: List of bytes-like objects
+    """
+    buffers = []
+    pending = []
+    for command in commands:
+        for buffer in command:
+            if len(buffer) < SCATTER_THRESHOLD:
+                pending.append(buffer)
+                continue
+            if pending:
+                buffers.append(b''.join(pending))
+                pending = []
+            buffers.append(buffer)
+    if pending:
+        buffers.append(b''.join(pending))
+    return buffers
+
+
+async def read_reply_async(stream):
+    """
+    Reads one complete reply from an asyncio StreamReader
+    :param stream: The StreamReader of the connection
+    :return: Same as RespReader.read_reply
+    """
+    try:
+        line = await stream.readuntil(DELIMITER)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError('Connection closed by Redis server')
+    prefix, rest = line[:1], line[1:-2]
+    if prefix == b'+':
+        return rest
+    if prefix == b'-':
+        return ResponseError(rest.decode('utf-8', 'replace'))
+    if prefix == b':':
+        return int(rest)
+    if prefix == b'$':
+        length = int(rest)
+        if length < 0:
+            return None
+        try:
+            payload = await stream.readexactly(length)
+            terminator = await stream.readexactly(2)
+        except asyncio.IncompleteReadError:
+            raise ProtocolError('Connection closed by Redis server')
+        if terminator != DELIMITER:
+            raise ProtocolError('Bulk string longer than announced length')
+        return payload
+    if prefix == b'*':
+        count = int(rest)
+        if count < 0:
+            return None
+        return [await read_reply_async(stream) for _ in range(count)]
+    raise ProtocolError('Unknown reply type: %r' % line)
@@ -0,0 +1,112 @@
+from backends.backend_base import BackendException
+from backends.redis.async_redis_backend import AsyncRedisBackend
+from benchmarks.redis_server import RedisStandIn
+from unittest import TestCase
+import asyncio
+import os
+import socket
+
+
+class TestAsyncRedisClient(TestCase):
+    """
+    Test cases for async_redis_backend.py, against a local Redis protocol
+    stand-in server
+    """
+    def setUp(self):
+        self.server = RedisStandIn().start()
+        self.addCleanup(self.server.stop)
+
+    def _run(self, coroutine_fn, **kwargs):
+        async def run():
+            backend = AsyncRedisBackend('127.0.0.1', self.server.port, **kwargs)
+            try:
+                return await coroutine_fn(backend)
+            finally:
+                await backend.disconnect()
+        return asyncio.run(run())
+
+    def test_get_set_delete(self):
+        """
+        Tests GET, SET, SETEX and DEL, including a large value
+        """
+        value = os.urandom(3 * 1024 * 1024) + b'\r\n'
+
+        async def scenario(backend):
+            self.assertEqual(await backend.set_cache(b'a', b'1'), b'OK')
+            self.assertEqual(
+                await backend.set_cache_and_expire(b'b', value, 60), b'OK')
+            self.assertEqual(await backend.get_cache(b'a'), b'1')
+            self.assertEqual(await backend.get_cache(b'b'), value)
+            self.assertEqual(await backend.invalidate_key(b'a'), 1)
+            self.assertIsNone(await backend.get_cache(b'a'))
+        self._run(scenario)
+
+    def test_many(self):
+        """
+        Tests MGET, pipelined SETEX and multi-key DEL
+        """
+        async def scenario(backend):
+            await backend.set_many_and_expire({b'a': b'1', b'b': b'2'}, 60)
+            self.assertEqual(await backend.get_many([b'a', b'x', b'b']),
+                             [b'1', None, b'2'])
+            self.assertEqual(await backend.invalidate_many([b'a', b'b']), 2)
+            self.assertEqual(await backend.get_many([]), [])
+        self._run(scenario)
+
+    def test_incr(self):
+        """
+        Tests INCR
+        """
+        async def scenario(backend):
+            self.assertEqual(await backend.incr(b'counter'), 1)
+            self.assertEqual(await backend.incr(b'counter'), 2)
+            self.assertEqual(await backend.get_cache(b'counter'), b'2')
+        self._run(scenario)
+
+    def test_pooling(self):
+        """
+        Tests that concurrent requests share at most max_connections
+        connections, which are kept open between requests
+        """
+        async def scenario(backend):
+            await backend.set_cache(b'key', b'value')
+            results = await asyncio.gather(
+                *[backend.get_cache(b'key') for _ in range(50)])
+            self.assertEqual(results, [b'value'] * 50)
+            self.assertLessEqual(len(backend._idle), 4)
+            idle = list(backend._idle)
+            await backend.get_cache(b'key')
+            self.assertIn(backend._idle[-1], idle)
+        self._run(scenario, max_connections=4)
+
+    def test_timeout(self):
+        """
+        Tests that a server that never replies raises after the timeout
+        """
+        silent = socket.socket()
+        silent.bind(('127.0.0.1', 0))
+        silent.listen(1)
+        self.addCleanup(silent.close)
+
+        async def scenario():
+            backend = AsyncRedisBackend(
+                '127.0.0.1', silent.getsockname()[1], timeout=0.1)
+            with self.assertRaises(BackendException):
+                await backend.get_cache(b'key')
+            self.assertEqual(backend._idle, [])
+        asyncio.run(scenario())
+
+    def test_connection_refused(self):
+        """
+        Tests that failing to connect raises a BackendException
+        """
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+        unused.close()
+
+        async def scenario():
+            backend = AsyncRedisBackend('127.0.0.1', port)
+            with self.assertRaises(BackendException):
+                await backend.get_cache(b'key')
+        asyncio.run(scenario())
@@ -0,0 +1,198 @@
+from backends.backend_base import BackendException
+from backends.redis.connection_pool import (
+    Connection, ConnectionPool, send_buffers)
+from unittest import TestCase
+from mock import Mock, patch
+import socket
+import threading
+
+
+class TestConnectionPool(TestCase):
+    """
+    Test cases for connection_pool.py
+    """
+    def setUp(self):
+        self.address = '8.8.8.8'
+        self.port = 1234
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_release_and_reuse(self, mock_sock_lib):
+        """
+        Tests that a released connection is handed out again
+        """
+        pool = ConnectionPool(self.address, self.port)
+        connection = pool.get_connection()
+        pool.release(connection)
+
+        self.assertIs(pool.get_connection(), connection)
+        self.assertEqual(mock_sock_lib.socket.call_count, 1)
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_max_connections(self, mock_sock_lib):
+        """
+        Tests that the pool blocks when exhausted and times out
+        """
+        pool = ConnectionPool(
+            self.address, self.port, max_connections=1, wait_timeout=0.01)
+        connection = pool.get_connection()
+
+        with self.assertRaises(BackendException):
+            pool.get_connection()
+
+        # A waiting caller is woken up when the connection is released
+        result = []
+        pool.wait_timeout = None
+        waiter = threading.Thread(
+            target=lambda: result.append(pool.get_connection()))
+        waiter.start()
+        pool.release(connection)
+        waiter.join(1)
+        self.assertEqual(result, [connection])
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_failed_connect_frees_slot(self, mock_sock_lib):
+        """
+        Tests that a connection which fails to connect does not leak a slot
+        """
+        mock_socket = Mock()
+        mock_sock_lib.socket.return_value = mock_socket
+        mock_socket.connect.side_effect = Exception('Connection refused')
+        pool = ConnectionPool(self.address, self.port, max_connections=1)
+
+        with self.assertRaises(Exception):
+            pool.get_connection()
+
+        mock_socket.connect.side_effect = None
+        self.assertIsNotNone(pool.get_connection())
+
+    @patch('backends.redis.connection_pool.time')
+    @patch('backends.redis.connection_pool.socket')
+    def test_idle_timeout(self, mock_sock_lib, mock_time):
+        """
+        Tests that connections idle for too long are closed, not reused
+        """
+        mock_time.time.return_value = 100
+        pool = ConnectionPool(self.address, self.port, idle_timeout=10)
+        old_socket = Mock()
+        mock_sock_lib.socket.return_value = old_socket
+        pool.release(pool.get_connection())
+
+        mock_time.time.return_value = 111
+        mock_sock_lib.socket.return_value = Mock()
+        connection = pool.get_connection()
+
+        old_socket.close.assert_called_once_with()
+        self.assertIsNot(connection.sock, old_socket)
+        self.assertEqual(pool._created, 1)
+
+    @patch('backends.redis.connection_pool.select')
+    @patch('backends.redis.connection_pool.time')
+    @patch('backends.redis.connection_pool.socket')
+    def test_health_check(self, mock_sock_lib, mock_time, mock_select):
+        """
+        Tests that connections idle past the health check interval are
+        dropped if the server closed them
+        """
+        mock_time.time.return_value = 100
+        pool = ConnectionPool(
+            self.address, self.port, health_check_interval=5)
+        old_socket = Mock()
+        mock_sock_lib.socket.return_value = old_socket
+        pool.release(pool.get_connection())
+
+        # Within the interval no check is made
+        mock_time.time.return_value = 104
+        connection = pool.get_connection()
+        self.assertEqual(mock_select.select.call_count, 0)
+        pool.release(connection)
+
+        # Past the interval a readable (closed) socket is discarded
+        mock_time.time.return_value = 110
+        mock_select.select.return_value = ([old_socket], [], [])
+        mock_sock_lib.socket.return_value = Mock()
+        connection = pool.get_connection()
+
+        old_socket.close.assert_called_once_with()
+        self.assertIsNot(connection.sock, old_socket)
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_disconnect(self, mock_sock_lib):
+        """
+        Tests that disconnect closes idle connections
+        """
+        mock_socket = Mock()
+        mock_sock_lib.socket.return_value = mock_socket
+        pool = ConnectionPool(self.address, self.port)
+        pool.release(pool.get_connection())
+
+        pool.disconnect()
+
+        mock_socket.close.assert_called_once_with()
+        self.assertEqual(pool._created, 0)
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_reset_after_fork(self, mock_sock_lib):
+        """
+        Tests that a forked child never reuses the parent's connections
+        """
+        pool = ConnectionPool(self.address, self.port, max_connections=1)
+        connection = pool.get_connection()
+        pool.release(connection)
+
+        pool._reset_after_fork()
+
+        self.assertIsNot(pool.get_connection(), connection)
+        self.assertEqual(mock_sock_lib.socket.call_count, 2)
+
+
+class TestSendBuffers(TestCase):
+    """
+    Test cases for the scatter-gather writes in connection_pool.py
+    """
+
+    def test_partial_sends(self):
+        """
+        Tests that buffers are resent from where a short write stopped
+        """
+        sent = []
+
+        def sendmsg(buffers):
+            # Writes at most 3 bytes per call
+            data = b''.join(bytes(buffer) for buffer in buffers)[:3]
+            sent.append(data)
+            return len(data)
+        mock_socket = Mock()
+        mock_socket.sendmsg.side_effect = sendmsg
+
+        send_buffers(mock_socket, [b'ab', b'', bytearray(b'cdef'),
+                                   memoryview(b'gh')])
+        self.assertEqual(sent, [b'abc', b'def', b'gh'])
+
+    def test_without_sendmsg(self):
+        """
+        Tests the fallback for sockets without sendmsg
+        """
+        mock_socket = Mock(spec=['sendall'])
+        send_buffers(mock_socket, [b'ab', b'cd'])
+        mock_socket.sendall.assert_called_once_with(b'abcd')
+
+    def test_socket(self):
+        """
+        Tests sending a large value over a real socket
+        """
+        left, right = socket.socketpair()
+        self.addCleanup(left.close)
+        self.addCleanup(right.close)
+        connection = Connection('localhost', 0)
+        connection.sock = left
+        value = bytes(range(256)) * 4096
+        received = bytearray()
+
+        def receive():
+            while len(received) < len(value) + 4:
+                received.extend(right.recv(65536))
+        thread = threading.Thread(target=receive)
+        thread.start()
+        connection.send([b'he', memoryview(value), b'ad'])
+        thread.join(10)
+        self.assertEqual(received, b'he' + value + b'ad')
@@ -1,7 +1,22 @@
-from backends.redis.redis_backend import RedisBackend
+from backends.backend_base import BackendException
+from backends.redis.redis_backend import RedisBackend, RELEASE_LOCK_SCRIPT
+from backends.redis.resp import ResponseError
+from backends.redis.test_resp import StreamConnection
+from benchmarks.redis_server import RedisStandIn
 from unittest import TestCase
 from mock import Mock, patch
-from random import randint
+import os
+import socket
+
+
+def mock_socket_with_reply(reply, chunk_size=None):
+    """
+    Builds a mock socket whose recv_into serves `reply`
+    """
+    mock_socket = Mock()
+    mock_socket.recv_into.side_effect = \
+        StreamConnection(reply, chunk_size).recv_into
+    return mock_socket
 
 
 class TestRedisClient(TestCase):
@@ -11,194 +26,409 @@ class TestRedisClient(TestCase):
     def setUp(self):
         self.address = '8.8.8.8'
         self.port = 1234
-        self.redis_client = RedisBackend(self.address, self.port)
-        self.recv_count = 0
+        self.redis_client = RedisBackend(
+            self.address, self.port, use_pool=False)
 
-    @patch('backends.redis.redis_backend.socket')
+    @patch('backends.redis.connection_pool.socket')
     def test_bad_send(self, mock_sock_lib):
         """
         Tests that an appropriate Exception is raised when sending
         to the socket fails
         """
-        key = 'something'
+        key = b'something'
         mock_socket = Mock()
         mock_sock_lib.socket.return_value = mock_socket
         mock_error_message = 'This is an error from Redis'
-        mock_socket.send.side_effect = Exception(mock_error_message)
+        mock_socket.sendall.side_effect = Exception(mock_error_message)
 
-        with self.assertRaises(Exception):
+        with self.assertRaises(BackendException):
             self.redis_client.get_cache(key)
 
-        self.assertEqual(mock_socket.recv.call_count, 0)
+        self.assertEqual(mock_socket.recv_into.call_count, 0)
         mock_socket.connect.assert_called_once_with(
             (self.address, self.port))
-        mock_socket.send.assert_called_once_with(
-            '*2\r\n$3\r\nGET\r\n$%s\r\n%s\r\n' % (len(key), key))
+        mock_socket.sendall.assert_called_once_with(
+            b'*2\r\n$3\r\nGET\r\n$%d\r\n%s\r\n' % (len(key), key))
         mock_socket.close.assert_called_once_with()
 
-    @patch('backends.redis.redis_backend.socket')
+    @patch('backends.redis.connection_pool.socket')
     def test_bad_connection(self, mock_sock_lib):
         """
         Tests that an appropriate Exception is raised when connecting to
         Redis Server fails
         """
-        key = 'something'
+        key = b'something'
         mock_socket = Mock()
         mock_sock_lib.socket.return_value = mock_socket
         mock_error_message = 'This is an error from Redis'
         mock_socket.connect.side_effect = Exception(mock_error_message)
 
-        with self.assertRaises(Exception):
+        with self.assertRaises(BackendException):
             self.redis_client.get_cache(key)
 
-        self.assertEqual(mock_socket.recv.call_count, 0)
+        self.assertEqual(mock_socket.recv_into.call_count, 0)
         mock_socket.connect.assert_called_once_with(
             (self.address, self.port))
-        self.assertEqual(mock_socket.send.call_count, 0)
+        self.assertEqual(mock_socket.sendall.call_count, 0)
         mock_socket.close.assert_called_once_with()
 
-    @patch('backends.redis.redis_backend.socket')
+    @patch('backends.redis.connection_pool.socket')
     def test_get(self, mock_sock_lib):
         """
         Tests GET
         """
-        key = 'something'
-        expected_value = 'something that was cached'
-        mock_socket = Mock()
+        key = b'something'
+        expected_value = b'something that was cached'
+        mock_socket = mock_socket_with_reply(
+            b'$%d\r\n%s\r\n' % (len(expected_value), expected_value))
         mock_sock_lib.socket.return_value = mock_socket
 
-        def socket_recv_side_effect(*args, **kwargs):
-            if self.recv_count == 0:
-                self.recv_count += 1
-                return '\r\n%s' % expected_value
-            else:
-                return ""
-        mock_socket.recv.side_effect = socket_recv_side_effect
-
         cache_response = self.redis_client.get_cache(key)
 
         self.assertEqual(expected_value, cache_response)
-        mock_socket.recv.assert_called_with(self.redis_client.RECV_SIZE)
-        self.assertEqual(mock_socket.recv.call_count, 1)
         mock_socket.connect.assert_called_once_with(
             (self.address, self.port))
-        mock_socket.send.assert_called_once_with(
-            '*2\r\n$3\r\nGET\r\n$%s\r\n%s\r\n' % (len(key), key))
+        mock_socket.sendall.assert_called_once_with(
+            b'*2\r\n$3\r\nGET\r\n$%d\r\n%s\r\n' % (len(key), key))
         mock_socket.close.assert_called_once_with()
 
-    @patch('backends.redis.redis_backend.socket')
+    @patch('backends.redis.connection_pool.socket')
+    def test_get_miss(self, mock_sock_lib):
+        """
+        Tests that a nil reply to GET is a cache miss
+        """
+        mock_sock_lib.socket.return_value = mock_socket_with_reply(b'$-1\r\n')
+
+        self.assertIsNone(self.redis_client.get_cache(b'something'))
+
+    @patch('backends.redis.connection_pool.socket')
     def test_get_large_response(self, mock_sock_lib):
         """
         Tests that the full large response is received from Redis
         """
-        key = 'something'
-        expected_value = 'something that was cached'
-        mock_socket = Mock()
+        key = b'something'
+        expected_value = os.urandom(3 * 1024 * 1024) + b'\r\n' + b'tail'
+        mock_socket = mock_socket_with_reply(
+            b'$%d\r\n%s\r\n' % (len(expected_value), expected_value),
+            chunk_size=2048)
         mock_sock_lib.socket.return_value = mock_socket
-        iterations = randint(10, 20)
 
-        def socket_recv_side_effect(*args, **kwargs):
-            if self.recv_count != iterations - 1:
-                self.recv_count += 1
-                return '\r\n%s' % (expected_value * 100)
-            else:
-                return ""
-
-        mock_socket.recv.side_effect = socket_recv_side_effect
         cache_response = self.redis_client.get_cache(key)
 
-        # self.assertEqual(expected_value, cache_response)
-        mock_socket.recv.assert_called_with(self.redis_client.RECV_SIZE)
-        self.assertEqual(mock_socket.recv.call_count, iterations)
+        self.assertEqual(expected_value, cache_response)
         mock_socket.connect.assert_called_once_with(
             (self.address, self.port))
-        mock_socket.send.assert_called_once_with(
-            '*2\r\n$3\r\nGET\r\n$%s\r\n%s\r\n' % (len(key), key))
+        mock_socket.sendall.assert_called_once_with(
+            b'*2\r\n$3\r\nGET\r\n$%d\r\n%s\r\n' % (len(key), key))
         mock_socket.close.assert_called_once_with()
 
-    @patch('backends.redis.redis_backend.socket')
+    @patch('backends.redis.connection_pool.socket')
+    def test_error_reply(self, mock_sock_lib):
+        """
+        Tests that an error reply raises a BackendException
+        """
+        mock_sock_lib.socket.return_value = mock_socket_with_reply(
+            b'-WRONGTYPE Operation against a key\r\n')
+
+        with self.assertRaises(ResponseError):
+            self.redis_client.get_cache(b'something')
+
+    @patch('backends.redis.connection_pool.socket')
     def test_set(self, mock_sock_lib):
         """
         Tests SET
         """
-        key = 'something'
-        value = 'something_else'
-        mock_socket = Mock()
+        key = b'something'
+        value = b'something_else'
+        mock_socket = mock_socket_with_reply(b'+OK\r\n')
         mock_sock_lib.socket.return_value = mock_socket
 
-        def socket_recv_side_effect(*args, **kwargs):
-            if self.recv_count == 0:
-                self.recv_count += 1
-                return '+OK\r\n'
-            else:
-                return ""
-        mock_socket.recv.side_effect = socket_recv_side_effect
-
         cache_response = self.redis_client.set_cache(key, value)
-        self.assertEqual(cache_response, '+OK')
+        self.assertEqual(cache_response, b'OK')
 
-        mock_socket.recv.assert_called_with(self.redis_client.RECV_SIZE)
-        self.assertEqual(mock_socket.recv.call_count, 1)
         mock_socket.connect.assert_called_once_with(
             (self.address, self.port))
-        mock_socket.send.assert_called_once_with(
-            '*3\r\n$3\r\nSET\r\n$%s\r\n%s\r\n$%s\r\n%s\r\n' %
+        mock_socket.sendall.assert_called_once_with(
+            b'*3\r\n$3\r\nSET\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n' %
             (len(key), key, len(value), value))
         mock_socket.close.assert_called_once_with()
 
-    @patch('backends.redis.redis_backend.socket')
+    @patch('backends.redis.connection_pool.socket')
     def test_delete(self, mock_sock_lib):
         """
         Tests DELETE
         """
-        key = 'something'
-        value = 'something_else'
-        mock_socket = Mock()
+        key = b'something'
+        mock_socket = mock_socket_with_reply(b':1\r\n')
         mock_sock_lib.socket.return_value = mock_socket
 
-        mock_socket.recv.return_value = ':%s\r\n' % value
-
         cache_response = self.redis_client.invalidate_key(key)
-        self.assertEqual(cache_response, ':%s' % value)
+        self.assertEqual(cache_response, 1)
 
-        mock_socket.recv.assert_called_with(self.redis_client.RECV_SIZE)
-        self.assertEqual(mock_socket.recv.call_count, 1)
         mock_socket.connect.assert_called_once_with(
             (self.address, self.port))
-        mock_socket.send.assert_called_once_with(
-            '*2\r\n$3\r\nDEL\r\n$9\r\n%s\r\n' % key)
+        mock_socket.sendall.assert_called_once_with(
+            b'*2\r\n$3\r\nDEL\r\n$9\r\n%s\r\n' % key)
         mock_socket.close.assert_called_once_with()
 
-    @patch('backends.redis.redis_backend.socket')
+    @patch('backends.redis.connection_pool.socket')
+    def test_incr(self, mock_sock_lib):
+        """
+        Tests INCR
+        """
+        mock_socket = mock_socket_with_reply(b':3\r\n')
+        mock_sock_lib.socket.return_value = mock_socket
+
+        self.assertEqual(self.redis_client.incr(b'counter'), 3)
+        mock_socket.sendall.assert_called_once_with(
+            b'*2\r\n$4\r\nINCR\r\n$7\r\ncounter\r\n')
+
+    @patch('backends.redis.connection_pool.socket')
     def test_setex(self, mock_sock_lib):
         """
         Tests SETEX
         """
-        key = 'something'
-        value = 'something_else'
+        key = b'something'
+        value = b'something_else'
         expiration = 100
-        mock_socket = Mock()
+        mock_socket = mock_socket_with_reply(b'+OK\r\n')
         mock_sock_lib.socket.return_value = mock_socket
 
-        def socket_recv_side_effect(*args, **kwargs):
-            if self.recv_count == 0:
-                self.recv_count += 1
-                return '+OK\r\n'
-            else:
-                return ""
-        mock_socket.recv.side_effect = socket_recv_side_effect
-
-        cache_response = self.redis_client.set_cache_and_expire(key, value, expiration)
-        self.assertEqual(cache_response, '+OK')
+        cache_response = self.redis_client.set_cache_and_expire(
+            key, value, expiration)
+        self.assertEqual(cache_response, b'OK')
 
-        mock_socket.recv.assert_called_with(self.redis_client.RECV_SIZE)
-        self.assertEqual(mock_socket.recv.call_count, 1)
         mock_socket.connect.assert_called_once_with(
             (self.address, self.port))
 
         expected_raw = \
-            '*4\r\n$5\r\nSETEX\r\n$%s\r\n%s\r\n$%s\r\n%s\r\n$%s\r\n%s\r\n' \
+            b'*4\r\n$5\r\nSETEX\r\n$%d\r\n%s\r\n$%d\r\n%d\r\n$%d\r\n%s\r\n' \
             % (len(key), key, len(str(expiration)),
                expiration, len(value), value)
-        mock_socket.send.assert_called_once_with(expected_raw)
+        mock_socket.sendall.assert_called_once_with(expected_raw)
+        mock_socket.close.assert_called_once_with()
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_get_many(self, mock_sock_lib):
+        """
+        Tests MGET
+        """
+        mock_socket = mock_socket_with_reply(
+            b'*3\r\n$1\r\na\r\n$-1\r\n$1\r\nc\r\n')
+        mock_sock_lib.socket.return_value = mock_socket
+
+        cache_response = self.redis_client.get_many([b'k1', b'k2', b'k3'])
+
+        self.assertEqual(cache_response, [b'a', None, b'c'])
+        mock_socket.sendall.assert_called_once_with(
+            b'*4\r\n$4\r\nMGET\r\n$2\r\nk1\r\n$2\r\nk2\r\n$2\r\nk3\r\n')
+        self.assertEqual(self.redis_client.get_many([]), [])
+        self.assertEqual(mock_sock_lib.socket.call_count, 1)
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_set_many_and_expire(self, mock_sock_lib):
+        """
+        Tests that SETEX commands are pipelined in a single write
+        """
+        mock_socket = mock_socket_with_reply(b'+OK\r\n+OK\r\n')
+        mock_sock_lib.socket.return_value = mock_socket
+        mapping = {b'k1': b'v1', b'k2': b'v2'}
+
+        cache_response = self.redis_client.set_many_and_expire(mapping, 10)
+
+        self.assertEqual(cache_response, [b'OK', b'OK'])
+        mock_socket.sendall.assert_called_once_with(b''.join(
+            b''.join(self.redis_client._build_command(
+                'SETEX', key, 10, value))
+            for key, value in mapping.items()))
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_set_many_and_expire_error(self, mock_sock_lib):
+        """
+        Tests that an error reply inside a pipeline raises once all the
+        replies have been read
+        """
+        mock_sock_lib.socket.return_value = mock_socket_with_reply(
+            b'+OK\r\n-ERR invalid expire time\r\n')
+
+        with self.assertRaises(ResponseError):
+            self.redis_client.set_many_and_expire(
+                {b'k1': b'v1', b'k2': b'v2'}, 10)
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_invalidate_many(self, mock_sock_lib):
+        """
+        Tests multi-key DEL
+        """
+        mock_socket = mock_socket_with_reply(b':2\r\n')
+        mock_sock_lib.socket.return_value = mock_socket
+
+        self.assertEqual(self.redis_client.invalidate_many([b'a', b'b']), 2)
+        mock_socket.sendall.assert_called_once_with(
+            b'*3\r\n$3\r\nDEL\r\n$1\r\na\r\n$1\r\nb\r\n')
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_acquire_lock(self, mock_sock_lib):
+        """
+        Tests SET NX PX for locks
+        """
+        mock_socket = mock_socket_with_reply(b'+OK\r\n')
+        mock_sock_lib.socket.side_effect = [
+            mock_socket, mock_socket_with_reply(b'$-1\r\n')]
+
+        token = self.redis_client.acquire_lock(b'lock', 1.5)
+
+        self.assertIsNotNone(token)
+        mock_socket.sendall.assert_called_once_with(b''.join(
+            self.redis_client._build_command(
+                'SET', b'lock', token, 'NX', 'PX', 1500)))
+        self.assertIsNone(self.redis_client.acquire_lock(b'lock', 1.5))
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_release_lock(self, mock_sock_lib):
+        """
+        Tests that releasing a lock checks its token server side
+        """
+        mock_socket = mock_socket_with_reply(b':1\r\n')
+        mock_sock_lib.socket.return_value = mock_socket
+
+        self.assertEqual(self.redis_client.release_lock(b'lock', b'token'), 1)
+        mock_socket.sendall.assert_called_once_with(b''.join(
+            self.redis_client._build_command(
+                'EVAL', RELEASE_LOCK_SCRIPT, 1, b'lock', b'token')))
+
+
+class TestPooledRedisClient(TestCase):
+    """
+    Test cases for redis_backend.py with connection pooling enabled
+    """
+    def setUp(self):
+        self.address = '8.8.8.8'
+        self.port = 1234
+        self.redis_client = RedisBackend(self.address, self.port)
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_connection_reused(self, mock_sock_lib):
+        """
+        Tests that consecutive requests share a single socket
+        """
+        mock_socket = mock_socket_with_reply(b'+OK\r\n' * 5)
+        mock_sock_lib.socket.return_value = mock_socket
+
+        for _ in range(5):
+            self.redis_client.set_cache(b'key', b'value')
+
+        self.assertEqual(mock_sock_lib.socket.call_count, 1)
+        mock_socket.connect.assert_called_once_with(
+            (self.address, self.port))
+        self.assertEqual(mock_socket.sendall.call_count, 5)
+        self.assertEqual(mock_socket.close.call_count, 0)
+
+        self.redis_client.disconnect()
+        mock_socket.close.assert_called_once_with()
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_error_reply_keeps_connection(self, mock_sock_lib):
+        """
+        Tests that an error reply does not discard the pooled connection
+        """
+        mock_socket = mock_socket_with_reply(b'-ERR bad\r\n+OK\r\n')
+        mock_sock_lib.socket.return_value = mock_socket
+
+        with self.assertRaises(ResponseError):
+            self.redis_client.set_cache(b'key', b'value')
+        self.assertEqual(self.redis_client.set_cache(b'key', b'value'), b'OK')
+        self.assertEqual(mock_sock_lib.socket.call_count, 1)
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_reconnect_on_stale_connection(self, mock_sock_lib):
+        """
+        Tests that a pooled connection dropped by the server is replaced and
+        the request retried once
+        """
+        stale_socket = mock_socket_with_reply(b'+OK\r\n')
+        fresh_socket = mock_socket_with_reply(b'+OK\r\n')
+        mock_sock_lib.socket.side_effect = [stale_socket, fresh_socket]
+
+        self.redis_client.set_cache(b'key', b'value')
+        stale_socket.sendall.side_effect = Exception('Connection reset')
+        cache_response = self.redis_client.set_cache(b'key', b'value')
+
+        self.assertEqual(cache_response, b'OK')
+        stale_socket.close.assert_called_once_with()
+        fresh_socket.sendall.assert_called_once_with(b''.join(
+            self.redis_client._build_command('SET', b'key', b'value')))
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_no_retry_on_new_connection(self, mock_sock_lib):
+        """
+        Tests that a failure on a freshly opened connection is not retried
+        """
+        mock_socket = Mock()
+        mock_sock_lib.socket.return_value = mock_socket
+        mock_socket.sendall.side_effect = Exception('Connection reset')
+
+        with self.assertRaises(BackendException):
+            self.redis_client.get_cache(b'key')
+
+        self.assertEqual(mock_sock_lib.socket.call_count, 1)
         mock_socket.close.assert_called_once_with()
+        self.assertEqual(self.redis_client.pool._created, 0)
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_timeouts(self, mock_sock_lib):
+        """
+        Tests that the connect timeout applies to connecting and the
+        timeout to the requests after it
+        """
+        redis_client = RedisBackend(self.address, self.port,
+                                    connect_timeout=0.5, timeout=0.1)
+        mock_socket = mock_socket_with_reply(b'+OK\r\n')
+        mock_sock_lib.socket.return_value = mock_socket
+
+        redis_client.set_cache(b'key', b'value')
+
+        self.assertEqual(
+            [call[0][0] for call in mock_socket.settimeout.call_args_list],
+            [0.5, 0.1])
+
+    @patch('backends.redis.connection_pool.socket')
+    def test_no_retry_on_timeout(self, mock_sock_lib):
+        """
+        Tests that a request timing out on a reused connection is not
+        retried
+        """
+        mock_socket = mock_socket_with_reply(b'+OK\r\n')
+        mock_sock_lib.socket.return_value = mock_socket
+
+        self.redis_client.set_cache(b'key', b'value')
+        mock_socket.recv_into.side_effect = socket.timeout('timed out')
+        with self.assertRaises(BackendException):
+            self.redis_client.get_cache(b'key')
+
+        self.assertEqual(mock_sock_lib.socket.call_count, 1)
+        self.assertEqual(mock_socket.sendall.call_count, 2)
+
+
+class TestRedisServer(TestCase):
+    """
+    Test cases for redis_backend.py against a local Redis protocol stand-in
+    server
+    """
+    def setUp(self):
+        self.server = RedisStandIn().start()
+        self.addCleanup(self.server.stop)
+        self.redis_client = RedisBackend('127.0.0.1', self.server.port)
+        self.addCleanup(self.redis_client.disconnect)
+
+    def test_large_values(self):
+        """
+        Tests that large bytes-like values are written and read back
+        """
+        value = os.urandom(3 * 1024 * 1024)
+        self.assertEqual(self.redis_client.set_cache_and_expire(
+            b'a', memoryview(value), 60), b'OK')
+        self.redis_client.set_many_and_expire(
+            {b'b': bytearray(value), b'c': b'small'}, 60)
+        self.assertEqual(self.redis_client.get_many([b'a', b'b', b'c']),
+                         [value, value, b'small'])
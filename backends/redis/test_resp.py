@@ -0,0 +1,221 @@
+from backends.redis.resp import (
+    RespReader, ResponseError, ProtocolError, SCATTER_THRESHOLD, build_command,
+    build_command_buffers, join_commands, read_reply_async)
+from unittest import TestCase
+import asyncio
+import os
+import pickle
+
+
+class StreamConnection(object):
+    """
+    Connection stand-in that serves a byte stream in chunks of at most
+    `chunk_size` bytes per recv_into call
+    """
+    def __init__(self, data, chunk_size=None):
+        self.data = data
+        self.position = 0
+        self.chunk_size = chunk_size
+        self.recv_count = 0
+
+    def recv_into(self, buffer):
+        self.recv_count += 1
+        size = len(buffer)
+        if self.chunk_size is not None:
+            size = min(size, self.chunk_size)
+        chunk = self.data[self.position:self.position + size]
+        buffer[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+
+class TestRespReader(TestCase):
+    """
+    Test cases for resp.py
+    """
+
+    def _reader(self, data, chunk_size=None, buffer_size=64):
+        return RespReader(StreamConnection(data, chunk_size), buffer_size)
+
+    def test_simple_types(self):
+        """
+        Tests status, integer and error replies
+        """
+        reader = self._reader(b'+OK\r\n:42\r\n:-1\r\n-ERR wrong type\r\n')
+        self.assertEqual(reader.read_reply(), b'OK')
+        self.assertEqual(reader.read_reply(), 42)
+        self.assertEqual(reader.read_reply(), -1)
+        error = reader.read_reply()
+        self.assertIsInstance(error, ResponseError)
+        self.assertEqual(str(error), 'ERR wrong type')
+
+    def test_nil(self):
+        """
+        Tests that nil bulk strings and arrays are None, unlike empty ones
+        """
+        reader = self._reader(b'$-1\r\n*-1\r\n$0\r\n\r\n*0\r\n')
+        self.assertIsNone(reader.read_reply())
+        self.assertIsNone(reader.read_reply())
+        self.assertEqual(reader.read_reply(), b'')
+        self.assertEqual(reader.read_reply(), [])
+
+    def test_bulk_with_crlf(self):
+        """
+        Tests that bulk strings containing CRLF are read by length
+        """
+        value = b'line one\r\nline two\r\n$3\r\n'
+        reader = self._reader(b'$%d\r\n%s\r\n+OK\r\n' % (len(value), value))
+        self.assertEqual(reader.read_reply(), value)
+        self.assertEqual(reader.read_reply(), b'OK')
+
+    def test_array(self):
+        """
+        Tests nested arrays mixing types
+        """
+        reader = self._reader(b'*3\r\n$3\r\nfoo\r\n$-1\r\n*1\r\n:7\r\n')
+        self.assertEqual(reader.read_reply(), [b'foo', None, [7]])
+
+    def test_byte_at_a_time(self):
+        """
+        Tests replies split at every possible boundary
+        """
+        data = b'*2\r\n$5\r\nhello\r\n:12\r\n+PONG\r\n'
+        reader = self._reader(data, chunk_size=1, buffer_size=4)
+        self.assertEqual(reader.read_reply(), [b'hello', 12])
+        self.assertEqual(reader.read_reply(), b'PONG')
+
+    def test_long_status_line(self):
+        """
+        Tests that lines longer than the buffer grow it
+        """
+        status = b'x' * 1000
+        reader = self._reader(b'+%s\r\n' % status, chunk_size=7, buffer_size=8)
+        self.assertEqual(reader.read_reply(), status)
+
+    def test_multi_megabyte_value(self):
+        """
+        Tests that multi-megabyte pickled values arrive intact and are read
+        with a bounded number of recv calls
+        """
+        value = pickle.dumps([os.urandom(1024) for _ in range(5 * 1024)])
+        connection = StreamConnection(
+            b'$%d\r\n%s\r\n$%d\r\n%s\r\n' % (len(value), value,
+                                            len(value), value),
+            chunk_size=64 * 1024)
+        reader = RespReader(connection)
+
+        for _ in range(2):
+            reply = reader.read_reply()
+            self.assertEqual(len(reply), len(value))
+            self.assertEqual(pickle.loads(reply), pickle.loads(value))
+        self.assertLess(connection.recv_count, 2 * len(value) // (64 * 1024) + 8)
+
+    def test_truncated_reply(self):
+        """
+        Tests that a connection closed mid-reply is a protocol error
+        """
+        reader = self._reader(b'$10\r\nabc')
+        with self.assertRaises(ProtocolError):
+            reader.read_reply()
+
+    def test_bad_length(self):
+        """
+        Tests that a bulk string longer than announced is rejected
+        """
+        reader = self._reader(b'$2\r\nabc\r\n')
+        with self.assertRaises(ProtocolError):
+            reader.read_reply()
+
+    def test_unknown_type(self):
+        """
+        Tests that unknown reply types are rejected
+        """
+        reader = self._reader(b'?what\r\n')
+        with self.assertRaises(ProtocolError):
+            reader.read_reply()
+
+
+class TestReadReplyAsync(TestCase):
+    """
+    Test cases for read_reply_async in resp.py
+    """
+
+    def _read_all(self, data, count):
+        async def read():
+            stream = asyncio.StreamReader()
+            stream.feed_data(data)
+            stream.feed_eof()
+            return [await read_reply_async(stream) for _ in range(count)]
+        return asyncio.run(read())
+
+    def test_types(self):
+        """
+        Tests every reply type
+        """
+        value = b'with\r\ncrlf'
+        replies = self._read_all(
+            b'+OK\r\n:5\r\n$-1\r\n$%d\r\n%s\r\n*2\r\n$1\r\na\r\n*-1\r\n'
+            b'-ERR bad\r\n' % (len(value), value), 6)
+
+        self.assertEqual(replies[:5], [b'OK', 5, None, value, [b'a', None]])
+        self.assertIsInstance(replies[5], ResponseError)
+
+    def test_multi_megabyte_value(self):
+        """
+        Tests that multi-megabyte values arrive intact
+        """
+        value = os.urandom(4 * 1024 * 1024)
+        self.assertEqual(
+            self._read_all(b'$%d\r\n%s\r\n' % (len(value), value), 1),
+            [value])
+
+    def test_truncated_reply(self):
+        """
+        Tests that a connection closed mid-reply is a protocol error
+        """
+        with self.assertRaises(ProtocolError):
+            self._read_all(b'$10\r\nabc', 1)
+        with self.assertRaises(ProtocolError):
+            self._read_all(b'+OK', 1)
+
+
+class TestBuildCommand(TestCase):
+    """
+    Test cases for build_command in resp.py
+    """
+
+    def test_build_command(self):
+        """
+        Tests encoding of text, bytes and numbers
+        """
+        self.assertEqual(build_command('SETEX', b'key', 10, 'caf\xe9'),
+                         b'*4\r\n$5\r\nSETEX\r\n$3\r\nkey\r\n$2\r\n10\r\n'
+                         b'$5\r\ncaf\xc3\xa9\r\n')
+
+    def test_large_arguments(self):
+        """
+        Tests that large arguments are passed through by reference, and
+        memoryviews are encoded by their bytes
+        """
+        value = os.urandom(SCATTER_THRESHOLD)
+        buffers = build_command_buffers('SET', b'key', value)
+        self.assertEqual(len(buffers), 3)
+        self.assertIs(buffers[1], value)
+        self.assertEqual(b''.join(buffers), build_command(
+            'SET', b'key', memoryview(value)))
+        self.assertEqual(build_command(memoryview(b'ab').cast('B', (1, 2))),
+                         b'*1\r\n$2\r\nab\r\n')
+
+    def test_join_commands(self):
+        """
+        Tests that pipelined commands are joined around large buffers
+        """
+        value = os.urandom(SCATTER_THRESHOLD)
+        commands = [build_command_buffers('SET', b'a', value),
+                    build_command_buffers('SET', b'b', b'1'),
+                    build_command_buffers('SET', b'c', b'2')]
+        buffers = join_commands(commands)
+        self.assertEqual(len(buffers), 3)
+        self.assertIs(buffers[1], value)
+        self.assertEqual(b''.join(buffers), b''.join(
+            b''.join(command) for command in commands))
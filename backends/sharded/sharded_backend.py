@@ -0,0 +1,316 @@
+from backends.backend_base import Backend, BackendException
+from backends.forking import after_fork
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import threading
+import time
+
+# Points each shard gets on the hash ring. More points spread keys more
+# evenly at the cost of a larger ring
+DEFAULT_REPLICAS = 160
+# Seconds a failed shard is bypassed before it is tried again
+DEFAULT_RETRY_INTERVAL = 30
+
+
+def _hash(value):
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    return int.from_bytes(
+        hashlib.blake2b(value, digest_size=8).digest(), 'big')
+
+
+class ShardDownError(BackendException):
+    """
+    Raised instead of sending an operation that can't fail over to the down
+    shard owning its key
+    """
+
+    def __init__(self, shard):
+        super(ShardDownError, self).__init__('Shard %s is down' % shard)
+        self.shard = shard
+
+
+class ShardedBackend(Backend):
+    """
+    Spreads keys over several backends with consistent hashing. Adding or
+    removing a shard only moves the keys it gains or loses. A shard that
+    fails is marked down for retry_interval seconds. Meanwhile reads and
+    writes with a TTL go to the next shard on the ring, while invalidations,
+    counters, locks and writes without a TTL raise ShardDownError, since
+    the owner would serve the old value again once it is back
+    """
+
+    def __init__(self, shards, replicas=DEFAULT_REPLICAS,
+                 retry_interval=DEFAULT_RETRY_INTERVAL, max_workers=None):
+        """
+        :param shards: Dictionary of shard name to Backend, or a list of
+        Backend named shard-0, shard-1... Keys are placed by shard name, so
+        names must stay the same across restarts and hosts
+        :param replicas: Points per shard on the hash ring
+        :param retry_interval: Seconds a failed shard is bypassed
+        :param max_workers: Threads used to run batched operations on
+        several shards at once, defaults to one per shard
+        """
+        super(ShardedBackend, self).__init__()
+        self.replicas = replicas
+        self.retry_interval = retry_interval
+        self.max_workers = max_workers
+        self.shards = {}
+        self._down_until = {}
+        self._points = ()
+        self._owners = ()
+        self._reset_after_fork()
+        after_fork(self, ShardedBackend._reset_after_fork)
+        if not isinstance(shards, dict):
+            shards = dict(('shard-%d' % index, backend)
+                          for index, backend in enumerate(shards))
+        self.shards.update(shards)
+        self._build_ring()
+
+    def _reset_after_fork(self):
+        # Worker threads don't survive a fork, the pool is started again
+        # when needed
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _build_ring(self):
+        ring = sorted((_hash('%s#%d' % (name, replica)), name)
+                      for name in self.shards
+                      for replica in range(self.replicas))
+        # Swapped in together so readers never see a half built ring
+        self._points, self._owners = (
+            tuple(point for point, _ in ring),
+            tuple(name for _, name in ring))
+
+    def add_shard(self, name, backend):
+        """
+        Adds a shard, which takes over roughly 1/N of the keys
+        :param name: Unique and stable name of the shard
+        :param backend: The shard's Backend
+        """
+        with self._lock:
+            self.shards[name] = backend
+            self._build_ring()
+
+    def remove_shard(self, name):
+        """
+        Removes a shard, its keys move to the next shards on the ring
+        :param name: Name of the shard
+        """
+        with self._lock:
+            del self.shards[name]
+            self._down_until.pop(name, None)
+            self._build_ring()
+
+    def shard_for(self, key, failover=True):
+        """
+        :param key: The cache key
+        :param failover: Whether the key goes to the next live shard on the
+        ring while its owner is down
+        :return: Name of the live shard owning the key
+        :raises ShardDownError: Without failover, if the owner is down
+        """
+        points, owners = self._points, self._owners
+        if not points:
+            raise BackendException('ShardedBackend has no shards')
+        start = bisect(points, _hash(key))
+        down_until = self._down_until
+        if not down_until:
+            return owners[start % len(owners)]
+        now = time.monotonic()
+        if not failover:
+            name = owners[start % len(owners)]
+            if down_until.get(name, 0) > now:
+                raise ShardDownError(name)
+            return name
+        for offset in range(len(owners)):
+            name = owners[(start + offset) % len(owners)]
+            if down_until.get(name, 0) <= now:
+                return name
+        raise BackendException('Every shard is down')
+
+    def mark_down(self, name):
+        """
+        Bypasses a shard for retry_interval seconds
+        :param name: Name of the shard
+        """
+        with self._lock:
+            if name in self.shards:
+                self._down_until[name] = \
+                    time.monotonic() + self.retry_interval
+
+    def down_shards(self):
+        """
+        :return: Names of the shards currently bypassed
+        """
+        now = time.monotonic()
+        with self._lock:
+            for name, until in list(self._down_until.items()):
+                if until <= now:
+                    del self._down_until[name]
+            return sorted(self._down_until)
+
+    def _call(self, key, method, args=(), failover=True):
+        name = self.shard_for(key, failover)
+        try:
+            return getattr(self.shards[name], method)(key, *args)
+        except BackendException:
+            self.mark_down(name)
+            raise
+
+    def _group(self, keys):
+        """
+        :return: Dictionary of shard name to the keys it owns
+        """
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.shard_for(key), []).append(key)
+        return groups
+
+    def _fan_out(self, groups, operation):
+        """
+        Runs operation(backend, keys) for every shard, in parallel when
+        several shards are involved. Failed shards are marked down
+        :param groups: Dictionary of shard name to keys
+        :return: (dictionary of shard name to result, names of failed
+        shards)
+        """
+        if len(groups) <= 1:
+            futures = None
+        else:
+            if self._executor is None:
+                with self._lock:
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.max_workers or
+                            max(len(self.shards), 1))
+            futures = dict(
+                (name, self._executor.submit(
+                    operation, self.shards[name], keys))
+                for name, keys in groups.items())
+        results = {}
+        failed = []
+        for name, keys in groups.items():
+            try:
+                if futures is None:
+                    results[name] = operation(self.shards[name], keys)
+                else:
+                    results[name] = futures[name].result()
+            except BackendException:
+                self.mark_down(name)
+                failed.append(name)
+        return results, failed
+
+    def get_cache(self, key):
+        return self._call(key, 'get_cache')
+
+    def set_cache(self, key, value):
+        return self._call(key, 'set_cache', (value,), failover=False)
+
+    def set_cache_and_expire(self, key, value, expiration):
+        return self._call(key, 'set_cache_and_expire', (value, expiration))
+
+    def invalidate_key(self, key):
+        return self._call(key, 'invalidate_key', failover=False)
+
+    def get_many(self, keys):
+        """
+        Gets keys from every shard in parallel. Keys of a shard that fails
+        are returned as misses
+        :param keys: The cache keys to get
+        :return: List of values in the order of keys, with None for misses
+        """
+        results, _ = self._fan_out(
+            self._group(keys),
+            lambda backend, shard_keys: dict(
+                zip(shard_keys, backend.get_many(shard_keys))))
+        found = {}
+        for values in results.values():
+            found.update(values)
+        return [found.get(key) for key in keys]
+
+    def set_many_and_expire(self, mapping, expiration):
+        """
+        Sets keys on every shard in parallel
+        :param mapping: Dictionary of cache keys to cache values
+        :param expiration: The time to live (ttl) in seconds
+        :raises BackendException: If a shard failed, once the others are
+        written
+        """
+        _, failed = self._fan_out(
+            self._group(mapping),
+            lambda backend, shard_keys: backend.set_many_and_expire(
+                dict((key, mapping[key]) for key in shard_keys),
+                expiration))
+        if failed:
+            raise BackendException(
+                'Unable to write to shards %s' % ', '.join(map(str, failed)))
+
+    def _owner_groups(self, keys):
+        """
+        :return: (dictionary of live shard name to the keys it owns, names
+        of the down shards owning some of the keys)
+        """
+        groups = {}
+        down = []
+        for key in keys:
+            try:
+                name = self.shard_for(key, failover=False)
+            except ShardDownError as e:
+                if e.shard not in down:
+                    down.append(e.shard)
+                continue
+            groups.setdefault(name, []).append(key)
+        return groups, down
+
+    def get_counters(self, keys):
+        """
+        Reads counters from their owners, without failing over: another
+        shard would answer a miss, read as 0, for a counter it doesn't hold
+        :param keys: The counter keys
+        :return: List of values in the order of keys
+        :raises BackendException: If the owner of a counter failed or is
+        down
+        """
+        groups, down = self._owner_groups(keys)
+        if down:
+            raise ShardDownError(down[0])
+        results, failed = self._fan_out(
+            groups,
+            lambda backend, shard_keys: dict(
+                zip(shard_keys, backend.get_counters(shard_keys))))
+        if failed:
+            raise BackendException(
+                'Unable to read counters on shards %s' %
+                ', '.join(map(str, failed)))
+        found = {}
+        for values in results.values():
+            found.update(values)
+        return [found.get(key) for key in keys]
+
+    def invalidate_many(self, keys):
+        """
+        Removes keys from every shard in parallel
+        :param keys: The cache keys
+        :raises BackendException: If a shard failed or is down, once the
+        others are done
+        """
+        groups, down = self._owner_groups(keys)
+        _, failed = self._fan_out(
+            groups,
+            lambda backend, shard_keys: backend.invalidate_many(shard_keys))
+        failed.extend(down)
+        if failed:
+            raise BackendException(
+                'Unable to invalidate on shards %s' %
+                ', '.join(map(str, failed)))
+
+    def incr(self, key):
+        return self._call(key, 'incr', failover=False)
+
+    def acquire_lock(self, key, timeout):
+        return self._call(key, 'acquire_lock', (timeout,), failover=False)
+
+    def release_lock(self, key, token):
+        return self._call(key, 'release_lock', (token,), failover=False)
@@ -0,0 +1,212 @@
+from backends.backend_base import BackendException
+from backends.memory.memory_backend import MemoryBackend
+from backends.sharded.sharded_backend import ShardDownError, ShardedBackend
+from unittest import TestCase
+from mock import patch
+import threading
+
+
+class FailingBackend(MemoryBackend):
+    """
+    MemoryBackend that raises BackendException while failing is set
+    """
+
+    def __init__(self):
+        super(FailingBackend, self).__init__()
+        self.failing = False
+
+    def _check(self):
+        if self.failing:
+            raise BackendException('down')
+
+    def get_cache(self, key):
+        self._check()
+        return super(FailingBackend, self).get_cache(key)
+
+    def set_cache(self, key, value):
+        self._check()
+        return super(FailingBackend, self).set_cache(key, value)
+
+    def get_many(self, keys):
+        self._check()
+        return super(FailingBackend, self).get_many(keys)
+
+    def set_many_and_expire(self, mapping, expiration):
+        self._check()
+        return super(FailingBackend, self).set_many_and_expire(
+            mapping, expiration)
+
+
+class TestShardedBackend(TestCase):
+    """
+    Test cases for sharded_backend.py
+    """
+    def setUp(self):
+        self.shards = dict(('node-%d' % index, FailingBackend())
+                           for index in range(4))
+        self.backend = ShardedBackend(self.shards)
+
+    def test_routing(self):
+        """
+        Tests that keys are stored on a single shard and spread evenly
+        """
+        for i in range(4000):
+            self.backend.set_cache('key-%d' % i, b'value')
+        for i in range(4000):
+            self.assertEqual(self.backend.get_cache('key-%d' % i), b'value')
+        counts = [len(shard) for shard in self.shards.values()]
+        self.assertEqual(sum(counts), 4000)
+        for count in counts:
+            self.assertGreater(count, 700)
+            self.assertLess(count, 1300)
+
+        self.assertEqual(self.backend.invalidate_key('key-0'), 1)
+        self.assertIsNone(self.backend.get_cache('key-0'))
+
+    def test_list_of_shards(self):
+        """
+        Tests that shards given as a list are named by position
+        """
+        backend = ShardedBackend([MemoryBackend(), MemoryBackend()])
+        self.assertEqual(sorted(backend.shards), ['shard-0', 'shard-1'])
+
+    def test_add_shard(self):
+        """
+        Tests that a new shard only takes keys, about 1/N of them
+        """
+        keys = ['key-%d' % i for i in range(5000)]
+        before = dict((key, self.backend.shard_for(key)) for key in keys)
+        self.backend.add_shard('node-4', MemoryBackend())
+        after = dict((key, self.backend.shard_for(key)) for key in keys)
+
+        moved = [key for key in keys if before[key] != after[key]]
+        self.assertTrue(all(after[key] == 'node-4' for key in moved))
+        self.assertGreater(len(moved), 700)
+        self.assertLess(len(moved), 1300)
+
+    def test_remove_shard(self):
+        """
+        Tests that only the keys of a removed shard move
+        """
+        keys = ['key-%d' % i for i in range(5000)]
+        before = dict((key, self.backend.shard_for(key)) for key in keys)
+        self.backend.remove_shard('node-1')
+        for key in keys:
+            if before[key] != 'node-1':
+                self.assertEqual(self.backend.shard_for(key), before[key])
+            else:
+                self.assertNotEqual(self.backend.shard_for(key), 'node-1')
+
+    @patch('backends.sharded.sharded_backend.time')
+    def test_down_shard(self, mock_time):
+        """
+        Tests that a failing shard is bypassed until retry_interval passed
+        """
+        mock_time.monotonic.return_value = 100
+        key = 'key'
+        owner = self.backend.shard_for(key)
+        self.shards[owner].failing = True
+        with self.assertRaises(BackendException):
+            self.backend.get_cache(key)
+        self.assertEqual(self.backend.down_shards(), [owner])
+
+        self.backend.set_cache_and_expire(key, b'value', 60)
+        fallback = self.backend.shard_for(key)
+        self.assertNotEqual(fallback, owner)
+        self.assertEqual(self.shards[fallback].get_cache(key), b'value')
+
+        self.shards[owner].failing = False
+        mock_time.monotonic.return_value = 100 + self.backend.retry_interval
+        self.assertEqual(self.backend.shard_for(key), owner)
+        self.assertEqual(self.backend.down_shards(), [])
+
+    def test_down_shard_invalidation(self):
+        """
+        Tests that invalidations, counters, counter reads, locks and writes
+        without a TTL never fail over, so they aren't lost once the owner is back
+        """
+        keys = ['key-%d' % index for index in range(20)]
+        for key in keys:
+            self.backend.set_cache_and_expire(key, b'old', 60)
+        owner = self.backend.shard_for('key-0')
+        owned = [key for key in keys if self.backend.shard_for(key) == owner]
+        self.backend.mark_down(owner)
+
+        for operation in (lambda: self.backend.invalidate_key('key-0'),
+                          lambda: self.backend.incr('key-0'),
+                          lambda: self.backend.get_counters(['key-0']),
+                          lambda: self.backend.set_cache('key-0', b'new'),
+                          lambda: self.backend.acquire_lock('key-0', 10),
+                          lambda: self.backend.release_lock('key-0', b'x')):
+            with self.assertRaises(ShardDownError):
+                operation()
+        with self.assertRaises(BackendException):
+            self.backend.invalidate_many(keys)
+        # Keys of the live shards are invalidated anyway
+        self.assertEqual(
+            [key for key in keys if self.shards[owner].get_cache(key)],
+            owned)
+        self.assertTrue(all(
+            self.shards[name].get_cache(key) is None
+            for name in self.shards if name != owner for key in keys))
+        # Reads and writes with a TTL still fail over
+        self.backend.set_cache_and_expire('key-0', b'new', 60)
+        self.assertEqual(self.backend.get_cache('key-0'), b'new')
+
+    def test_all_shards_down(self):
+        """
+        Tests that a BackendException is raised when no shard is left
+        """
+        for name in self.shards:
+            self.backend.mark_down(name)
+        with self.assertRaises(BackendException):
+            self.backend.get_cache('key')
+
+    def test_many(self):
+        """
+        Tests that batched operations are sent to every shard in parallel
+        """
+        mapping = dict(('key-%d' % i, b'value-%d' % i) for i in range(100))
+        # Each shard's write only returns once all four are in flight
+        barrier = threading.Barrier(len(self.shards), timeout=5)
+        original = MemoryBackend.set_many_and_expire
+
+        def set_many_and_expire(backend, mapping, expiration):
+            barrier.wait()
+            return original(backend, mapping, expiration)
+
+        with patch.object(MemoryBackend, 'set_many_and_expire',
+                          set_many_and_expire):
+            self.backend.set_many_and_expire(mapping, 60)
+        for shard in self.shards.values():
+            self.assertGreater(len(shard), 0)
+
+        keys = sorted(mapping) + ['missing']
+        self.assertEqual(self.backend.get_many(keys),
+                         [mapping[key] for key in sorted(mapping)] + [None])
+
+        self.backend.invalidate_many(keys[:50])
+        self.assertEqual(self.backend.get_many(keys[:50]), [None] * 50)
+
+    def test_many_with_failing_shard(self):
+        """
+        Tests that keys of a failing shard are misses and writes raise once
+        the other shards are written
+        """
+        mapping = dict(('key-%d' % i, b'value') for i in range(100))
+        self.backend.set_many_and_expire(mapping, 60)
+        keys = sorted(mapping)
+        owners = [self.backend.shard_for(key) for key in keys]
+        self.shards['node-2'].failing = True
+        self.assertEqual(
+            self.backend.get_many(keys),
+            [None if owner == 'node-2' else b'value' for owner in owners])
+        self.assertEqual(self.backend.down_shards(), ['node-2'])
+
+        self.shards['node-3'].failing = True
+        with self.assertRaises(BackendException):
+            self.backend.set_many_and_expire(mapping, 60)
+        self.assertEqual(self.backend.down_shards(), ['node-2', 'node-3'])
+        for key, owner in zip(keys, owners):
+            if owner in ('node-0', 'node-1'):
+                self.assertEqual(self.shards[owner].get_cache(key), b'value')
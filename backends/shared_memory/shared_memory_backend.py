@@ -0,0 +1,405 @@
+from backends.backend_base import Backend, BackendException
+from backends.forking import after_fork
+from contextlib import contextmanager
+import binascii
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b'CDSHM001'
+# Magic, number of index slots, size of the value area, then the data head:
+# the total number of bytes ever reserved in the value area
+_HEADER = struct.Struct('<8sQQQ')
+_HEAD = struct.Struct('<Q')
+HEAD_OFFSET = 24
+HEADER_SIZE = 64
+# Key hash, data position, expiry UNIX timestamp or 0, key length, value
+# length and state, followed by a CRC32 of those fields
+_SLOT_FIELDS = struct.Struct('<QQdIII')
+_CHECKSUM = struct.Struct('<I')
+SLOT_SIZE = _SLOT_FIELDS.size + _CHECKSUM.size
+
+EMPTY = 0
+USED = 1
+DELETED = 2
+
+DEFAULT_SLOTS = 65536
+DEFAULT_DATA_SIZE = 64 * 1024 * 1024
+# Slots probed for a key. When all of them hold live keys the one written
+# longest ago is evicted
+MAX_PROBES = 16
+
+
+def _encode_key(key):
+    if isinstance(key, bytes):
+        return key
+    return str(key).encode('utf-8')
+
+
+def _hash(key):
+    return int.from_bytes(
+        hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def _reset_lock_after_fork(backend):
+    # Another thread may have held the lock when the process forked
+    backend._lock = threading.Lock()
+
+
+class SharedMemoryBackend(Backend):
+    """
+    Backend shared by every process on a host through a memory-mapped file,
+    e.g. under /dev/shm, so prefork workers share one cache without a
+    network hop. Keys are found through an open addressing hash index and
+    values are appended to a ring buffer, overwriting the oldest values
+    first. Processes exclude each other with fcntl locks, which the kernel
+    releases when a process dies. A value is written before the index slot
+    pointing to it, and every slot carries a checksum, so a writer dying
+    mid-update leaves at worst one key that reads as a miss
+    """
+
+    def __init__(self, path, slots=DEFAULT_SLOTS,
+                 data_size=DEFAULT_DATA_SIZE):
+        """
+        :param path: File to map, created if missing. Every process opening
+        the same file shares the cache
+        :param slots: Number of index slots, the most keys held at once.
+        Ignored when the file already exists
+        :param data_size: Size in bytes of the value ring buffer, which
+        bounds the size of a single key and value. Ignored when the file
+        already exists
+        """
+        super(SharedMemoryBackend, self).__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                self.slots, self.data_size = self._open(slots, data_size)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+            self._data_start = HEADER_SIZE + self.slots * SLOT_SIZE
+            self._map = mmap.mmap(self._fd, self._data_start + self.data_size)
+        except Exception:
+            os.close(self._fd)
+            raise
+        after_fork(self, _reset_lock_after_fork)
+
+    def _open(self, slots, data_size):
+        """
+        Reads the layout of an existing file, or lays out a new one. Called
+        with the file locked
+        :return: (number of slots, size of the value area)
+        """
+        header = os.pread(self._fd, _HEADER.size, 0)
+        if len(header) == _HEADER.size:
+            magic, file_slots, file_data_size, _ = _HEADER.unpack(header)
+            if magic == MAGIC:
+                return file_slots, file_data_size
+            if magic != bytes(len(MAGIC)):
+                raise BackendException(
+                    '%s is not a shared memory cache file' % (self.path,))
+        os.ftruncate(self._fd, 0)
+        os.ftruncate(self._fd, HEADER_SIZE + slots * SLOT_SIZE + data_size)
+        # The magic is written last, so a process dying while laying out
+        # the file leaves it to be laid out again
+        os.pwrite(self._fd, _HEADER.pack(MAGIC, slots, data_size, 0), 0)
+        return slots, data_size
+
+    def close(self):
+        """
+        Unmaps the file. The cache stays in the file for other processes
+        """
+        with self._lock:
+            self._map.close()
+            os.close(self._fd)
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX if exclusive else
+                        fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _head(self):
+        return _HEAD.unpack_from(self._map, HEAD_OFFSET)[0]
+
+    def _slot(self, index):
+        """
+        :return: (key hash, position, expires_at, key length, value length,
+        state), with the state DELETED for a slot whose checksum is wrong
+        """
+        offset = HEADER_SIZE + index * SLOT_SIZE
+        fields = _SLOT_FIELDS.unpack_from(self._map, offset)
+        if fields[5] == EMPTY:
+            return fields
+        checksum = _CHECKSUM.unpack_from(
+            self._map, offset + _SLOT_FIELDS.size)[0]
+        if zlib.crc32(self._map[offset:offset + _SLOT_FIELDS.size]) != \
+                checksum:
+            # Torn by a writer that died, the probe goes on past it
+            return fields[:5] + (DELETED,)
+        return fields
+
+    def _write_slot(self, index, key_hash, position, expires_at, key_length,
+                    value_length, state):
+        fields = _SLOT_FIELDS.pack(key_hash, position, expires_at,
+                                   key_length, value_length, state)
+        offset = HEADER_SIZE + index * SLOT_SIZE
+        self._map[offset:offset + SLOT_SIZE] = \
+            fields + _CHECKSUM.pack(zlib.crc32(fields))
+
+    def _is_live(self, fields, head, now):
+        expires_at = fields[2]
+        # Values are overwritten once the head moved a full ring past them
+        return fields[5] == USED and head <= fields[1] + self.data_size and \
+            (not expires_at or expires_at > now)
+
+    def _data_offset(self, position):
+        return self._data_start + position % self.data_size
+
+    def _key_at(self, fields):
+        start = self._data_offset(fields[1])
+        return self._map[start:start + fields[3]]
+
+    def _value_at(self, fields):
+        start = self._data_offset(fields[1]) + fields[3]
+        return self._map[start:start + fields[4]]
+
+    def _probe(self, key_hash):
+        start = key_hash % self.slots
+        for probe in range(min(MAX_PROBES, self.slots)):
+            yield (start + probe) % self.slots
+
+    def _find(self, key, head, now):
+        """
+        :return: (index, fields) of the live slot holding key, or None
+        """
+        key_hash = _hash(key)
+        for index in self._probe(key_hash):
+            fields = self._slot(index)
+            if fields[5] == EMPTY:
+                return None
+            if fields[0] == key_hash and self._is_live(fields, head, now) \
+                    and self._key_at(fields) == key:
+                return index, fields
+        return None
+
+    def _get(self, key, head, now):
+        found = self._find(key, head, now)
+        if found is None:
+            return None
+        return self._value_at(found[1])
+
+    def _reserve(self, length, head):
+        """
+        Reserves room for a record in the value area. The head moves before
+        the record is written, so values a dying writer partly overwrote are
+        already out of the ring
+        :return: Position of the record
+        """
+        offset = head % self.data_size
+        if offset + length > self.data_size:
+            # Records never wrap, skip the end of the ring
+            head += self.data_size - offset
+        _HEAD.pack_into(self._map, HEAD_OFFSET, head + length)
+        return head
+
+    def _set(self, key, value, expires_at):
+        """
+        Stores a value, reusing the first free slot in the key's probe
+        sequence or evicting the oldest key in it
+        :return: False if the key and value don't fit in the value area
+        """
+        key_hash = _hash(key)
+        head = self._head()
+        now = time.time()
+        free = None
+        oldest = None
+        for index in self._probe(key_hash):
+            fields = self._slot(index)
+            if fields[5] == EMPTY:
+                if free is None:
+                    free = index
+                break
+            live = self._is_live(fields, head, now)
+            if live and fields[0] == key_hash and \
+                    self._key_at(fields) == key:
+                self._write_slot(index, 0, 0, 0, 0, 0, DELETED)
+                live = False
+            if not live:
+                if free is None:
+                    free = index
+            elif oldest is None or fields[1] < oldest[1]:
+                oldest = (index, fields[1])
+        length = len(key) + len(value)
+        if length > self.data_size:
+            return False
+        if free is None:
+            free = oldest[0]
+        position = self._reserve(length, head)
+        start = self._data_offset(position)
+        self._map[start:start + len(key)] = key
+        self._map[start + len(key):start + length] = value
+        self._write_slot(free, key_hash, position, expires_at or 0,
+                         len(key), len(value), USED)
+        return True
+
+    def _delete(self, key):
+        """
+        :return: Number of keys removed
+        """
+        key_hash = _hash(key)
+        head = self._head()
+        now = time.time()
+        removed = 0
+        for index in self._probe(key_hash):
+            fields = self._slot(index)
+            if fields[5] == EMPTY:
+                break
+            if fields[0] == key_hash and self._is_live(fields, head, now) \
+                    and self._key_at(fields) == key:
+                self._write_slot(index, 0, 0, 0, 0, 0, DELETED)
+                removed += 1
+        return removed
+
+    def __len__(self):
+        with self._locked(False):
+            head = self._head()
+            now = time.time()
+            return sum(self._is_live(self._slot(index), head, now)
+                       for index in range(self.slots))
+
+    def get_cache(self, key):
+        """
+        Gets the given key from the shared file
+        :param key: The cache key to get
+        :return: A copy of the stored value, or None if missing or expired
+        """
+        key = _encode_key(key)
+        with self._locked(False):
+            return self._get(key, self._head(), time.time())
+
+    def set_cache(self, key, value):
+        """
+        Stores the key/value pair without expiration
+        :param key: The cache key
+        :param value: The cache value, bytes
+        :return: False if the pair is larger than the value area
+        """
+        key = _encode_key(key)
+        with self._locked(True):
+            return self._set(key, value, None)
+
+    def set_cache_and_expire(self, key, value, expiration):
+        """
+        Stores the key/value pair with an expiration TTL
+        :param key: The cache key
+        :param value: The cache value, bytes
+        :param expiration: The time to live (ttl) in seconds
+        :return: False if the pair is larger than the value area
+        """
+        key = _encode_key(key)
+        with self._locked(True):
+            return self._set(key, value, time.time() + expiration)
+
+    def invalidate_key(self, key):
+        """
+        Removes the key
+        :param key: The cache key
+        :return: Number of keys removed
+        """
+        key = _encode_key(key)
+        with self._locked(True):
+            return self._delete(key)
+
+    def get_many(self, keys):
+        """
+        Gets several keys under a single lock acquisition
+        :param keys: The cache keys to get
+        :return: List of values in the order of keys, with None for misses
+        """
+        keys = [_encode_key(key) for key in keys]
+        with self._locked(False):
+            head = self._head()
+            now = time.time()
+            return [self._get(key, head, now) for key in keys]
+
+    def set_many_and_expire(self, mapping, expiration):
+        """
+        Stores several key/value pairs with the same expiration TTL
+        :param mapping: Dictionary of cache keys to cache values
+        :param expiration: The time to live (ttl) in seconds
+        """
+        with self._locked(True):
+            expires_at = time.time() + expiration
+            for key, value in mapping.items():
+                self._set(_encode_key(key), value, expires_at)
+        return True
+
+    def invalidate_many(self, keys):
+        """
+        Removes several keys
+        :param keys: The cache keys
+        :return: Number of keys removed
+        """
+        keys = [_encode_key(key) for key in keys]
+        with self._locked(True):
+            return sum(self._delete(key) for key in keys)
+
+    def incr(self, key):
+        """
+        Increments the counter at key, stored as ASCII digits, without an
+        expiration
+        :param key: The counter key
+        :return: The new value
+        """
+        key = _encode_key(key)
+        with self._locked(True):
+            value = int(self._get(key, self._head(), time.time()) or 0) + 1
+            self._set(key, str(value).encode('ascii'), None)
+        return value
+
+    def acquire_lock(self, key, timeout):
+        """
+        Takes the lock unless a live lock is already stored at key
+        :param key: The lock key
+        :param timeout: Seconds after which the lock expires
+        :return: The lock token, or None if the lock is already held
+        """
+        key = _encode_key(key)
+        token = binascii.hexlify(os.urandom(16))
+        with self._locked(True):
+            now = time.time()
+            if self._get(key, self._head(), now) is not None:
+                return None
+            self._set(key, token, now + timeout)
+        return token
+
+    def release_lock(self, key, token):
+        """
+        Removes the lock if it still holds the token
+        :param key: The lock key
+        :param token: The token returned by acquire_lock
+        """
+        key = _encode_key(key)
+        with self._locked(True):
+            if self._get(key, self._head(), time.time()) == token:
+                self._delete(key)
+
+    def clear(self):
+        """
+        Removes every key, for every process sharing the file
+        """
+        with self._locked(True):
+            self._map[HEADER_SIZE:self._data_start] = \
+                bytes(self._data_start - HEADER_SIZE)
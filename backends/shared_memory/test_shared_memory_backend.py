@@ -0,0 +1,173 @@
+from backends.backend_base import BackendException
+from backends.shared_memory.shared_memory_backend import (
+    SharedMemoryBackend, HEADER_SIZE)
+from unittest import TestCase
+from mock import patch
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+
+def increment(path, times):
+    backend = SharedMemoryBackend(path)
+    for _ in range(times):
+        backend.incr('counter')
+    backend.close()
+
+
+def die_holding_lock(path):
+    backend = SharedMemoryBackend(path)
+    backend._locked(True).__enter__()
+    os._exit(0)
+
+
+class TestSharedMemoryBackend(TestCase):
+    """
+    Test cases for shared_memory_backend.py
+    """
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'cache')
+        self.backend = self.open()
+
+    def open(self, **kwargs):
+        backend = SharedMemoryBackend(self.path, **kwargs)
+        self.addCleanup(backend.close)
+        return backend
+
+    def test_get_set(self):
+        """
+        Tests GET, SET, DEL and a miss
+        """
+        self.assertTrue(self.backend.set_cache('key', b'value'))
+        self.assertEqual(self.backend.get_cache('key'), b'value')
+        self.assertEqual(self.backend.get_cache(b'key'), b'value')
+        self.assertIsNone(self.backend.get_cache('missing'))
+        self.backend.set_cache('key', b'other')
+        self.assertEqual(self.backend.get_cache('key'), b'other')
+        self.assertEqual(len(self.backend), 1)
+
+        self.assertEqual(self.backend.invalidate_key('key'), 1)
+        self.assertEqual(self.backend.invalidate_key('key'), 0)
+        self.assertIsNone(self.backend.get_cache('key'))
+
+    def test_many(self):
+        """
+        Tests the multi-key methods
+        """
+        self.backend.set_many_and_expire({'a': b'1', 'b': b'2'}, 60)
+        self.assertEqual(self.backend.get_many(['a', 'x', 'b']),
+                         [b'1', None, b'2'])
+        self.assertEqual(self.backend.invalidate_many(['a', 'b', 'x']), 2)
+        self.assertEqual(len(self.backend), 0)
+
+    @patch('backends.shared_memory.shared_memory_backend.time')
+    def test_expiry(self, mock_time):
+        """
+        Tests that an expired key is a miss and its slot is reused
+        """
+        mock_time.time.return_value = 100
+        self.backend.set_cache_and_expire('key', b'value', 10)
+        mock_time.time.return_value = 109
+        self.assertEqual(self.backend.get_cache('key'), b'value')
+        mock_time.time.return_value = 110
+        self.assertIsNone(self.backend.get_cache('key'))
+        self.assertEqual(len(self.backend), 0)
+
+    def test_shared(self):
+        """
+        Tests that backends opening the same file share keys, and keep the
+        layout the file was created with
+        """
+        self.backend.set_cache('key', b'value')
+        other = self.open(slots=8, data_size=1024)
+        self.assertEqual(other.get_cache('key'), b'value')
+        self.assertEqual(other.slots, self.backend.slots)
+        self.backend.clear()
+        self.assertIsNone(other.get_cache('key'))
+
+    def test_not_a_cache_file(self):
+        """
+        Tests that a file with other contents is not overwritten
+        """
+        with open(self.path + '.other', 'wb') as other:
+            other.write(b'x' * 128)
+        with self.assertRaises(BackendException):
+            SharedMemoryBackend(self.path + '.other')
+
+    def test_ring_eviction(self):
+        """
+        Tests that the oldest values are overwritten once the ring is full
+        """
+        backend = SharedMemoryBackend(self.path + '.small', slots=256,
+                                      data_size=1000)
+        self.addCleanup(backend.close)
+        for i in range(50):
+            backend.set_cache('key-%02d' % i, b'v' * 94)
+        values = backend.get_many(['key-%02d' % i for i in range(50)])
+        # Ten 100 byte records fit in the ring
+        self.assertEqual(values, [None] * 40 + [b'v' * 94] * 10)
+        self.assertFalse(backend.set_cache('big', b'v' * 1000))
+        self.assertIsNone(backend.get_cache('big'))
+
+    def test_slot_eviction(self):
+        """
+        Tests that the key written longest ago is evicted when every probed
+        slot is taken
+        """
+        backend = SharedMemoryBackend(self.path + '.small', slots=4,
+                                      data_size=4096)
+        self.addCleanup(backend.close)
+        for i in range(10):
+            backend.set_cache(i, b'value')
+        self.assertEqual(len(backend), 4)
+        self.assertEqual(backend.get_many(range(10)),
+                         [None] * 6 + [b'value'] * 4)
+
+    def test_torn_slot(self):
+        """
+        Tests that a slot left half written by a dying writer reads as a
+        miss and is reused
+        """
+        backend = SharedMemoryBackend(self.path + '.small', slots=1,
+                                      data_size=4096)
+        self.addCleanup(backend.close)
+        backend.set_cache('key', b'value')
+        backend._map[HEADER_SIZE + 8] ^= 0xff
+        self.assertIsNone(backend.get_cache('key'))
+        self.assertEqual(len(backend), 0)
+        backend.set_cache('key', b'value')
+        self.assertEqual(backend.get_cache('key'), b'value')
+
+    def test_incr_across_processes(self):
+        """
+        Tests that processes exclude each other, including once a process
+        died holding the lock
+        """
+        context = multiprocessing.get_context('fork')
+        dead = context.Process(target=die_holding_lock, args=(self.path,))
+        dead.start()
+        dead.join(10)
+
+        workers = [context.Process(target=increment, args=(self.path, 200))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(30)
+            self.assertEqual(worker.exitcode, 0)
+        self.assertEqual(self.backend.get_cache('counter'), b'800')
+
+    def test_lock(self):
+        """
+        Tests acquiring and releasing a lock
+        """
+        token = self.backend.acquire_lock('lock', 10)
+        self.assertIsNotNone(token)
+        self.assertIsNone(self.backend.acquire_lock('lock', 10))
+        self.backend.release_lock('lock', b'wrong')
+        self.assertIsNone(self.backend.acquire_lock('lock', 10))
+        self.backend.release_lock('lock', token)
+        self.assertIsNotNone(self.backend.acquire_lock('lock', 10))
@@ -1,5 +1,6 @@
-from backends.backend_base import Backend
+from backends.backend_base import AsyncBackend, Backend
 from unittest import TestCase
+import asyncio
 
 
 class BackendTestCase(TestCase):
@@ -19,4 +20,80 @@ class BackendTestCase(TestCase):
             self.backend.invalidate_key('somekey')
 
         with self.assertRaises(NotImplementedError):
-            self.backend.set_cache_and_expire('somekey', 'somevalue', 'time')
\ No newline at end of file
+            self.backend.set_cache_and_expire('somekey', 'somevalue', 'time')
+
+        with self.assertRaises(NotImplementedError):
+            self.backend.acquire_lock('somekey', 10)
+
+        with self.assertRaises(NotImplementedError):
+            self.backend.release_lock('somekey', 'token')
+
+    def test_many_fallback(self):
+        """
+        Tests that the multi-key methods fall back to the single key methods
+        """
+        self.backend.get_cache = lambda key: key.upper()
+        self.assertEqual(self.backend.get_many(['a', 'b']), ['A', 'B'])
+
+        stored = {}
+        self.backend.set_cache_and_expire = \
+            lambda key, value, expiration: stored.update({key: expiration})
+        self.backend.set_many_and_expire({'a': 1, 'b': 2}, 10)
+        self.assertEqual(stored, {'a': 10, 'b': 10})
+
+        invalidated = []
+        self.backend.invalidate_key = invalidated.append
+        self.backend.invalidate_many(['a', 'b'])
+        self.assertEqual(invalidated, ['a', 'b'])
+
+    def test_incr_fallback(self):
+        """
+        Tests that incr falls back to reading and writing the key
+        """
+        stored = {}
+        self.backend.get_cache = stored.get
+        self.backend.set_cache = stored.__setitem__
+        self.assertEqual(self.backend.incr('counter'), 1)
+        self.assertEqual(self.backend.incr('counter'), 2)
+        self.assertEqual(stored, {'counter': b'2'})
+
+
+class AsyncBackendTestCase(TestCase):
+
+    def setUp(self):
+        self.backend = AsyncBackend()
+
+    def test_not_implemented(self):
+
+        for coroutine in (self.backend.get_cache('somekey'),
+                          self.backend.set_cache('somekey', 'somevalue'),
+                          self.backend.invalidate_key('somekey'),
+                          self.backend.set_cache_and_expire(
+                              'somekey', 'somevalue', 'time')):
+            with self.assertRaises(NotImplementedError):
+                asyncio.run(coroutine)
+
+    def test_many_fallback(self):
+        """
+        Tests that the multi-key methods fall back to the single key methods
+        """
+        stored = {}
+
+        async def set_cache_and_expire(key, value, expiration):
+            stored[key] = value
+
+        async def get_cache(key):
+            return stored.get(key)
+
+        async def invalidate_key(key):
+            stored.pop(key, None)
+
+        self.backend.set_cache_and_expire = set_cache_and_expire
+        self.backend.get_cache = get_cache
+        self.backend.invalidate_key = invalidate_key
+
+        asyncio.run(self.backend.set_many_and_expire({'a': 1, 'b': 2}, 10))
+        self.assertEqual(
+            asyncio.run(self.backend.get_many(['a', 'b', 'c'])), [1, 2, None])
+        asyncio.run(self.backend.invalidate_many(['a']))
+        self.assertEqual(stored, {'b': 2})
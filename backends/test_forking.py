@@ -0,0 +1,39 @@
+from backends import forking
+from unittest import TestCase
+from mock import patch
+import gc
+import weakref
+
+
+class Target(object):
+
+    def __init__(self):
+        self.resets = 0
+
+
+def reset(target):
+    target.resets += 1
+
+
+class TestForking(TestCase):
+    """
+    Test cases for forking.py
+    """
+
+    @patch.object(forking, '_resets', weakref.WeakKeyDictionary())
+    def test_after_fork(self):
+        """
+        Tests that each registered reset runs once per fork, and is
+        forgotten with its object
+        """
+        target = Target()
+        forking.after_fork(target, reset)
+        forking.after_fork(target, reset)
+        self.assertEqual(forking._resets[target], [reset])
+
+        forking._reset_in_child()
+        self.assertEqual(target.resets, 1)
+
+        del target
+        gc.collect()
+        self.assertEqual(len(forking._resets), 0)
@@ -0,0 +1,60 @@
+"""
+Measures the decorator's own overhead per cache hit, against a null backend
+answering every GET with the same value and against the in-process tier.
+Functions with nothing but a backend get the lean wrapper, a circuit breaker
+is enough to get the full one
+
+Usage: python -m benchmarks.bench_hit_path [iterations]
+"""
+from benchmarks.harness import NullBackend
+from cache_deco import Cache
+from cache_deco.circuit_breaker import CircuitBreaker
+from cache_deco.local_cache import LocalCache
+import pickle
+import sys
+import timeit
+
+REPEAT = 7
+
+
+def sample_function(a, b):
+    return a + b
+
+
+def best(operation, iterations):
+    """
+    :return: Fastest time per call in microseconds over REPEAT runs
+    """
+    return min(timeit.repeat(operation, number=iterations,
+                             repeat=REPEAT)) / iterations * 1e6
+
+
+def main(iterations=50000):
+    cache = Cache(NullBackend(pickle.dumps(3)))
+    backend_hit = cache.cache()(sample_function)
+    invalidator_hit = cache.cache(invalidator=True)(sample_function)
+    full_cache = Cache(NullBackend(pickle.dumps(3)),
+                       circuit_breaker=CircuitBreaker())
+    full_hit = full_cache.cache()(sample_function)
+    local_hit = cache.cache(local_cache=LocalCache())(sample_function)
+    local_hit(1, 2)
+    make_key = cache._key_function(sample_function, {})
+
+    baseline = best(lambda: sample_function(1, 2), iterations)
+    cases = [
+        ('key, per call', lambda: cache._generate_cache_key(
+            sample_function, (1, 2), {})),
+        ('key, compiled', lambda: make_key((1, 2), {})),
+        ('backend hit', lambda: backend_hit(1, 2)),
+        ('backend hit kw', lambda: backend_hit(1, b=2)),
+        ('hit invalidator', lambda: invalidator_hit(1, 2)),
+        ('full wrapper hit', lambda: full_hit(1, 2)),
+        ('local hit', lambda: local_hit(1, 2)),
+    ]
+    print('%-16s %8.2fus' % ('undecorated', baseline))
+    for name, operation in cases:
+        print('%-16s %8.2fus' % (name, best(operation, iterations)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
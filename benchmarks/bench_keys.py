@@ -0,0 +1,45 @@
+"""
+Compares cache key generation against the previous hash()-of-string path
+
+Usage: python -m benchmarks.bench_keys [iterations]
+"""
+from cache_deco import Cache
+from tests.inputs import SimpleObject
+import sys
+import timeit
+
+
+def sample_function(*args, **kwargs):
+    pass
+
+
+def legacy_key(fn, args, kwargs):
+    signature = Cache._default_signature_generator(None, args, **kwargs)
+    return str(hash(fn.__name__ + signature))
+
+
+CASES = [
+    ('primitives', (1, 'two', 3.0, None), {'flag': True}),
+    ('long string', ('x' * 10000,), {}),
+    ('list of ints', (list(range(1000)),), {}),
+    ('dict of str', (dict(('key%d' % i, 'value%d' % i)
+                          for i in range(200)),), {}),
+    ('objects', ([SimpleObject('name%d' % i, i) for i in range(50)],), {}),
+]
+
+
+def main(iterations=2000):
+    cache = Cache(None)
+    for name, args, kwargs in CASES:
+        legacy = timeit.timeit(
+            lambda: legacy_key(sample_function, args, kwargs),
+            number=iterations)
+        current = timeit.timeit(
+            lambda: cache._generate_cache_key(sample_function, args, kwargs),
+            number=iterations)
+        print('%-14s legacy=%8.2fus blake2b=%8.2fus' % (
+            name, legacy / iterations * 1e6, current / iterations * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,38 @@
+"""
+Compares RedisBackend cache hit latency and throughput with and without
+connection pooling
+
+Usage: python -m benchmarks.bench_redis_pool [iterations] [threads]
+"""
+from backends.redis.redis_backend import RedisBackend
+from benchmarks.harness import measure
+from benchmarks.redis_server import RedisStandIn
+import pickle
+import sys
+
+
+def run(backend, iterations, threads):
+    """
+    Issues `iterations` GETs of a cached key from each of `threads` threads
+    """
+    return measure(lambda index: pickle.loads(backend.get_cache('hot_key')),
+                   iterations, threads)
+
+
+def main(iterations=2000, threads=4):
+    server = RedisStandIn().start()
+    try:
+        for use_pool in (False, True):
+            backend = RedisBackend('127.0.0.1', server.port, use_pool=use_pool)
+            backend.set_cache_and_expire('hot_key', pickle.dumps('x' * 100), 60)
+            result = run(backend, iterations, threads)
+            backend.disconnect()
+            print('%-10s p50=%8.1fus p99=%8.1fus %10.0f ops/sec' % (
+                'pooled' if use_pool else 'unpooled', result['p50_us'],
+                result['p99_us'], result['ops_per_sec']))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,40 @@
+"""
+Compares serializers and compression on a large list of dicts
+
+Usage: python -m benchmarks.bench_serializers [iterations] [rows]
+"""
+from benchmarks.harness import sample_payload
+from cache_deco import serializers
+from cache_deco.serializers import Codec
+import sys
+import timeit
+
+
+def configurations():
+    yield 'legacy pickle', Codec()
+    names = ['pickle', 'marshal', 'json']
+    if serializers.msgpack is not None:
+        names.append('msgpack')
+    compressions = [None, 'zlib']
+    if serializers.lz4_frame is not None:
+        compressions.append('lz4')
+    for name in names:
+        for compression in compressions:
+            yield '%s+%s' % (name, compression or 'none'), \
+                Codec(name, compression)
+
+
+def main(iterations=50, rows=10000):
+    payload = sample_payload(rows)
+    for label, codec in configurations():
+        data = codec.dumps(payload)
+        dumps = timeit.timeit(lambda: codec.dumps(payload),
+                              number=iterations)
+        loads = timeit.timeit(lambda: codec.loads(data), number=iterations)
+        print('%-16s bytes=%9d dumps=%8.2fms loads=%8.2fms' % (
+            label, len(data), dumps / iterations * 1e3,
+            loads / iterations * 1e3))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,81 @@
+"""
+Timing helpers and sample data shared by the benchmarks
+"""
+from backends.backend_base import Backend
+import threading
+import time
+
+
+class NullBackend(Backend):
+    """
+    Backend that stores nothing and answers every GET with a fixed value,
+    to measure the decorator's own overhead
+    """
+
+    def __init__(self, value=None):
+        """
+        :param value: Returned by every GET, None to always miss
+        """
+        super(NullBackend, self).__init__()
+        self.value = value
+
+    def get_cache(self, key):
+        return self.value
+
+    def set_cache(self, key, value):
+        pass
+
+    def set_cache_and_expire(self, key, value, expiration):
+        pass
+
+    def invalidate_key(self, key):
+        pass
+
+
+def sample_payload(rows):
+    """
+    :param rows: Number of records
+    :return: A list of `rows` small dicts, like a database query result
+    """
+    return [{'id': i, 'name': 'user%d' % i, 'email': 'user%d@example.com' % i,
+             'score': i * 0.5, 'active': i % 2 == 0, 'tags': ['a', 'b']}
+            for i in range(rows)]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(operation, iterations, threads=1):
+    """
+    Calls operation `iterations` times from each of `threads` threads
+    :param operation: Callable taking the index of the call in its thread
+    :return: Dictionary with the p50 and p99 latency in microseconds and
+    the throughput in operations per second
+    """
+    latencies = []
+    lock = threading.Lock()
+    clock = time.perf_counter
+
+    def worker():
+        local = []
+        for index in range(iterations):
+            start = clock()
+            operation(index)
+            local.append(clock() - start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = clock()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = clock() - start
+    return {
+        'p50_us': percentile(latencies, 0.5) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'ops_per_sec': len(latencies) / elapsed,
+    }
@@ -0,0 +1,111 @@
+"""
+Minimal in-process Redis protocol stand-in used by the benchmarks so they
+can exercise RedisBackend over real sockets without a Redis install
+"""
+import socket
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            command = self._read_command()
+            if command is None:
+                return
+            self.wfile.write(self.server.execute(command))
+            self.wfile.flush()
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:])
+        args = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+class RedisStandIn(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Threaded server speaking enough RESP2 for the cache backends
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address='127.0.0.1', port=0):
+        socketserver.TCPServer.__init__(self, (address, port), _RedisHandler)
+        self.data = {}
+        self.expiry = {}
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _get(self, key, now):
+        expires = self.expiry.get(key)
+        if expires is not None and expires <= now:
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+        return self.data.get(key)
+
+    def execute(self, args):
+        name = args[0].upper()
+        now = time.time()
+        with self.lock:
+            if name == b'GET':
+                return _bulk(self._get(args[1], now))
+            if name == b'MGET':
+                values = [self._get(key, now) for key in args[1:]]
+                return b'*%d\r\n%s' % (
+                    len(values), b''.join(_bulk(value) for value in values))
+            if name == b'SET':
+                self.data[args[1]] = args[2]
+                self.expiry.pop(args[1], None)
+                return b'+OK\r\n'
+            if name == b'SETEX':
+                self.data[args[1]] = args[3]
+                self.expiry[args[1]] = now + int(args[2])
+                return b'+OK\r\n'
+            if name == b'DEL':
+                deleted = 0
+                for key in args[1:]:
+                    self.expiry.pop(key, None)
+                    if self.data.pop(key, None) is not None:
+                        deleted += 1
+                return b':%d\r\n' % deleted
+            if name == b'INCR':
+                value = int(self._get(args[1], now) or 0) + 1
+                self.data[args[1]] = b'%d' % value
+                self.expiry.pop(args[1], None)
+                return b':%d\r\n' % value
+            if name == b'PING':
+                return b'+PONG\r\n'
+        return b'-ERR unknown command\r\n'
+
+
+def _bulk(value):
+    if value is None:
+        return b'$-1\r\n'
+    return b'$%d\r\n%s\r\n' % (len(value), value)
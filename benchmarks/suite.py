@@ -0,0 +1,199 @@
+"""
+Benchmark suite for the decorator hot path: key generation, serialization
+and hit/miss latency through the full wrapper, on a null backend, a
+MemoryBackend and a RedisBackend talking to the Redis stand-in, across
+payload sizes and thread counts.
+
+Results are written as JSON, with a readable summary on stderr, so runs
+can be stored and compared to track regressions.
+
+Usage: python -m benchmarks.suite [--iterations N] [--rows 1,100,10000]
+       [--threads 1,4] [--backends null,memory,redis] [--output FILE]
+"""
+from backends.memory.memory_backend import MemoryBackend
+from backends.redis.redis_backend import RedisBackend
+from benchmarks.harness import NullBackend, measure, sample_payload
+from benchmarks.redis_server import RedisStandIn
+from cache_deco import Cache
+from cache_deco.serializers import Codec
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+
+BACKENDS = ('null', 'memory', 'redis')
+CODECS = (
+    ('pickle_legacy', {}),
+    ('pickle', {'serializer': 'pickle'}),
+    ('marshal', {'serializer': 'marshal'}),
+    ('pickle_zlib', {'serializer': 'pickle', 'compression': 'zlib'}),
+)
+# Lower bound on the iterations of a case once scaled down for its payload
+MIN_ITERATIONS = 20
+
+
+def scaled_iterations(iterations, rows):
+    """
+    Runs fewer iterations for large payloads so every case takes a similar
+    time
+    """
+    return max(MIN_ITERATIONS, min(iterations, iterations * 100 // rows))
+
+
+def sample_function(*args, **kwargs):
+    pass
+
+
+def bench_keys(rows, iterations):
+    cache = Cache(None)
+    args = (sample_payload(rows),)
+    yield 'generate_cache_key', measure(
+        lambda index: cache._generate_cache_key(sample_function, args, {}),
+        iterations)
+    yield 'legacy_signature', measure(
+        lambda index: hash(sample_function.__name__ +
+                           Cache._default_signature_generator(None, args)),
+        iterations)
+
+
+def bench_serialization(rows, iterations):
+    payload = sample_payload(rows)
+    for name, options in CODECS:
+        codec = Codec(**options)
+        data = codec.dumps(payload)
+        yield name + '_dumps', dict(
+            measure(lambda index: codec.dumps(payload), iterations),
+            bytes=len(data))
+        yield name + '_loads', measure(
+            lambda index: codec.loads(data), iterations)
+
+
+def open_backend(name, payload, server):
+    """
+    :return: (backend for hits, backend for misses)
+    """
+    if name == 'null':
+        return NullBackend(Codec().dumps(payload)), NullBackend()
+    if name == 'memory':
+        backend = MemoryBackend()
+    else:
+        backend = RedisBackend('127.0.0.1', server.port)
+    return backend, backend
+
+
+def bench_wrapper(backend_name, rows, threads, iterations, server):
+    payload = sample_payload(rows)
+    hit_backend, miss_backend = open_backend(backend_name, payload, server)
+
+    @Cache(hit_backend).cache()
+    def cached_hit(key):
+        return payload
+
+    @Cache(miss_backend).cache()
+    def cached_miss(key):
+        return payload
+
+    # Keys are unique to the case, as the stand-in server outlives it, and
+    # every miss uses a new key, shared between threads
+    case = (rows, threads)
+    counter = itertools.count()
+    cached_hit(case)
+    try:
+        yield 'hit', measure(
+            lambda index: cached_hit(case), iterations, threads)
+        yield 'miss', measure(
+            lambda index: cached_miss((case, next(counter))),
+            iterations, threads)
+    finally:
+        if backend_name == 'redis':
+            hit_backend.disconnect()
+
+
+def run(iterations, rows_list, threads_list, backends, report):
+    """
+    Runs every case, passing each result to report
+    """
+    for rows in rows_list:
+        count = scaled_iterations(iterations, rows)
+        for name, result in bench_keys(rows, count):
+            report(dict(result, group='keys', name=name, rows=rows,
+                        threads=1, iterations=count))
+        for name, result in bench_serialization(rows, count):
+            report(dict(result, group='serialization', name=name,
+                        rows=rows, threads=1, iterations=count))
+
+    server = RedisStandIn().start() if 'redis' in backends else None
+    try:
+        for backend_name in backends:
+            for rows in rows_list:
+                count = scaled_iterations(iterations, rows)
+                for threads in threads_list:
+                    for name, result in bench_wrapper(
+                            backend_name, rows, threads, count, server):
+                        report(dict(result, group='wrapper', name=name,
+                                    backend=backend_name, rows=rows,
+                                    threads=threads, iterations=count))
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+def _backend_list(value):
+    names = value.split(',')
+    for name in names:
+        if name not in BACKENDS:
+            raise argparse.ArgumentTypeError(
+                'unknown backend %r, choose from %s' % (name, BACKENDS))
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the cache decorator hot path')
+    parser.add_argument('--iterations', type=int, default=2000,
+                        help='calls per case, fewer for large payloads')
+    parser.add_argument('--rows', type=_int_list, default=[1, 100, 10000],
+                        help='comma separated payload sizes, in records')
+    parser.add_argument('--threads', type=_int_list, default=[1, 4],
+                        help='comma separated thread counts')
+    parser.add_argument('--backends', type=_backend_list,
+                        default=list(BACKENDS),
+                        help='comma separated backends, from %s' % (
+                            ','.join(BACKENDS),))
+    parser.add_argument('--output', help='JSON file, defaults to stdout')
+    args = parser.parse_args(argv)
+
+    results = []
+
+    def report(result):
+        results.append(result)
+        sys.stderr.write(
+            '%-13s %-20s %-7s rows=%-6d threads=%-3d p50=%10.1fus '
+            'p99=%10.1fus %10.0f ops/sec\n' % (
+                result['group'], result['name'], result.get('backend', '-'),
+                result['rows'], result['threads'], result['p50_us'],
+                result['p99_us'], result['ops_per_sec']))
+
+    run(args.iterations, args.rows, args.threads, args.backends, report)
+    document = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(document, output, indent=2)
+    else:
+        json.dump(document, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,66 +1,1241 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import functools
-import pickle
+import inspect
+import itertools
+import math
+import random
+import threading
+import time
 
-from backends.backend_base import BackendException
+from backends.backend_base import AsyncBackend, BackendException
+from backends.forking import after_fork
+from cache_deco import keys, metadata, negative, streaming
+from cache_deco.admission import AdmissionPolicy
+from cache_deco.chunking import AsyncChunkedBackend, ChunkedBackend
+from cache_deco.circuit_breaker import OPEN
+from cache_deco.generations import Generations, namespace_name, tag_name
+from cache_deco.local_cache import LocalCache
+from cache_deco.metrics import Metrics
+from cache_deco.negative import CachedException
+from cache_deco.serializers import Codec, DEFAULT_COMPRESS_THRESHOLD
+from cache_deco.single_flight import SingleFlight
+from cache_deco.warm import DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY, preload
 
 # Default expiration time for a cached object if not given in the decorator
 DEFAULT_EXPIRATION = 60
 
+# Seconds a single flight backend lock is held before it expires
+DEFAULT_LOCK_TIMEOUT = 10
+# Bounds in seconds of the backoff between cache reads while waiting for
+# another process to fill a key
+LOCK_POLL_INTERVAL = 0.005
+MAX_LOCK_POLL_INTERVAL = 0.1
+# Appended to a cache key to name its single flight backend lock
+LOCK_SUFFIX = ':lock'
+SINGLE_FLIGHT_MODES = (None, 'local', 'distributed')
+# Threads recomputing stale values in the background, per Cache
+DEFAULT_REFRESH_WORKERS = 4
+
+# Marks a lookup that found nothing, as None is a valid cached value
+_MISSING = object()
+
 
 class Cache(object):
-    def __init__(self, client):
+    def __init__(self, client, local_cache=None,
+                 refresh_workers=DEFAULT_REFRESH_WORKERS, serializer=None,
+                 compression=None,
+                 compress_threshold=DEFAULT_COMPRESS_THRESHOLD,
+                 circuit_breaker=None, write_behind=None,
+                 generation_ttl=None, max_value_size=None):
+        """
+        :param client: The cache backend
+        :param local_cache: Optional LocalCache used as an in-process tier
+        in front of the backend by every decorated function
+        :param refresh_workers: Number of threads refreshing stale values
+        :param serializer: Serializer, or name of one, used by every
+        decorated function. None stores plain pickles
+        :param compression: Compressor, or name of one, applied to values of
+        at least compress_threshold bytes
+        :param compress_threshold: Serialized size in bytes from which values
+        are compressed
+        :param circuit_breaker: Optional CircuitBreaker skipping the backend
+        while it keeps failing
+        :param write_behind: Optional WriteBehind writing computed values to
+        the backend in the background
+        :param generation_ttl: Seconds the namespace and tag generations
+        read from the backend are reused in this process, None to read them
+        on every call
+        :param max_value_size: Largest value in bytes stored under a single
+        key. Larger values are split into chunks, see cache_deco.chunking
+        """
+        if max_value_size is not None:
+            chunked_class = AsyncChunkedBackend \
+                if isinstance(client, AsyncBackend) else ChunkedBackend
+            chunked = chunked_class(client, max_value_size)
+            if write_behind is not None and write_behind.backend is client:
+                write_behind.backend = chunked
+            client = chunked
         self.backend = client
+        self.local_cache = local_cache
+        self.refresh_workers = refresh_workers
+        self.serializer = serializer
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.codec = Codec(serializer, compression, compress_threshold)
+        self.backend_hits = 0
+        self.backend_misses = 0
+        self.metrics = Metrics()
+        self.circuit_breaker = circuit_breaker
+        self.write_behind = write_behind
+        self.generations = Generations(client, generation_ttl)
+        self._single_flight = SingleFlight()
+        self._reset_after_fork()
+        after_fork(self, Cache._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # Refresh threads don't survive a fork, and refreshes queued in the
+        # parent never complete in the child
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._refresh_executor = None
 
     def cache(self, **options):
         """
         Cache decorator
         """
         return_invalidator = options.get('invalidator', False) is True
+        expiration = options.get('expiration', DEFAULT_EXPIRATION)
+        local = options.get('local_cache', self.local_cache)
+        if local is False:
+            local = None
+        local_ttl = min(options.get('local_ttl', expiration), expiration)
+        single_flight = options.get('single_flight')
+        if single_flight not in SINGLE_FLIGHT_MODES:
+            raise ValueError(
+                'single_flight must be one of %s' % (SINGLE_FLIGHT_MODES,))
+        lock_timeout = options.get('lock_timeout', DEFAULT_LOCK_TIMEOUT)
+        lock_wait = options.get('lock_wait', lock_timeout)
+        soft_expiration = options.get('soft_expiration')
+        early_refresh = options.get('early_refresh')
+        if early_refresh is True:
+            early_refresh = 1.0
+        with_metadata = soft_expiration is not None or bool(early_refresh)
+        if soft_expiration is not None:
+            local_ttl = min(local_ttl, soft_expiration)
+        write_behind = self.write_behind
+        if options.get('write_behind', True) is False:
+            write_behind = None
+        codec = self.codec
+        if any(name in options for name in
+               ('serializer', 'compression', 'compress_threshold')):
+            codec = Codec(
+                options.get('serializer', self.serializer),
+                options.get('compression', self.compression),
+                options.get('compress_threshold', self.compress_threshold))
+        admission = AdmissionPolicy.from_options(options)
+        negative_policy = negative.NegativeCaching.from_options(options)
+        stream = options.get('stream')
+        if stream is True:
+            stream = streaming.DEFAULT_CHUNK_SIZE
+        namespace = options.get('namespace')
+        tags = options.get('tags')
+        if isinstance(tags, str):
+            tags = (tags,)
 
         def cache_inside(fn, **kwargs):
-            @functools.wraps(fn)
+            fn_metrics = self.metrics.for_function(keys.function_id(fn))
+            make_key = self._key_function(fn, options)
+            fn_namespace = keys.function_id(fn) if namespace is True \
+                else namespace
+            scope_names = self._scope_names(fn_namespace, tags)
+            if not asyncio.iscoroutinefunction(fn) and \
+                    isinstance(self.backend, AsyncBackend):
+                raise ValueError(
+                    '%s is not a coroutine function, it can\'t be cached in '
+                    'an AsyncBackend' % keys.function_id(fn))
+            if stream:
+                if asyncio.iscoroutinefunction(fn) or \
+                        single_flight is not None or with_metadata or \
+                        admission is not None or negative_policy is not None:
+                    raise ValueError(
+                        'stream is not supported for coroutine functions, '
+                        'nor with single_flight, soft_expiration, '
+                        'early_refresh, admission or negative caching')
+                wrapper = self._cache_stream(
+                    fn, make_key, expiration, codec, fn_metrics, scope_names,
+                    stream, return_invalidator)
+                wrapper.cache_namespace = fn_namespace
+                return wrapper
+            if asyncio.iscoroutinefunction(fn):
+                if single_flight is not None or with_metadata:
+                    raise ValueError(
+                        'single_flight, soft_expiration and early_refresh '
+                        'are not supported for coroutine functions')
+                wrapper = self._cache_coroutine(
+                    fn, options, expiration, local, local_ttl, codec,
+                    fn_metrics, scope_names, admission, negative_policy,
+                    return_invalidator)
+                wrapper.cache_namespace = fn_namespace
+                return wrapper
+
+            # Bound once, so a hit only binds its key
+            invalidate = functools.partial(
+                self.invalidate_cache, local_cache=local,
+                fn_metrics=fn_metrics)
+
+            def with_invalidator(value, fn_hash):
+                if type(value) is CachedException:
+                    raise value.exception
+                if return_invalidator:
+                    return value, functools.partial(invalidate, fn_hash)
+                return value
+
+            def call_uncached(args, kwargs):
+                # If the backend fails, just execute the function as normal
+                if return_invalidator:
+                    return fn(*args, **kwargs), None
+                return fn(*args, **kwargs)
+
+            def encode(ret, start, now):
+                """
+                :return: (serialized value, value to store in the backend)
+                """
+                pickled_ret = codec.dumps(ret)
+                fn_metrics.computed(now - start, len(pickled_ret))
+                if with_metadata:
+                    return pickled_ret, metadata.pack(
+                        pickled_ret, now + (soft_expiration or expiration),
+                        now - start)
+                return pickled_ret, pickled_ret
+
+            def ttl_for(ret):
+                if negative_policy is None:
+                    return expiration
+                return negative_policy.ttl(ret, expiration)
+
+            def local_ttl_for(value):
+                if negative_policy is None:
+                    return local_ttl
+                if type(value) is negative.CachedException:
+                    return min(local_ttl, negative_policy.exception_ttl)
+                return min(local_ttl, ttl_for(value))
+
+            def write_later(fn_hash, ret, start, now):
+                write_behind.submit(
+                    fn_hash, ret,
+                    lambda value: encode_admitted(value, start, now),
+                    ttl_for(ret), remember_written)
+
+            def encode_admitted(ret, start, now):
+                stored = encode(ret, start, now)[1]
+                if admission is not None and self._rejected(
+                        fn_metrics, admission.check_size(len(stored))):
+                    return None
+                return stored
+
+            def remember_written(fn_hash, ret, stored):
+                if local is not None:
+                    local.set(fn_hash, ret, len(stored), local_ttl_for(ret))
+
+            def store_exception(fn_hash, exception):
+                data = negative.pack_exception(exception)
+                if data is None:
+                    return
+                try:
+                    started = time.perf_counter()
+                    self.backend.set_cache_and_expire(
+                        fn_hash, data, negative_policy.exception_ttl)
+                    fn_metrics.backend_latency(
+                        'set', time.perf_counter() - started)
+                except BackendException as e:
+                    # The function's exception is raised either way
+                    fn_metrics.error(e)
+                    return
+                if local is not None:
+                    cached = negative.CachedException(exception)
+                    local.set(fn_hash, cached, len(data),
+                              local_ttl_for(cached))
+
+            def store(fn_hash, args, kwargs):
+                start = time.time()
+                try:
+                    ret = fn(*args, **kwargs)
+                except Exception as e:
+                    if negative_policy is not None and \
+                            negative_policy.caches(e):
+                        store_exception(fn_hash, e)
+                    raise
+                now = time.time()
+                if admission is not None and self._rejected(
+                        fn_metrics,
+                        admission.check(fn_hash, ret, now - start)):
+                    return ret
+                if write_behind is not None:
+                    write_later(fn_hash, ret, start, now)
+                    return ret
+                pickled_ret, stored = encode(ret, start, now)
+                if admission is not None and self._rejected(
+                        fn_metrics, admission.check_size(len(stored))):
+                    return ret
+                started = time.perf_counter()
+                self.backend.set_cache_and_expire(
+                    fn_hash, stored, ttl_for(ret)
+                )
+                fn_metrics.backend_latency(
+                    'set', time.perf_counter() - started)
+                if local is not None:
+                    local.set(fn_hash, ret, len(pickled_ret),
+                              local_ttl_for(ret))
+                return ret
+
+            def load_hit(fn_hash, args, kwargs, cache_request):
+                payload, soft_expires_at, compute_time = \
+                    metadata.unpack(cache_request)
+                cache_hit = negative.decode(codec, payload)
+                if soft_expires_at is not None and _is_stale(
+                        soft_expires_at, compute_time, early_refresh):
+                    # Serve the stale value and recompute it in the
+                    # background
+                    self._refresh_in_background(fn_hash, functools.partial(
+                        fill, fn_hash, args, kwargs))
+                if local is not None:
+                    local.set(fn_hash, cache_hit, len(cache_request),
+                              local_ttl_for(cache_hit))
+                return cache_hit
+
+            def locked_store(fn_hash, args, kwargs):
+                # Only the process holding the backend lock computes, the
+                # others wait for it to write the result
+                lock_key = fn_hash + LOCK_SUFFIX
+                token = self.backend.acquire_lock(lock_key, lock_timeout)
+                if token is not None:
+                    try:
+                        return store(fn_hash, args, kwargs)
+                    finally:
+                        self.backend.release_lock(lock_key, token)
+                cache_request = self._wait_for_fill(fn_hash, lock_wait)
+                if cache_request is None:
+                    return store(fn_hash, args, kwargs)
+                return load_hit(fn_hash, args, kwargs, cache_request)
+
+            def fill(fn_hash, args, kwargs):
+                if single_flight is None:
+                    return store(fn_hash, args, kwargs)
+                compute = store if single_flight == 'local' else locked_store
+                return self._single_flight.run(
+                    fn_hash, functools.partial(compute, fn_hash, args, kwargs),
+                    lock_wait)
+
+            def lean_wrapper(*args, **kwargs):
+                # Used when the backend is the only tier and nothing but the
+                # value is cached, so none of the other checks apply
+                fn_hash = make_key(args, kwargs)
+                try:
+                    started = time.perf_counter()
+                    cache_request = self.backend.get_cache(fn_hash)
+                    fn_metrics.backend_latency(
+                        'get', time.perf_counter() - started)
+                    if cache_request is None or cache_request == '':
+                        self.backend_misses += 1
+                        fn_metrics.miss()
+                        ret = store(fn_hash, args, kwargs)
+                    else:
+                        self.backend_hits += 1
+                        fn_metrics.hit('backend')
+                        # Without soft expiration, metadata left by an
+                        # earlier configuration is ignored
+                        ret = negative.decode(
+                            codec, metadata.unpack(cache_request)[0])
+                except BackendException as e:
+                    fn_metrics.error(e)
+                    return call_uncached(args, kwargs)
+                return with_invalidator(ret, fn_hash)
+
             def wrapper(*args, **kwargs):
-                fn_hash = self._generate_cache_key(fn, args, kwargs, **options)
+                fn_hash = make_key(args, kwargs)
+                if scope_names is not None:
+                    scoped = self._scope_keys(
+                        [(fn_hash, scope_names(args, kwargs))], fn_metrics)
+                    if scoped is None:
+                        return call_uncached(args, kwargs)
+                    fn_hash = scoped[0]
+                if local is not None:
+                    local_hit = local.get(fn_hash, _MISSING)
+                    if local_hit is not _MISSING:
+                        fn_metrics.hit('local')
+                        return with_invalidator(local_hit, fn_hash)
+                if write_behind is not None:
+                    # Computed here, but not written yet
+                    pending = write_behind.pending(fn_hash, _MISSING)
+                    if pending is not _MISSING:
+                        fn_metrics.hit('local')
+                        return with_invalidator(pending, fn_hash)
+                breaker = self.circuit_breaker
+                if breaker is not None and not breaker.allow():
+                    fn_metrics.short_circuit()
+                    return call_uncached(args, kwargs)
+                failed = False
                 try:
+                    started = time.perf_counter()
                     cache_request = self.backend.get_cache(fn_hash)
-                    # TODO
-                    if cache_request is '':
+                    fn_metrics.backend_latency(
+                        'get', time.perf_counter() - started)
+                    if _is_cache_miss(cache_request):
                         # Cache miss
-                        ret = fn(*args, **kwargs)
-                        pickled_ret = pickle.dumps(ret)
-                        self.backend.set_cache_and_expire(
-                            fn_hash, pickled_ret, options.get(
-                                'expiration', DEFAULT_EXPIRATION)
-                        )
+                        self.backend_misses += 1
+                        fn_metrics.miss()
+                        ret = fill(fn_hash, args, kwargs)
                     else:
                         # Cache hit
-                        cache_hit = pickle.loads(cache_request)
-                        if return_invalidator:
-                            return cache_hit, functools.partial(
-                                self.invalidate_cache, fn_hash)
-                        else:
-                            return cache_hit
-                except BackendException:
-                    # If the backend fails, just execute the function as normal
-                    if return_invalidator:
-                        return fn(*args, **kwargs), None
+                        self.backend_hits += 1
+                        fn_metrics.hit('backend')
+                        cache_hit = load_hit(
+                            fn_hash, args, kwargs, cache_request)
+                        return with_invalidator(cache_hit, fn_hash)
+                except BackendException as e:
+                    failed = True
+                    fn_metrics.error(e)
+                    return call_uncached(args, kwargs)
+                finally:
+                    if breaker is not None:
+                        _record_outcome(breaker, failed)
+                return with_invalidator(ret, fn_hash)
+
+            if scope_names is None and local is None and \
+                    write_behind is None and self.circuit_breaker is None and \
+                    negative_policy is None and admission is None and \
+                    single_flight is None and not with_metadata:
+                wrapper = lean_wrapper
+            wrapper = functools.wraps(fn)(wrapper)
+
+            def cache_map(args_list):
+                """
+                Calls the decorated function once per tuple of positional
+                arguments, resolving every cache key in one backend round
+                trip and computing only the misses
+                :param args_list: Iterable of tuples of positional arguments
+                :return: List of results in the order of args_list
+                """
+                return map_calls(args_list, None, False)
+
+            def warm_batch(args_list, on_compute=None):
+                """
+                Computes and writes the results of a batch of calls that are
+                missing from the cache, for Cache.warm
+                :param args_list: Iterable of tuples of positional arguments
+                :param on_compute: Optional callable called before each call
+                of the function
+                :raises BackendException: If the batch couldn't be looked up,
+                in which case the function isn't called, or written
+                """
+                if write_behind is None:
+                    map_calls(args_list, on_compute, True)
+                    return
+                lost = write_behind.errors + write_behind.dropped
+                map_calls(args_list, on_compute, True)
+                write_behind.flush()
+                if write_behind.errors + write_behind.dropped > lost:
+                    raise BackendException('Unable to write the batch')
+
+            def map_calls(args_list, on_compute, raise_errors):
+                calls = [tuple(args) for args in args_list]
+                keys = [make_key(args, {}) for args in calls]
+                if scope_names is not None:
+                    keys = self._scope_keys(
+                        [(key, scope_names(args, {}))
+                         for key, args in zip(keys, calls)], fn_metrics)
+                    if keys is None:
+                        if raise_errors:
+                            raise BackendException(
+                                'Unable to read the generations of the batch')
+                        return [call_uncached(args, {}) for args in calls]
+
+                results = {}
+                remote = {}
+                for key, args in zip(keys, calls):
+                    if key in results or key in remote:
+                        continue
+                    if local is not None:
+                        local_hit = local.get(key, _MISSING)
+                        if local_hit is not _MISSING:
+                            fn_metrics.hit('local')
+                            results[key] = local_hit
+                            continue
+                    if write_behind is not None:
+                        pending = write_behind.pending(key, _MISSING)
+                        if pending is not _MISSING:
+                            fn_metrics.hit('local')
+                            results[key] = pending
+                            continue
+                    remote[key] = args
+
+                remote_keys = list(remote)
+                # Calls served without the backend neither probe nor spend the
+                # circuit breaker's half-open calls
+                breaker = self.circuit_breaker if remote_keys else None
+                allowed = breaker is None or breaker.allow()
+                failed = False
+                try:
+                    cached = None
+                    if not remote_keys:
+                        cached = []
+                    elif not allowed:
+                        fn_metrics.short_circuit()
                     else:
-                        return fn(*args, **kwargs)
-                if return_invalidator:
-                    return \
-                        ret, functools.partial(self.invalidate_cache, fn_hash)
-                else:
-                    return ret
+                        try:
+                            started = time.perf_counter()
+                            cached = self.backend.get_many(remote_keys)
+                            fn_metrics.backend_latency(
+                                'get_many', time.perf_counter() - started)
+                        except BackendException as e:
+                            failed = True
+                            fn_metrics.error(e)
+                    if cached is None and raise_errors:
+                        raise BackendException(
+                            'Unable to look up the batch')
+
+                    misses = {}
+                    for index, key in enumerate(remote_keys):
+                        if cached is None or _is_cache_miss(cached[index]):
+                            misses[key] = remote[key]
+                            continue
+                        self.backend_hits += 1
+                        fn_metrics.hit('backend')
+                        results[key] = load_hit(
+                            key, remote[key], {}, cached[index])
+
+                    pickled = {}
+                    stored = {}
+                    for key, args in misses.items():
+                        if on_compute is not None:
+                            on_compute()
+                        start = time.time()
+                        results[key] = fn(*args)
+                        if cached is None:
+                            continue
+                        now = time.time()
+                        self.backend_misses += 1
+                        fn_metrics.miss()
+                        if admission is not None and self._rejected(
+                                fn_metrics, admission.check(
+                                    key, results[key], now - start)):
+                            continue
+                        if write_behind is not None:
+                            write_later(key, results[key], start, now)
+                            continue
+                        pickled_ret, stored_ret = encode(
+                            results[key], start, now)
+                        if admission is not None and self._rejected(
+                                fn_metrics,
+                                admission.check_size(len(stored_ret))):
+                            continue
+                        pickled[key] = pickled_ret
+                        stored.setdefault(ttl_for(results[key]), {})[key] = \
+                            stored_ret
+                    for ttl, mapping in stored.items():
+                        try:
+                            started = time.perf_counter()
+                            self.backend.set_many_and_expire(mapping, ttl)
+                            fn_metrics.backend_latency(
+                                'set_many', time.perf_counter() - started)
+                        except BackendException as e:
+                            failed = True
+                            fn_metrics.error(e)
+                    if local is not None:
+                        for key, value in pickled.items():
+                            local.set(key, results[key], len(value),
+                                      local_ttl_for(results[key]))
+                    if failed and raise_errors:
+                        raise BackendException('Unable to write the batch')
+                finally:
+                    if breaker is not None and allowed:
+                        _record_outcome(breaker, failed)
+
+                if return_invalidator and cached is None:
+                    return [(negative.raise_cached(results[key]), None)
+                            for key in keys]
+                return [with_invalidator(results[key], key) for key in keys]
+
+            wrapper.map = cache_map
+            wrapper.cache_warm_batch = warm_batch
+            wrapper.cache_namespace = fn_namespace
             return wrapper
         return cache_inside
 
-    def invalidate_cache(self, cache_key):
+    def _cache_coroutine(self, fn, options, expiration, local, local_ttl,
+                         codec, fn_metrics, scope_names, admission,
+                         negative_policy, return_invalidator):
+        """
+        Builds the wrapper for an `async def` function. Backend methods are
+        awaited when they return awaitables, so both AsyncBackend and
+        non-blocking Backend implementations can be used
+        """
+        make_key = self._key_function(fn, options)
+
+        def with_invalidator(value, fn_hash):
+            value = negative.raise_cached(value)
+            if return_invalidator:
+                return value, functools.partial(
+                    self.invalidate_cache_async, fn_hash, local, fn_metrics)
+            return value
+
+        def ttl_for(ret):
+            if negative_policy is None:
+                return expiration
+            return negative_policy.ttl(ret, expiration)
+
+        def local_ttl_for(value):
+            if negative_policy is None:
+                return local_ttl
+            if type(value) is negative.CachedException:
+                return min(local_ttl, negative_policy.exception_ttl)
+            return min(local_ttl, ttl_for(value))
+
+        async def compute_or_cache_exception(fn_hash, args, kwargs):
+            try:
+                return await compute(args, kwargs)
+            except Exception as e:
+                if negative_policy is None or not negative_policy.caches(e):
+                    raise
+                data = negative.pack_exception(e)
+                if data is None:
+                    raise
+                try:
+                    await _resolve(self.backend.set_cache_and_expire(
+                        fn_hash, data, negative_policy.exception_ttl))
+                except BackendException as error:
+                    # The function's exception is raised either way
+                    fn_metrics.error(error)
+                    raise e
+                if local is not None:
+                    cached = negative.CachedException(e)
+                    local.set(fn_hash, cached, len(data),
+                              local_ttl_for(cached))
+                raise
+
+        async def call_uncached(args, kwargs):
+            # If the backend fails, just execute the function as normal
+            if return_invalidator:
+                return await fn(*args, **kwargs), None
+            return await fn(*args, **kwargs)
+
+        async def compute(args, kwargs):
+            start = time.perf_counter()
+            ret = await fn(*args, **kwargs)
+            return ret, time.perf_counter() - start
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            fn_hash = make_key(args, kwargs)
+            if scope_names is not None:
+                scoped = await self._scope_keys_async(
+                    [(fn_hash, scope_names(args, kwargs))], fn_metrics)
+                if scoped is None:
+                    return await call_uncached(args, kwargs)
+                fn_hash = scoped[0]
+            if local is not None:
+                local_hit = local.get(fn_hash, _MISSING)
+                if local_hit is not _MISSING:
+                    fn_metrics.hit('local')
+                    return with_invalidator(local_hit, fn_hash)
+            breaker = self.circuit_breaker
+            if breaker is not None and not breaker.allow():
+                fn_metrics.short_circuit()
+                return await call_uncached(args, kwargs)
+            failed = False
+            try:
+                started = time.perf_counter()
+                cache_request = await _resolve(
+                    self.backend.get_cache(fn_hash))
+                fn_metrics.backend_latency(
+                    'get', time.perf_counter() - started)
+                if _is_cache_miss(cache_request):
+                    # Cache miss
+                    self.backend_misses += 1
+                    fn_metrics.miss()
+                    ret, compute_time = await compute_or_cache_exception(
+                        fn_hash, args, kwargs)
+                    if admission is not None and self._rejected(
+                            fn_metrics,
+                            admission.check(fn_hash, ret, compute_time)):
+                        return with_invalidator(ret, fn_hash)
+                    pickled_ret = codec.dumps(ret)
+                    fn_metrics.computed(compute_time, len(pickled_ret))
+                    if admission is not None and self._rejected(
+                            fn_metrics,
+                            admission.check_size(len(pickled_ret))):
+                        return with_invalidator(ret, fn_hash)
+                    started = time.perf_counter()
+                    await _resolve(self.backend.set_cache_and_expire(
+                        fn_hash, pickled_ret, ttl_for(ret)))
+                    fn_metrics.backend_latency(
+                        'set', time.perf_counter() - started)
+                else:
+                    # Cache hit
+                    self.backend_hits += 1
+                    fn_metrics.hit('backend')
+                    ret = negative.decode(codec, cache_request)
+                    pickled_ret = cache_request
+            except BackendException as e:
+                failed = True
+                fn_metrics.error(e)
+                return await call_uncached(args, kwargs)
+            finally:
+                if breaker is not None:
+                    _record_outcome(breaker, failed)
+            if local is not None:
+                local.set(fn_hash, ret, len(pickled_ret), local_ttl_for(ret))
+            return with_invalidator(ret, fn_hash)
+
+        async def cache_map(args_list):
+            """
+            Coroutine version of map, computing the misses concurrently
+            :param args_list: Iterable of tuples of positional arguments
+            :return: List of results in the order of args_list
+            """
+            calls = [tuple(args) for args in args_list]
+            keys = [make_key(args, {}) for args in calls]
+            if scope_names is not None:
+                keys = await self._scope_keys_async(
+                    [(key, scope_names(args, {}))
+                     for key, args in zip(keys, calls)], fn_metrics)
+                if keys is None:
+                    return [await call_uncached(args, {}) for args in calls]
+
+            results = {}
+            remote = {}
+            for key, args in zip(keys, calls):
+                if key in results or key in remote:
+                    continue
+                if local is not None:
+                    local_hit = local.get(key, _MISSING)
+                    if local_hit is not _MISSING:
+                        fn_metrics.hit('local')
+                        results[key] = local_hit
+                        continue
+                remote[key] = args
+
+            remote_keys = list(remote)
+            # Calls served without the backend neither probe nor spend the
+            # circuit breaker's half-open calls
+            breaker = self.circuit_breaker if remote_keys else None
+            allowed = breaker is None or breaker.allow()
+            failed = False
+            try:
+                cached = None
+                if not remote_keys:
+                    cached = []
+                elif not allowed:
+                    fn_metrics.short_circuit()
+                else:
+                    try:
+                        started = time.perf_counter()
+                        cached = await _resolve(
+                            self.backend.get_many(remote_keys))
+                        fn_metrics.backend_latency(
+                            'get_many', time.perf_counter() - started)
+                    except BackendException as e:
+                        failed = True
+                        fn_metrics.error(e)
+
+                misses = []
+                for index, key in enumerate(remote_keys):
+                    if cached is None or _is_cache_miss(cached[index]):
+                        misses.append(key)
+                        continue
+                    self.backend_hits += 1
+                    fn_metrics.hit('backend')
+                    results[key] = negative.decode(codec, cached[index])
+                    if local is not None:
+                        local.set(key, results[key], len(cached[index]),
+                                  local_ttl_for(results[key]))
+
+                computed = await asyncio.gather(
+                    *[compute(remote[key], {}) for key in misses])
+                compute_times = {}
+                for key, (ret, compute_time) in zip(misses, computed):
+                    results[key] = ret
+                    compute_times[key] = compute_time
+                if misses and cached is not None:
+                    self.backend_misses += len(misses)
+                    pickled = {}
+                    for key in misses:
+                        fn_metrics.miss()
+                        if admission is not None and self._rejected(
+                                fn_metrics, admission.check(
+                                    key, results[key], compute_times[key])):
+                            continue
+                        data = codec.dumps(results[key])
+                        fn_metrics.computed(compute_times[key], len(data))
+                        if admission is not None and self._rejected(
+                                fn_metrics, admission.check_size(len(data))):
+                            continue
+                        pickled.setdefault(
+                            ttl_for(results[key]), {})[key] = data
+                    for ttl, mapping in pickled.items():
+                        try:
+                            started = time.perf_counter()
+                            await _resolve(self.backend.set_many_and_expire(
+                                mapping, ttl))
+                            fn_metrics.backend_latency(
+                                'set_many', time.perf_counter() - started)
+                        except BackendException as e:
+                            failed = True
+                            fn_metrics.error(e)
+                        if local is not None:
+                            for key, value in mapping.items():
+                                local.set(key, results[key], len(value),
+                                          local_ttl_for(results[key]))
+            finally:
+                if breaker is not None and allowed:
+                    _record_outcome(breaker, failed)
+
+            if return_invalidator and cached is None:
+                return [(negative.raise_cached(results[key]), None)
+                        for key in keys]
+            return [with_invalidator(results[key], key) for key in keys]
+
+        wrapper.map = cache_map
+        return wrapper
+
+    def _cache_stream(self, fn, make_key, expiration, codec, fn_metrics,
+                      scope_names, chunk_size, return_invalidator):
+        """
+        Builds the wrapper of a function whose results are iterated and
+        cached chunk by chunk, see cache_deco.streaming. The wrapper returns
+        an iterator, reading chunks from the backend only as it is consumed
+        """
+        def with_invalidator(value, fn_hash):
+            if return_invalidator:
+                return value, functools.partial(
+                    self.invalidate_cache, fn_hash, None, fn_metrics)
+            return value
+
+        def call_uncached(args, kwargs):
+            # If the backend fails, just execute the function as normal
+            if return_invalidator:
+                return iter(fn(*args, **kwargs)), None
+            return iter(fn(*args, **kwargs))
+
+        def write_failed(exception):
+            fn_metrics.error(exception)
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record_failure()
+
+        def write(fn_hash, args, kwargs, skip):
+            """
+            Yields the items of a call from the `skip`th one, writing every
+            item to the backend a chunk at a time. Only one chunk is held in
+            memory, and nothing is cached if the caller stops early
+            """
+            start = time.time()
+            write_id = streaming.new_write_id()
+            chunk = []
+            chunks = count = size = 0
+            writing = True
+            for item in fn(*args, **kwargs):
+                if count >= skip:
+                    yield item
+                count += 1
+                if not writing:
+                    continue
+                chunk.append(item)
+                if len(chunk) < chunk_size:
+                    continue
+                data = codec.dumps(chunk)
+                chunk = []
+                try:
+                    started = time.perf_counter()
+                    self.backend.set_cache_and_expire(
+                        streaming.chunk_key(fn_hash, write_id, chunks), data,
+                        expiration)
+                    fn_metrics.backend_latency(
+                        'set', time.perf_counter() - started)
+                except BackendException as e:
+                    write_failed(e)
+                    writing = False
+                    continue
+                chunks += 1
+                size += len(data)
+            if not writing:
+                return
+            # The manifest is written last, once every chunk is
+            mapping = {}
+            if chunk:
+                data = codec.dumps(chunk)
+                mapping[streaming.chunk_key(fn_hash, write_id, chunks)] = data
+                chunks += 1
+                size += len(data)
+            mapping[fn_hash] = streaming.pack_manifest(write_id, chunks)
+            try:
+                started = time.perf_counter()
+                self.backend.set_many_and_expire(mapping, expiration)
+                fn_metrics.backend_latency(
+                    'set_many', time.perf_counter() - started)
+            except BackendException as e:
+                write_failed(e)
+                return
+            fn_metrics.computed(time.time() - start, size)
+
+        def read(fn_hash, args, kwargs, write_id, chunks):
+            count = 0
+            for first in range(0, chunks, streaming.PREFETCH_CHUNKS):
+                names = [streaming.chunk_key(fn_hash, write_id, index)
+                         for index in range(first, min(
+                             chunks, first + streaming.PREFETCH_CHUNKS))]
+                try:
+                    started = time.perf_counter()
+                    values = self.backend.get_many(names)
+                    fn_metrics.backend_latency(
+                        'get_many', time.perf_counter() - started)
+                except BackendException as e:
+                    fn_metrics.error(e)
+                    yield from itertools.islice(
+                        fn(*args, **kwargs), count, None)
+                    return
+                for value in values:
+                    if _is_cache_miss(value):
+                        # A chunk expired or was evicted, so compute the rest
+                        # and store the whole result again
+                        yield from write(fn_hash, args, kwargs, count)
+                        return
+                    for item in codec.loads(value):
+                        yield item
+                        count += 1
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            fn_hash = make_key(args, kwargs) + streaming.KEY_SUFFIX
+            if scope_names is not None:
+                scoped = self._scope_keys(
+                    [(fn_hash, scope_names(args, kwargs))], fn_metrics)
+                if scoped is None:
+                    return call_uncached(args, kwargs)
+                fn_hash = scoped[0]
+            breaker = self.circuit_breaker
+            if breaker is not None and not breaker.allow():
+                fn_metrics.short_circuit()
+                return call_uncached(args, kwargs)
+            failed = False
+            try:
+                started = time.perf_counter()
+                cache_request = self.backend.get_cache(fn_hash)
+                fn_metrics.backend_latency(
+                    'get', time.perf_counter() - started)
+            except BackendException as e:
+                failed = True
+                fn_metrics.error(e)
+                return call_uncached(args, kwargs)
+            finally:
+                if breaker is not None:
+                    _record_outcome(breaker, failed)
+            manifest = None
+            if not _is_cache_miss(cache_request):
+                manifest = streaming.unpack_manifest(cache_request)
+            if manifest is None:
+                self.backend_misses += 1
+                fn_metrics.miss()
+                return with_invalidator(
+                    write(fn_hash, args, kwargs, 0), fn_hash)
+            self.backend_hits += 1
+            fn_metrics.hit('backend')
+            return with_invalidator(
+                read(fn_hash, args, kwargs, *manifest), fn_hash)
+
+        return wrapper
+
+    def invalidate_cache(self, cache_key, local_cache=None,
+                         fn_metrics=None):
         """
         Creates the invalidator to be returned when requested to invalidate
         the cache
         :param cache_key: The cache key to invalidate
+        :param local_cache: The in-process tier holding the key, defaults to
+        the Cache's own
+        :param fn_metrics: FunctionMetrics of the function owning the key
         """
+        if local_cache is None:
+            local_cache = self.local_cache
+        # Discarded first, so a write landing meanwhile can't put the value
+        # back in the in-process tier
+        if self.write_behind is not None:
+            self.write_behind.discard(cache_key)
+        if local_cache is not None:
+            local_cache.invalidate(cache_key)
+        if fn_metrics is not None:
+            fn_metrics.invalidation()
+        started = time.perf_counter()
         self.backend.invalidate_key(cache_key)
+        if fn_metrics is not None:
+            fn_metrics.backend_latency(
+                'invalidate', time.perf_counter() - started)
+
+    def invalidate_function(self, fn):
+        """
+        Invalidates every cached result of a function decorated with a
+        namespace, and of any other function sharing it, by bumping the
+        namespace's generation
+        :param fn: The decorated function
+        """
+        self.invalidate_namespace(self._namespace_of(fn))
+        self.metrics.for_function(keys.function_id(fn)).invalidation()
+
+    def invalidate_namespace(self, namespace):
+        """
+        Invalidates every cached result of the functions decorated with a
+        namespace
+        :param namespace: The namespace
+        """
+        self.generations.bump(namespace_name(namespace))
+
+    def invalidate_tag(self, tag):
+        """
+        Invalidates every cached result tagged with tag, across functions
+        :param tag: The tag
+        """
+        self.generations.bump(tag_name(tag))
+
+    def _namespace_of(self, fn):
+        namespace = getattr(fn, 'cache_namespace', None)
+        if namespace is None:
+            raise ValueError(
+                '%s was not decorated with a cache namespace' % (
+                    keys.function_id(fn),))
+        return namespace
+
+    def _scope_names(self, namespace, tags):
+        """
+        :param namespace: The function's namespace, or None
+        :param tags: Iterable of tags, or a callable taking the function's
+        arguments and returning its tags, or None
+        :return: Callable taking a call's args and kwargs and returning the
+        names of the generations folded into its key, or None if the
+        function has neither a namespace nor tags
+        """
+        if namespace is None and not tags:
+            return None
+        static = [] if namespace is None else [namespace_name(namespace)]
+        if not callable(tags):
+            static = static + [tag_name(tag) for tag in tags or ()]
+            return lambda args, kwargs: static
+
+        def names(args, kwargs):
+            return static + [tag_name(tag) for tag in tags(*args, **kwargs)]
+        return names
+
+    def _generations_needed(self, calls, fn_metrics):
+        """
+        :param calls: List of (cache key, generation names)
+        :return: (names of the generations, the generations if known
+        without a backend read, whether the backend may be read)
+        """
+        names = list(dict.fromkeys(
+            name for _, call_names in calls for name in call_names))
+        generations = self.generations.cached(names)
+        breaker = self.circuit_breaker
+        if generations is None and breaker is not None and \
+                breaker.state == OPEN:
+            fn_metrics.short_circuit()
+            return names, None, False
+        return names, generations, True
+
+    def _rejected(self, fn_metrics, reason):
+        """
+        Counts a result kept out of the cache by the admission policy
+        :param reason: Reason returned by the policy, None if admitted
+        :return: True if the result is rejected
+        """
+        if reason is None:
+            return False
+        fn_metrics.rejected(reason)
+        return True
+
+    def _generations_failed(self, exception, fn_metrics):
+        fn_metrics.error(exception)
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_failure()
+
+    def _scope_keys(self, calls, fn_metrics):
+        """
+        Folds the generations of each call's namespace and tags into its
+        cache key
+        :param calls: List of (cache key, generation names)
+        :param fn_metrics: FunctionMetrics of the decorated function
+        :return: List of scoped keys, or None if the generations could not
+        be read and the function should be called uncached
+        """
+        names, generations, allowed = self._generations_needed(
+            calls, fn_metrics)
+        if not allowed:
+            return None
+        if generations is None:
+            try:
+                started = time.perf_counter()
+                generations = self.generations.fetch(names)
+                fn_metrics.backend_latency(
+                    'get_many', time.perf_counter() - started)
+            except BackendException as e:
+                self._generations_failed(e, fn_metrics)
+                return None
+        return [Generations.scope(key, call_names, generations)
+                for key, call_names in calls]
+
+    async def _scope_keys_async(self, calls, fn_metrics):
+        """
+        Coroutine version of _scope_keys
+        """
+        names, generations, allowed = self._generations_needed(
+            calls, fn_metrics)
+        if not allowed:
+            return None
+        if generations is None:
+            try:
+                started = time.perf_counter()
+                generations = await self.generations.fetch_async(names)
+                fn_metrics.backend_latency(
+                    'get_many', time.perf_counter() - started)
+            except BackendException as e:
+                self._generations_failed(e, fn_metrics)
+                return None
+        return [Generations.scope(key, call_names, generations)
+                for key, call_names in calls]
+
+    def _refresh_in_background(self, cache_key, compute):
+        """
+        Recomputes a stale key on the refresh thread pool, unless a refresh
+        of the same key is already queued or running in this process
+        :param cache_key: The stale cache key
+        :param compute: Callable computing and storing the new value
+        """
+        with self._refresh_lock:
+            if cache_key in self._refreshing:
+                return
+            self._refreshing.add(cache_key)
+            if self._refresh_executor is None:
+                self._refresh_executor = ThreadPoolExecutor(
+                    max_workers=self.refresh_workers)
+
+        def refresh():
+            try:
+                compute()
+            except Exception:
+                # The stale value keeps being served until it hard expires
+                pass
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(cache_key)
+
+        self._refresh_executor.submit(refresh)
+
+    def _wait_for_fill(self, cache_key, timeout):
+        """
+        Polls the backend with exponential backoff until another process
+        fills the key
+        :param cache_key: The cache key being filled
+        :param timeout: Maximum number of seconds to wait
+        :return: The cached value, or None if the wait timed out
+        """
+        deadline = time.monotonic() + timeout
+        interval = LOCK_POLL_INTERVAL
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(interval, remaining))
+            cache_request = self.backend.get_cache(cache_key)
+            if not _is_cache_miss(cache_request):
+                return cache_request
+            interval = min(interval * 2, MAX_LOCK_POLL_INTERVAL)
+
+    async def invalidate_cache_async(self, cache_key, local_cache=None,
+                                     fn_metrics=None):
+        """
+        Coroutine version of invalidate_cache, for use with an AsyncBackend
+        :param cache_key: The cache key to invalidate
+        :param local_cache: The in-process tier holding the key, defaults to
+        the Cache's own
+        :param fn_metrics: FunctionMetrics of the function owning the key
+        """
+        if local_cache is None:
+            local_cache = self.local_cache
+        # Discarded first, so a write landing meanwhile can't put the value
+        # back in the in-process tier
+        if self.write_behind is not None:
+            self.write_behind.discard(cache_key)
+        if local_cache is not None:
+            local_cache.invalidate(cache_key)
+        if fn_metrics is not None:
+            fn_metrics.invalidation()
+        started = time.perf_counter()
+        await _resolve(self.backend.invalidate_key(cache_key))
+        if fn_metrics is not None:
+            fn_metrics.backend_latency(
+                'invalidate', time.perf_counter() - started)
+
+    async def invalidate_function_async(self, fn):
+        """
+        Coroutine version of invalidate_function, for use with an
+        AsyncBackend
+        :param fn: The decorated function
+        """
+        await self.invalidate_namespace_async(self._namespace_of(fn))
+        self.metrics.for_function(keys.function_id(fn)).invalidation()
+
+    async def invalidate_namespace_async(self, namespace):
+        """
+        Coroutine version of invalidate_namespace
+        :param namespace: The namespace
+        """
+        await self.generations.bump_async(namespace_name(namespace))
+
+    async def invalidate_tag_async(self, tag):
+        """
+        Coroutine version of invalidate_tag
+        :param tag: The tag
+        """
+        await self.generations.bump_async(tag_name(tag))
+
+    def warm(self, fn, args_list, concurrency=DEFAULT_CONCURRENCY,
+             batch_size=DEFAULT_BATCH_SIZE, rate=None, processes=False,
+             progress=None):
+        """
+        Preloads the results of a decorated function, computing only the
+        calls missing from the cache on a thread or process pool
+        :param fn: Function decorated by this Cache
+        :param args_list: Iterable of tuples of positional arguments
+        :param concurrency: Batches computed at once
+        :param batch_size: Calls looked up and written per backend round trip
+        :param rate: Maximum calls of the function per second, None for no
+        limit
+        :param processes: Compute on processes, see cache_deco.warm.preload
+        :param progress: Optional callable taking a WarmProgress after every
+        batch
+        :return: WarmProgress of the finished run
+        """
+        return preload(fn, args_list, concurrency, batch_size, rate,
+                       processes, progress)
+
+    def stats(self):
+        """
+        Hit and miss counters for each cache tier
+        :return: Dictionary of counter name to value
+        """
+        stats = {
+            'backend_hits': self.backend_hits,
+            'backend_misses': self.backend_misses,
+        }
+        if self.local_cache is not None:
+            stats['local_hits'] = self.local_cache.hits
+            stats['local_misses'] = self.local_cache.misses
+        if self.circuit_breaker is not None:
+            breaker_stats = self.circuit_breaker.stats()
+            stats['circuit_state'] = breaker_stats['state']
+            stats['circuit_trips'] = breaker_stats['trips']
+        if self.write_behind is not None:
+            for name, value in self.write_behind.stats().items():
+                stats['write_behind_' + name] = value
+        return stats
 
     def _default_signature_generator(*args, **kwargs):
         """
@@ -80,20 +1255,71 @@ class Cache(object):
         return ','.join(parsed)
 
     def _generate_cache_key(self, fn, fn_args=None, fn_kwargs=None, **options):
-        signature_generator = options.get(
-            'signature_generator',
-            self._default_signature_generator)
-
-        if not hasattr(signature_generator, '__call__'):
-            raise TypeError(
-                "signature_generator must be a callable function")
-
-        fn_args = fn_args or []
-        fn_kwargs = fn_kwargs or {}
-        fn_name = fn.__name__
-        signature = signature_generator(fn_args, **fn_kwargs)
-        fn_hash = str(hash(fn_name + signature))
-        return fn_hash
+        """
+        Builds the cache key of a call, a hex digest of the function's module
+        and qualified name and of its arguments, or of the custom signature
+        when a signature_generator is given
+        """
+        return self._key_function(fn, options)(fn_args or (), fn_kwargs or {})
+
+    def _key_function(self, fn, options):
+        """
+        Compiles the key generation of a decorated function once, with its
+        identity hashed and its options resolved
+        :return: Callable taking the positional and keyword arguments of a
+        call and returning its cache key
+        """
+        signature_generator = options.get('signature_generator')
+        hasher = keys.new_hasher(fn)
+        if signature_generator is None:
+            return functools.partial(keys.make_key, hasher)
+
+        if not callable(signature_generator):
+            def not_callable(fn_args, fn_kwargs):
+                raise TypeError(
+                    "signature_generator must be a callable function")
+            return not_callable
+
+        def signature_key(fn_args, fn_kwargs):
+            signature = signature_generator(fn_args, **fn_kwargs)
+            return keys.make_signature_key(hasher, signature)
+        return signature_key
+
+
+def _is_stale(soft_expires_at, compute_time, early_refresh):
+    """
+    Decides whether a cached value should be refreshed. With early refresh
+    the decision is probabilistic (XFetch): the closer the soft expiry and
+    the longer the value took to compute, the likelier a refresh
+    :param soft_expires_at: UNIX timestamp after which the value is stale
+    :param compute_time: Seconds it took to compute the value
+    :param early_refresh: XFetch beta, higher values refresh earlier
+    """
+    now = time.time()
+    if early_refresh:
+        # 1 - random() is in (0, 1] so the logarithm is defined
+        now -= compute_time * early_refresh * math.log(1.0 - random.random())
+    return now >= soft_expires_at
+
+
+async def _resolve(result):
+    # Awaits results of AsyncBackend methods, passes through plain values
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+def _record_outcome(breaker, failed):
+    if failed:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def _is_cache_miss(value):
+    # Backends report a miss as None, '' is still accepted for backends
+    # written against older releases
+    return value is None or value == ''
 
 
 def _argument_to_string(arg):
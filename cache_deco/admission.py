@@ -0,0 +1,148 @@
+"""
+Admission policies, deciding which computed results are worth writing to
+the cache. Cheap calls, huge results, unwanted values and keys seen only
+once can be kept out so they don't evict valuable keys
+"""
+
+# Reasons a result is rejected
+FAST = 'fast'
+LARGE = 'large'
+VALUE = 'value'
+RARE = 'rare'
+REASONS = (FAST, LARGE, VALUE, RARE)
+
+DEFAULT_SKETCH_WIDTH = 4096
+SKETCH_DEPTH = 4
+# Counters saturate at this value, like TinyLFU's 4 bit counters
+MAX_COUNT = 15
+
+
+class FrequencySketch(object):
+    """
+    Count-min sketch estimating how often keys were seen recently, as used
+    by TinyLFU. Every counter is halved once width * 10 keys were counted,
+    so old popularity fades. Estimates may be too high, never too low, and
+    concurrent increments may be lost, which only makes admission slightly
+    less precise
+    """
+
+    def __init__(self, width=DEFAULT_SKETCH_WIDTH):
+        """
+        :param width: Counters per row, rounded up to a power of two. Should
+        be around the number of keys expected to be live
+        """
+        size = 1
+        while size < width:
+            size *= 2
+        self.width = size
+        self.sample_size = size * 10
+        self._mask = size - 1
+        self._rows = [bytearray(size) for _ in range(SKETCH_DEPTH)]
+        self._additions = 0
+
+    def _indexes(self, key):
+        h = hash(key)
+        # Each row uses its own 16 bits of a mixed hash
+        mixed = (h * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        return [((mixed >> (16 * row)) ^ h) & self._mask
+                for row in range(SKETCH_DEPTH)]
+
+    def estimate(self, key):
+        """
+        :param key: A hashable key
+        :return: Estimated number of recent occurrences of the key
+        """
+        return min(row[index] for row, index
+                   in zip(self._rows, self._indexes(key)))
+
+    def increment(self, key):
+        """
+        Counts an occurrence of the key
+        :param key: A hashable key
+        :return: The key's new estimate
+        """
+        indexes = self._indexes(key)
+        estimate = min(row[index] for row, index in zip(self._rows, indexes))
+        if estimate < MAX_COUNT:
+            # Conservative update: only the smallest counters grow
+            for row, index in zip(self._rows, indexes):
+                if row[index] == estimate:
+                    row[index] = estimate + 1
+            estimate += 1
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._age()
+        return estimate
+
+    def _age(self):
+        self._additions //= 2
+        self._rows = [bytearray(count >> 1 for count in row)
+                      for row in self._rows]
+
+
+class AdmissionPolicy(object):
+    """
+    Decides whether a computed result is written to the cache
+    """
+
+    def __init__(self, min_compute_time=None, max_size=None, cache_if=None,
+                 sketch=None, min_frequency=2):
+        """
+        :param min_compute_time: Seconds a call must take for its result to
+        be cached
+        :param max_size: Largest serialized size in bytes that is cached
+        :param cache_if: Callable taking a result and returning whether to
+        cache it
+        :param sketch: FrequencySketch counting misses per key, to only
+        cache keys missed at least min_frequency times recently
+        :param min_frequency: Recent misses needed with a sketch
+        """
+        self.min_compute_time = min_compute_time
+        self.max_size = max_size
+        self.cache_if = cache_if
+        self.sketch = sketch
+        self.min_frequency = min_frequency
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        Builds the policy of a decorator from its options
+        :return: AdmissionPolicy, or None if no admission option is given
+        """
+        sketch = options.get('admission_sketch')
+        if sketch is True:
+            sketch = FrequencySketch()
+        policy = cls(options.get('min_compute_time'),
+                     options.get('max_size'), options.get('cache_if'),
+                     sketch or None, options.get('min_frequency', 2))
+        if policy.min_compute_time is None and policy.max_size is None and \
+                policy.cache_if is None and policy.sketch is None:
+            return None
+        return policy
+
+    def check(self, key, value, compute_time):
+        """
+        Checks a result before it is serialized
+        :param key: The cache key
+        :param value: The computed result
+        :param compute_time: Seconds it took to compute
+        :return: The reason to reject the result, or None to go on
+        """
+        if self.min_compute_time is not None and \
+                compute_time < self.min_compute_time:
+            return FAST
+        if self.cache_if is not None and not self.cache_if(value):
+            return VALUE
+        if self.sketch is not None and \
+                self.sketch.increment(key) < self.min_frequency:
+            return RARE
+        return None
+
+    def check_size(self, size):
+        """
+        :param size: Serialized size of the result in bytes
+        :return: The reason to reject the result, or None to cache it
+        """
+        if self.max_size is not None and size > self.max_size:
+            return LARGE
+        return None
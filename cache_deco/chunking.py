@@ -0,0 +1,278 @@
+"""
+Chunked storage for values larger than a backend should hold in one key.
+A large value is split into chunk keys, then a manifest holding the value's
+length and checksum is written under the value's own key. Readers fetch
+every chunk in one get_many and reassemble them into a single buffer; a
+missing or mismatched chunk makes the whole value a miss
+"""
+from backends.backend_base import AsyncBackend, Backend
+from cache_deco import streaming
+import math
+import struct
+import zlib
+
+# First byte of a manifest. Codec headers, pickles and the other markers
+# never start with it
+CHUNKED_MARKER = b'\x03'
+MANIFEST_VERSION = 1
+# Marker, version, write id, value length, number of chunks, CRC32
+_MANIFEST = struct.Struct('!cB8sQII')
+
+
+def split(key, value, max_size):
+    """
+    :param key: Key of the value
+    :param value: bytes-like value to store
+    :param max_size: Largest value in bytes stored under a single key
+    :return: (dictionary of chunk key to chunk, manifest), or None if the
+    value is small enough to store as it is
+    """
+    if max_size is None or len(value) <= max_size:
+        return None
+    value = memoryview(value).cast('B')
+    write_id = streaming.new_write_id()
+    count = int(math.ceil(len(value) / float(max_size)))
+    chunks = dict(
+        (streaming.chunk_key(key, write_id, index),
+         value[index * max_size:(index + 1) * max_size].tobytes())
+        for index in range(count))
+    manifest = _MANIFEST.pack(CHUNKED_MARKER, MANIFEST_VERSION, write_id,
+                              len(value), count, zlib.crc32(value))
+    return chunks, manifest
+
+
+def chunk_keys(key, value):
+    """
+    :param key: Key the value was read from
+    :param value: Value read from the backend
+    :return: Keys of the chunks in order if the value is a manifest, else
+    None
+    """
+    if value is None or value[:1] != CHUNKED_MARKER or \
+            len(value) != _MANIFEST.size:
+        return None
+    _, version, write_id, _, count, _ = _MANIFEST.unpack(bytes(value))
+    if version != MANIFEST_VERSION:
+        return []
+    return [streaming.chunk_key(key, write_id, index)
+            for index in range(count)]
+
+
+def join(manifest, chunks):
+    """
+    Reassembles a value from its chunks
+    :param manifest: The manifest read under the value's key
+    :param chunks: The chunks, in order, None for missing ones
+    :return: bytearray holding the value, or None if a chunk is missing or
+    the value doesn't match the manifest
+    """
+    _, _, _, length, count, checksum = _MANIFEST.unpack(bytes(manifest))
+    if len(chunks) != count:
+        return None
+    value = bytearray(length)
+    view = memoryview(value)
+    position = 0
+    for chunk in chunks:
+        if chunk is None or position + len(chunk) > length:
+            return None
+        view[position:position + len(chunk)] = chunk
+        position += len(chunk)
+    view.release()
+    if position != length or zlib.crc32(value) != checksum:
+        return None
+    return value
+
+
+def _find_manifests(keys, values):
+    """
+    :return: (dictionary of position to chunk keys of the manifests among
+    values, list of every chunk key to fetch)
+    """
+    manifests = {}
+    wanted = []
+    for index, (key, value) in enumerate(zip(keys, values)):
+        names = chunk_keys(key, value)
+        if names is not None:
+            manifests[index] = names
+            wanted.extend(names)
+    return manifests, wanted
+
+
+def _assemble(values, manifests, fetched):
+    """
+    Replaces the manifests among values with the values they describe
+    """
+    values = list(values)
+    position = 0
+    for index, names in manifests.items():
+        chunks = fetched[position:position + len(names)]
+        position += len(names)
+        values[index] = join(values[index], chunks) if names else None
+    return values
+
+
+def _split_mapping(mapping, max_size):
+    """
+    :return: (chunks to write first, values to write once they are)
+    """
+    chunks = {}
+    values = {}
+    for key, value in mapping.items():
+        parts = split(key, value, max_size)
+        if parts is None:
+            values[key] = value
+        else:
+            chunks.update(parts[0])
+            values[key] = parts[1]
+    return chunks, values
+
+
+class ChunkedBackend(Backend):
+    """
+    Wraps any backend so values larger than max_size bytes are stored in
+    chunks. Invalidating a value drops its manifest, its chunks are left to
+    expire, so values stored without expiration leave their chunks behind
+    until the backend evicts them
+    """
+
+    def __init__(self, backend, max_size):
+        """
+        :param backend: The wrapped Backend
+        :param max_size: Largest value in bytes stored under a single key
+        """
+        super(ChunkedBackend, self).__init__()
+        self.backend = backend
+        self.max_size = max_size
+
+    def __getattr__(self, name):
+        # Backend specific methods, like close(), reach the wrapped backend
+        if name == 'backend':
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def get_cache(self, key):
+        value = self.backend.get_cache(key)
+        names = chunk_keys(key, value)
+        if names is None:
+            return value
+        return join(value, self.backend.get_many(names)) if names else None
+
+    def get_many(self, keys):
+        values = self.backend.get_many(keys)
+        manifests, wanted = _find_manifests(keys, values)
+        if not manifests:
+            return values
+        fetched = self.backend.get_many(wanted) if wanted else []
+        return _assemble(values, manifests, fetched)
+
+    def set_cache(self, key, value):
+        parts = split(key, value, self.max_size)
+        if parts is None:
+            return self.backend.set_cache(key, value)
+        for chunk_key, chunk in parts[0].items():
+            self.backend.set_cache(chunk_key, chunk)
+        return self.backend.set_cache(key, parts[1])
+
+    def set_cache_and_expire(self, key, value, expiration):
+        parts = split(key, value, self.max_size)
+        if parts is None:
+            return self.backend.set_cache_and_expire(key, value, expiration)
+        self.backend.set_many_and_expire(parts[0], expiration)
+        return self.backend.set_cache_and_expire(key, parts[1], expiration)
+
+    def set_many_and_expire(self, mapping, expiration):
+        chunks, values = _split_mapping(mapping, self.max_size)
+        if chunks:
+            self.backend.set_many_and_expire(chunks, expiration)
+        return self.backend.set_many_and_expire(values, expiration)
+
+    def invalidate_key(self, key):
+        return self.backend.invalidate_key(key)
+
+    def invalidate_many(self, keys):
+        return self.backend.invalidate_many(keys)
+
+    def incr(self, key):
+        return self.backend.incr(key)
+
+    def get_counters(self, keys):
+        # Counters are never chunked
+        return self.backend.get_counters(keys)
+
+    def acquire_lock(self, key, timeout):
+        return self.backend.acquire_lock(key, timeout)
+
+    def release_lock(self, key, token):
+        return self.backend.release_lock(key, token)
+
+
+class AsyncChunkedBackend(AsyncBackend):
+    """
+    ChunkedBackend for an AsyncBackend
+    """
+
+    def __init__(self, backend, max_size):
+        """
+        :param backend: The wrapped AsyncBackend
+        :param max_size: Largest value in bytes stored under a single key
+        """
+        super(AsyncChunkedBackend, self).__init__()
+        self.backend = backend
+        self.max_size = max_size
+
+    def __getattr__(self, name):
+        if name == 'backend':
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    async def get_cache(self, key):
+        value = await self.backend.get_cache(key)
+        names = chunk_keys(key, value)
+        if names is None:
+            return value
+        if not names:
+            return None
+        return join(value, await self.backend.get_many(names))
+
+    async def get_many(self, keys):
+        values = await self.backend.get_many(keys)
+        manifests, wanted = _find_manifests(keys, values)
+        if not manifests:
+            return values
+        fetched = await self.backend.get_many(wanted) if wanted else []
+        return _assemble(values, manifests, fetched)
+
+    async def set_cache(self, key, value):
+        parts = split(key, value, self.max_size)
+        if parts is None:
+            return await self.backend.set_cache(key, value)
+        for chunk_key, chunk in parts[0].items():
+            await self.backend.set_cache(chunk_key, chunk)
+        return await self.backend.set_cache(key, parts[1])
+
+    async def set_cache_and_expire(self, key, value, expiration):
+        parts = split(key, value, self.max_size)
+        if parts is None:
+            return await self.backend.set_cache_and_expire(
+                key, value, expiration)
+        await self.backend.set_many_and_expire(parts[0], expiration)
+        return await self.backend.set_cache_and_expire(
+            key, parts[1], expiration)
+
+    async def set_many_and_expire(self, mapping, expiration):
+        chunks, values = _split_mapping(mapping, self.max_size)
+        if chunks:
+            await self.backend.set_many_and_expire(chunks, expiration)
+        return await self.backend.set_many_and_expire(values, expiration)
+
+    async def invalidate_key(self, key):
+        return await self.backend.invalidate_key(key)
+
+    async def invalidate_many(self, keys):
+        return await self.backend.invalidate_many(keys)
+
+    async def incr(self, key):
+        return await self.backend.incr(key)
+
+    async def get_counters(self, keys):
+        return await self.backend.get_counters(keys)
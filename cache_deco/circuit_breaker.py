@@ -0,0 +1,162 @@
+from backends.forking import after_fork
+from collections import deque
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Consecutive backend failures that open the circuit
+DEFAULT_FAILURE_THRESHOLD = 5
+# Share of failed calls among the last window_size calls that opens it
+DEFAULT_ERROR_RATE_THRESHOLD = 0.5
+DEFAULT_WINDOW_SIZE = 100
+DEFAULT_MINIMUM_CALLS = 20
+# Seconds the circuit stays open before letting a probe call through
+DEFAULT_RESET_TIMEOUT = 30
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a failing backend. The circuit opens after
+    failure_threshold consecutive failures, or when the error rate over the
+    last window_size calls reaches error_rate_threshold. While it is open
+    calls skip the backend. After reset_timeout seconds it is half open and
+    lets half_open_max_calls probe calls through: a success closes it, a
+    failure opens it again
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 error_rate_threshold=DEFAULT_ERROR_RATE_THRESHOLD,
+                 window_size=DEFAULT_WINDOW_SIZE,
+                 minimum_calls=DEFAULT_MINIMUM_CALLS,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT,
+                 half_open_max_calls=1):
+        """
+        :param failure_threshold: Consecutive failures that open the
+        circuit, None to only use the error rate
+        :param error_rate_threshold: Failed share of the recent calls that
+        opens the circuit, None to only count consecutive failures
+        :param window_size: Number of recent calls the error rate covers
+        :param minimum_calls: Calls needed in the window before the error
+        rate is considered
+        :param reset_timeout: Seconds the circuit stays open
+        :param half_open_max_calls: Probe calls let through at once while
+        half open
+        """
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.trips = 0
+        self._state = CLOSED
+        self._opened_at = None
+        self._consecutive_failures = 0
+        self._window = deque(maxlen=window_size)
+        self._window_failures = 0
+        self._probes = 0
+        self._reset_after_fork()
+        after_fork(self, CircuitBreaker._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # Another thread may have held the lock when the process forked
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        CLOSED, OPEN or HALF_OPEN
+        """
+        with self._lock:
+            if self._state == OPEN and self._reset_elapsed():
+                return HALF_OPEN
+            return self._state
+
+    def _reset_elapsed(self):
+        return time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def allow(self):
+        """
+        Decides whether a call may use the backend. Every allowed call must
+        be followed by record_success or record_failure
+        :return: False while the circuit is open
+        """
+        # Closed is by far the common case, so skip the lock for it
+        if self._state == CLOSED:
+            return True
+        with self._lock:
+            if self._state == OPEN:
+                if not self._reset_elapsed():
+                    return False
+                self._state = HALF_OPEN
+                self._probes = 0
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    return False
+                self._probes += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._close()
+                return
+            self._consecutive_failures = 0
+            self._record(False)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+            if self._state == OPEN:
+                # A call started before the circuit opened
+                return
+            self._consecutive_failures += 1
+            self._record(True)
+            if self._should_open():
+                self._open()
+
+    def _record(self, failed):
+        if len(self._window) == self._window.maxlen:
+            self._window_failures -= self._window[0]
+        self._window.append(failed)
+        self._window_failures += failed
+
+    def _should_open(self):
+        if self.failure_threshold is not None and \
+                self._consecutive_failures >= self.failure_threshold:
+            return True
+        calls = len(self._window)
+        return self.error_rate_threshold is not None and \
+            calls >= self.minimum_calls and \
+            self._window_failures >= self.error_rate_threshold * calls
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self.trips += 1
+
+    def _close(self):
+        self._state = CLOSED
+        self._opened_at = None
+        self._consecutive_failures = 0
+        self._window.clear()
+        self._window_failures = 0
+
+    def stats(self):
+        """
+        :return: Dictionary with the state, the number of times the circuit
+        opened, the consecutive failures and the recent error rate
+        """
+        state = self.state
+        with self._lock:
+            calls = len(self._window)
+            return {
+                'state': state,
+                'trips': self.trips,
+                'consecutive_failures': self._consecutive_failures,
+                'error_rate': self._window_failures / calls if calls else 0.0,
+            }
@@ -0,0 +1,117 @@
+"""
+Generation counters for bulk invalidation. Every namespace and tag has a
+counter in the backend, and the current generations of a call's namespace
+and tags are folded into its cache key. Bumping a counter makes every key
+built with the old generation unreachable at once, without scanning the
+keyspace. Orphaned values are left to expire
+"""
+import inspect
+import time
+
+# Prefix of the backend keys holding the counters
+KEY_PREFIX = 'cache_deco:gen:'
+
+
+def namespace_name(namespace):
+    return 'ns:%s' % (namespace,)
+
+
+def tag_name(tag):
+    return 'tag:%s' % (tag,)
+
+
+class Generations(object):
+    """
+    Reads and bumps generation counters. With a ttl, generations read from
+    the backend are reused for that many seconds, saving a round trip per
+    call at the cost of other processes seeing an invalidation up to ttl
+    seconds late. Bumps made by this process are seen immediately
+    """
+
+    def __init__(self, backend, ttl=None):
+        """
+        :param backend: The cache backend storing the counters
+        :param ttl: Seconds a generation read from the backend is reused,
+        None to read it on every call
+        """
+        self.backend = backend
+        self.ttl = ttl
+        # name -> (generation, monotonic time it was read at)
+        self._cached = {}
+
+    def cached(self, names):
+        """
+        :param names: Namespace and tag names
+        :return: Dictionary of name to generation if every name has a live
+        cached generation, otherwise None
+        """
+        if not self.ttl:
+            return None
+        oldest = time.monotonic() - self.ttl
+        generations = {}
+        for name in names:
+            entry = self._cached.get(name)
+            if entry is None or entry[1] <= oldest:
+                return None
+            generations[name] = entry[0]
+        return generations
+
+    def _remember(self, names, values):
+        now = time.monotonic()
+        generations = {}
+        for name, value in zip(names, values):
+            generations[name] = int(value) if value else 0
+            if self.ttl:
+                self._cached[name] = (generations[name], now)
+        return generations
+
+    def fetch(self, names):
+        """
+        Reads generations from the backend in one round trip
+        :param names: Namespace and tag names
+        :return: Dictionary of name to generation, 0 for unknown names
+        """
+        names = list(names)
+        return self._remember(names, self.backend.get_counters(
+            [KEY_PREFIX + name for name in names]))
+
+    async def fetch_async(self, names):
+        """
+        Coroutine version of fetch, for use with an AsyncBackend
+        """
+        names = list(names)
+        values = self.backend.get_counters(
+            [KEY_PREFIX + name for name in names])
+        if inspect.isawaitable(values):
+            values = await values
+        return self._remember(names, values)
+
+    def bump(self, name):
+        """
+        Increments a generation, invalidating every key built with the old
+        one
+        :param name: Namespace or tag name
+        :return: The new generation
+        """
+        return self._remember(
+            (name,), (self.backend.incr(KEY_PREFIX + name),))[name]
+
+    async def bump_async(self, name):
+        """
+        Coroutine version of bump, for use with an AsyncBackend
+        """
+        value = self.backend.incr(KEY_PREFIX + name)
+        if inspect.isawaitable(value):
+            value = await value
+        return self._remember((name,), (value,))[name]
+
+    @staticmethod
+    def scope(key, names, generations):
+        """
+        :param key: A cache key
+        :param names: Namespace and tag names of the call, in a fixed order
+        :param generations: Dictionary of name to generation
+        :return: The key with the generations appended
+        """
+        return '%s:%s' % (
+            key, '.'.join([str(generations[name]) for name in names]))
@@ -0,0 +1,326 @@
+"""
+Deterministic cache key generation. Arguments are fed into a blake2b hash
+as type-tagged, length-prefixed or terminated bytes, so keys are the same in
+every process and on every host, unlike keys built with hash()
+"""
+from array import array
+import hashlib
+import struct
+import sys
+
+# Size in bytes of the digest, keys are twice as long in hex
+KEY_DIGEST_SIZE = 16
+
+# Payloads larger than this many bytes are hashed in place, not buffered
+LARGE_PAYLOAD = 64 * 1024
+
+# Sequences at least this long are checked for the homogeneous fast paths
+BULK_MIN_LENGTH = 8
+
+# Longest str argument encoded by the fast path of make_key
+INLINE_TEXT = 256
+
+_FLOAT = struct.Struct('<d')
+
+
+def function_id(fn):
+    """
+    Identifies a function by module and qualified name, so functions with
+    the same name in different modules or classes get different keys
+    :param fn: The decorated function
+    :return: "module.qualname"
+    """
+    return '%s.%s' % (fn.__module__,
+                      getattr(fn, '__qualname__', fn.__name__))
+
+
+def new_hasher(fn):
+    """
+    :param fn: The decorated function
+    :return: A blake2b hash already fed with the function's identity
+    """
+    hasher = hashlib.blake2b(digest_size=KEY_DIGEST_SIZE)
+    hasher.update(b'F%s;' % function_id(fn).encode('utf-8'))
+    return hasher
+
+
+def make_key(hasher, args, kwargs):
+    """
+    Builds the cache key of a call
+    :param hasher: Hash returned by new_hasher, left untouched
+    :param args: Positional arguments of the call
+    :param kwargs: Keyword arguments of the call
+    :return: Hex digest identifying the function and its arguments
+    """
+    if not kwargs and len(args) < BULK_MIN_LENGTH:
+        # A few short str and int arguments are encoded straight into one
+        # bytes object, with the encoding _feed gives them
+        data = b'(%d:' % len(args)
+        for value in args:
+            cls = type(value)
+            if cls is int:
+                data += b'i%d;' % value
+            elif cls is str and len(value) <= INLINE_TEXT:
+                text = value.encode('utf-8', 'surrogatepass')
+                data += b's%d:%s' % (len(text), text)
+            else:
+                break
+        else:
+            hasher = hasher.copy()
+            hasher.update(data)
+            return hasher.hexdigest()
+    hasher = hasher.copy()
+    out = _Output(hasher)
+    if len(args) < BULK_MIN_LENGTH:
+        # Same encoding as _feed_sequence, without its bulk checks
+        out += b'(%d:' % len(args)
+        for value in args:
+            _feed(out, value)
+    else:
+        _feed_sequence(out, b'(', args)
+    if kwargs:
+        out += b'K'
+        for name in sorted(kwargs):
+            _feed_text(out, b's', name)
+            _feed(out, kwargs[name])
+    hasher.update(out)
+    return hasher.hexdigest()
+
+
+def make_signature_key(hasher, signature):
+    """
+    Builds the cache key of a call from a custom signature string
+    :param hasher: Hash returned by new_hasher, left untouched
+    :param signature: Output of the signature generator
+    :return: Hex digest identifying the function and the signature
+    """
+    hasher = hasher.copy()
+    out = _Output(hasher)
+    _feed_text(out, b'G', str(signature))
+    out.flush()
+    return hasher.hexdigest()
+
+
+class _Output(bytearray):
+    """
+    Buffers the encoded arguments so the hash is updated with a few large
+    chunks rather than many tiny ones. Large payloads bypass the buffer
+    """
+
+    def __init__(self, hasher):
+        super(_Output, self).__init__()
+        self.hasher = hasher
+
+    def write_large(self, data):
+        self.flush()
+        self.hasher.update(data)
+
+    def flush(self):
+        self.hasher.update(self)
+        del self[:]
+
+
+def _feed_bytes(out, tag, data):
+    out += b'%s%d:' % (tag, len(data))
+    if len(data) > LARGE_PAYLOAD:
+        out.write_large(data)
+    else:
+        out += data
+
+
+def _feed_text(out, tag, text):
+    _feed_bytes(out, tag, text.encode('utf-8', 'surrogatepass'))
+
+
+def _feed_int(out, value):
+    out += b'i%d;' % value
+
+
+def _feed_sequence(out, tag, values):
+    out += b'%s%d:' % (tag, len(values))
+    if len(values) >= BULK_MIN_LENGTH:
+        kinds = set(map(type, values))
+        if len(kinds) == 1:
+            kind = kinds.pop()
+            # Homogeneous sequences of ints or strs are encoded with a few
+            # C level joins instead of one Python call per element
+            if kind is int:
+                data = ','.join(map(str, values)).encode('ascii')
+                out += b'I%d:' % len(data)
+                out += data
+                return
+            if kind is str:
+                # The count is known, so the lengths are fixed size little
+                # endian integers
+                lengths = array('Q', map(len, values))
+                if sys.byteorder != 'little':
+                    lengths.byteswap()
+                out += b'S'
+                out += lengths.tobytes()
+                _feed_text(out, b's', ''.join(values))
+                return
+    for value in values:
+        _feed(out, value)
+
+
+def _feed_digests(out, tag, items):
+    """
+    Feeds an unordered collection whose items can't be sorted, as the
+    sorted digests of its items
+    """
+    digests = []
+    for item in items:
+        hasher = hashlib.blake2b(digest_size=KEY_DIGEST_SIZE)
+        item_out = _Output(hasher)
+        _feed(item_out, item)
+        item_out.flush()
+        digests.append(hasher.digest())
+    digests.sort()
+    out += b'%s%d:' % (tag, len(digests))
+    for digest in digests:
+        out += digest
+
+
+def _feed_mapping(out, mapping):
+    try:
+        names = sorted(mapping)
+    except TypeError:
+        _feed_digests(out, b'}', mapping.items())
+        return
+    if len(names) < BULK_MIN_LENGTH:
+        out += b'{%d:' % len(names)
+        for name in names:
+            _feed(out, name)
+            _feed(out, mapping[name])
+        return
+    out += b'D'
+    _feed_sequence(out, b'(', names)
+    _feed_sequence(out, b'(', list(map(mapping.__getitem__, names)))
+
+
+def _feed_set(out, values):
+    try:
+        items = sorted(values)
+    except TypeError:
+        _feed_digests(out, b'>', values)
+        return
+    _feed_sequence(out, b'<', items)
+
+
+def _feed_array(out, array):
+    out += b'A'
+    _feed_text(out, b's', array.dtype.str)
+    _feed_sequence(out, b'(', array.shape)
+    if array.dtype.hasobject:
+        # Object arrays hold pointers, so hash the objects themselves
+        _feed(out, array.tolist())
+    else:
+        numpy = sys.modules['numpy']
+        raw = numpy.ascontiguousarray(array).reshape(-1).view(numpy.uint8)
+        _feed_bytes(out, b'b', raw)
+
+
+def _object_encoder(cls):
+    prefix = _Output(None)
+    prefix += b'O'
+    _feed_text(prefix, b's', _class_name(cls))
+    prefix = bytes(prefix)
+
+    # An object with a custom __str__ is identified by it
+    if cls.__str__ is not object.__str__:
+        def encode(out, value):
+            out += prefix
+            _feed_text(out, b's', str(value))
+        return encode
+
+    # Otherwise include its state, recursively, so that a change of state
+    # doesn't hit the cache for the old state
+    def encode(out, value):
+        out += prefix
+        try:
+            state = vars(value)
+        except TypeError:
+            _feed_text(out, b'r', repr(value))
+            return
+        _feed_mapping(out, state)
+    return encode
+
+
+def _subclass_encoder(cls, base):
+    prefix = _Output(None)
+    _feed_text(prefix, b'C', _class_name(cls))
+    prefix = bytes(prefix)
+    encode_base = _ENCODERS[base]
+
+    def encode(out, value):
+        out += prefix
+        encode_base(out, value)
+    return encode
+
+
+def _class_name(cls):
+    return '%s.%s' % (cls.__module__, cls.__qualname__)
+
+
+def _feed_float(out, value):
+    out += b'f'
+    out += _FLOAT.pack(value)
+
+
+_ENCODERS = {
+    type(None): lambda out, value: out.extend(b'N'),
+    bool: lambda out, value: out.extend(b'T' if value else b'F'),
+    int: _feed_int,
+    float: _feed_float,
+    str: lambda out, value: _feed_text(out, b's', value),
+    bytes: lambda out, value: _feed_bytes(out, b'b', value),
+    bytearray: lambda out, value: _feed_bytes(out, b'B', value),
+    tuple: lambda out, value: _feed_sequence(out, b'(', value),
+    list: lambda out, value: _feed_sequence(out, b'[', value),
+    dict: _feed_mapping,
+    set: _feed_set,
+    frozenset: _feed_set,
+}
+
+# Subclasses of builtins are encoded like their base, tagged with their
+# class name
+_BASES = (bool, int, float, str, bytes, bytearray, tuple, list, dict, set,
+          frozenset)
+
+
+def _resolve_encoder(cls):
+    """
+    Picks the encoder of a type not seen before and remembers it, so
+    later values of that type are dispatched with a single lookup
+    """
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and issubclass(cls, numpy.ndarray):
+        encoder = _feed_array
+    else:
+        for base in _BASES:
+            if issubclass(cls, base):
+                encoder = _subclass_encoder(cls, base)
+                break
+        else:
+            encoder = _object_encoder(cls)
+    _ENCODERS[cls] = encoder
+    return encoder
+
+
+def _feed(out, value):
+    cls = type(value)
+    # Inlined fast paths for the most common argument types
+    if cls is str:
+        data = value.encode('utf-8', 'surrogatepass')
+        out += b's%d:' % len(data)
+        if len(data) > LARGE_PAYLOAD:
+            out.write_large(data)
+        else:
+            out += data
+    elif cls is int:
+        out += b'i%d;' % value
+    else:
+        encoder = _ENCODERS.get(cls)
+        if encoder is None:
+            encoder = _resolve_encoder(cls)
+        encoder(out, value)
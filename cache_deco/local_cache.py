@@ -0,0 +1,110 @@
+from backends.forking import after_fork
+from collections import OrderedDict
+import threading
+import time
+
+# Default bounds for an in-process cache tier
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class LocalCache(object):
+    """
+    Bounded in-process LRU cache with per-entry TTLs. Values are kept
+    deserialized, so a hit skips both the backend and unpickling. Cached
+    objects are shared between callers and must not be mutated
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, ttl=None):
+        """
+        :param max_entries: Maximum number of cached entries
+        :param max_bytes: Maximum total serialized size of cached entries
+        :param ttl: Upper bound in seconds on how long an entry is kept,
+        None to only use the TTL given when setting it
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._reset_after_fork()
+        after_fork(self, LocalCache._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # Another thread may have held the lock when the process forked
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """
+        Total serialized size in bytes of the cached entries
+        """
+        return self._bytes
+
+    def get(self, key, default=None):
+        """
+        Gets a live entry and marks it as most recently used
+        :param key: The cache key
+        :param default: Returned when the key is missing or expired
+        :return: The cached value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self._bytes -= size
+            self.misses += 1
+            return default
+
+    def set(self, key, value, size, ttl):
+        """
+        Stores an entry, evicting least recently used entries to stay
+        within bounds
+        :param key: The cache key
+        :param value: The deserialized value
+        :param size: Serialized size of the value in bytes
+        :param ttl: Time to live in seconds, capped by the cache's own ttl
+        """
+        if self.ttl is not None:
+            ttl = min(ttl, self.ttl)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or \
+                    self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def invalidate(self, key):
+        """
+        Removes an entry
+        :param key: The cache key
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def clear(self):
+        """
+        Removes every entry
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
@@ -0,0 +1,32 @@
+import struct
+
+# First byte of a value carrying refresh metadata. Neither a pickle nor a
+# serializer header starts with a NUL byte, so values are told apart from it
+METADATA_MARKER = b'\x00'
+# Marker, soft expiry as a UNIX timestamp, compute time in seconds
+_HEADER = struct.Struct('!cdd')
+
+
+def pack(payload, soft_expires_at, compute_time):
+    """
+    Prefixes a serialized value with its refresh metadata
+    :param payload: The serialized value
+    :param soft_expires_at: UNIX timestamp after which the value is stale
+    :param compute_time: Seconds it took to compute the value
+    :return: The value to store in the backend
+    """
+    return _HEADER.pack(METADATA_MARKER, soft_expires_at, compute_time) + \
+        payload
+
+
+def unpack(value):
+    """
+    Splits a stored value into its payload and refresh metadata
+    :param value: The value read from the backend
+    :return: (payload, soft_expires_at, compute_time), with None metadata
+    for values stored without it
+    """
+    if value[:1] != METADATA_MARKER or len(value) < _HEADER.size:
+        return value, None, None
+    _, soft_expires_at, compute_time = _HEADER.unpack_from(value)
+    return memoryview(value)[_HEADER.size:], soft_expires_at, compute_time
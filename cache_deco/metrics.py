@@ -0,0 +1,295 @@
+"""
+Per-function cache metrics. Every thread updates its own shard, so
+recording an event takes no lock. Shards are only summed when a snapshot is
+taken
+"""
+from backends.forking import after_fork
+from bisect import bisect_left
+import threading
+
+# Upper bounds in seconds of the latency and compute time buckets
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds in bytes of the serialized size buckets
+SIZE_BUCKETS = tuple(4 ** power for power in range(4, 14))
+
+COUNTERS = ('hits', 'local_hits', 'misses', 'errors', 'short_circuits',
+            'invalidations', 'rejected_fast', 'rejected_large',
+            'rejected_value', 'rejected_rare')
+BACKEND_OPERATIONS = ('get', 'set', 'get_many', 'set_many', 'invalidate')
+
+
+class CacheObserver(object):
+    """
+    Receives cache events, to feed a metrics system such as Prometheus or
+    StatsD. Methods are called on the thread that caused the event and must
+    be fast and not raise. `function` is the decorated function's
+    module.qualname
+    """
+
+    def hit(self, function, tier):
+        """
+        :param tier: 'local' or 'backend'
+        """
+
+    def miss(self, function):
+        pass
+
+    def error(self, function, exception):
+        """
+        Called when a backend failure made the cache fall back to calling the
+        function
+        """
+
+    def short_circuit(self, function):
+        """
+        Called when the function was called without the backend because the
+        circuit breaker is open
+        """
+
+    def invalidation(self, function):
+        pass
+
+    def rejected(self, function, reason):
+        """
+        Called when a computed result was not cached by the admission policy
+        :param reason: One of cache_deco.admission.REASONS
+        """
+
+    def backend_latency(self, function, operation, seconds):
+        """
+        :param operation: One of BACKEND_OPERATIONS
+        """
+
+    def computed(self, function, seconds, size):
+        """
+        Called when a result is computed and serialized
+        :param seconds: Time it took to compute
+        :param size: Serialized size in bytes
+        """
+
+
+class Histogram(object):
+    """
+    Counts of observed values per bucket, plus their count and sum
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'total')
+
+    def __init__(self, bounds):
+        """
+        :param bounds: Sorted upper bounds of the buckets, values above the
+        last one are counted in an overflow bucket
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+
+    def as_dict(self):
+        """
+        :return: Dictionary of 'count', 'sum' and 'buckets', a list of
+        (upper bound, count) with None as the overflow bound
+        """
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'buckets': list(zip(self.bounds + (None,), self.counts)),
+        }
+
+
+class _Shard(object):
+    __slots__ = COUNTERS + (
+        'thread', 'backend_latency', 'compute_time', 'serialized_size')
+
+    def __init__(self, thread):
+        for counter in COUNTERS:
+            setattr(self, counter, 0)
+        self.thread = thread
+        self.backend_latency = dict(
+            (operation, Histogram(LATENCY_BUCKETS))
+            for operation in BACKEND_OPERATIONS)
+        self.compute_time = Histogram(LATENCY_BUCKETS)
+        self.serialized_size = Histogram(SIZE_BUCKETS)
+
+    def merge(self, other):
+        for counter in COUNTERS:
+            setattr(self, counter,
+                    getattr(self, counter) + getattr(other, counter))
+        for operation, histogram in other.backend_latency.items():
+            self.backend_latency[operation].merge(histogram)
+        self.compute_time.merge(other.compute_time)
+        self.serialized_size.merge(other.serialized_size)
+
+
+class FunctionMetrics(object):
+    """
+    Metrics of one decorated function, also forwarded to the Cache's
+    observers
+    """
+
+    def __init__(self, function, observers):
+        """
+        :param function: module.qualname of the decorated function
+        :param observers: List of CacheObserver, shared with the Cache so
+        observers added later are notified too
+        """
+        self.function = function
+        self.observers = observers
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard(None)
+        self._reset_after_fork()
+        after_fork(self, FunctionMetrics._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # Another thread may have held the lock when the process forked
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def hit(self, tier):
+        shard = self._shard()
+        shard.hits += 1
+        if tier == 'local':
+            shard.local_hits += 1
+        if self.observers:
+            for observer in self.observers:
+                observer.hit(self.function, tier)
+
+    def miss(self):
+        self._shard().misses += 1
+        if self.observers:
+            for observer in self.observers:
+                observer.miss(self.function)
+
+    def error(self, exception):
+        self._shard().errors += 1
+        if self.observers:
+            for observer in self.observers:
+                observer.error(self.function, exception)
+
+    def short_circuit(self):
+        self._shard().short_circuits += 1
+        if self.observers:
+            for observer in self.observers:
+                observer.short_circuit(self.function)
+
+    def invalidation(self):
+        self._shard().invalidations += 1
+        if self.observers:
+            for observer in self.observers:
+                observer.invalidation(self.function)
+
+    def rejected(self, reason):
+        shard = self._shard()
+        counter = 'rejected_' + reason
+        setattr(shard, counter, getattr(shard, counter) + 1)
+        if self.observers:
+            for observer in self.observers:
+                observer.rejected(self.function, reason)
+
+    def backend_latency(self, operation, seconds):
+        self._shard().backend_latency[operation].observe(seconds)
+        if self.observers:
+            for observer in self.observers:
+                observer.backend_latency(self.function, operation, seconds)
+
+    def computed(self, seconds, size):
+        shard = self._shard()
+        shard.compute_time.observe(seconds)
+        shard.serialized_size.observe(size)
+        if self.observers:
+            for observer in self.observers:
+                observer.computed(self.function, seconds, size)
+
+    def snapshot(self):
+        """
+        Sums the shards of every thread. Shards of finished threads are
+        folded together so they don't pile up
+        :return: Dictionary of counter and histogram name to value
+        """
+        total = _Shard(None)
+        with self._lock:
+            live = []
+            for shard in self._shards:
+                if shard.thread.is_alive():
+                    live.append(shard)
+                else:
+                    self._retired.merge(shard)
+            self._shards = live
+            total.merge(self._retired)
+            for shard in live:
+                total.merge(shard)
+        snapshot = dict((counter, getattr(total, counter))
+                        for counter in COUNTERS)
+        snapshot['backend_latency'] = dict(
+            (operation, histogram.as_dict())
+            for operation, histogram in total.backend_latency.items())
+        snapshot['compute_time'] = total.compute_time.as_dict()
+        snapshot['serialized_size'] = total.serialized_size.as_dict()
+        return snapshot
+
+
+class Metrics(object):
+    """
+    Metrics of every function decorated by a Cache
+    """
+
+    def __init__(self):
+        self.observers = []
+        self._functions = {}
+        self._reset_after_fork()
+        after_fork(self, Metrics._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # Another thread may have held the lock when the process forked
+        self._lock = threading.Lock()
+
+    def add_observer(self, observer):
+        """
+        :param observer: CacheObserver notified of every event from now on
+        """
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+
+    def for_function(self, function):
+        """
+        :param function: module.qualname of a decorated function
+        :return: Its FunctionMetrics, shared by functions with the same name
+        """
+        with self._lock:
+            metrics = self._functions.get(function)
+            if metrics is None:
+                metrics = self._functions[function] = FunctionMetrics(
+                    function, self.observers)
+            return metrics
+
+    def snapshot(self):
+        """
+        :return: Dictionary of function name to its metrics snapshot
+        """
+        with self._lock:
+            functions = list(self._functions.items())
+        return dict((function, metrics.snapshot())
+                    for function, metrics in functions)
@@ -0,0 +1,125 @@
+"""
+Negative caching: exceptions and empty results kept in the cache for their
+own, usually shorter, time so failing or empty lookups aren't repeated by
+every caller
+"""
+import pickle
+
+# First byte of a cached exception. Codec headers have a codec id of at
+# least 1 and pickles start with 0x80 or a printable opcode, so this byte
+# is never written for a regular value. 0x00 is the refresh metadata marker
+EXCEPTION_MARKER = b'\x01'
+
+DEFAULT_EXCEPTION_TTL = 5
+
+
+class CachedException(object):
+    """
+    An exception read from the cache, raised again instead of being returned
+    """
+    __slots__ = ('exception',)
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def is_empty(value):
+    """
+    Default test for empty results: None and empty strings and containers
+    """
+    if value is None:
+        return True
+    if isinstance(value, (str, bytes, bytearray, list, tuple, dict, set,
+                          frozenset)):
+        return not value
+    return False
+
+
+def pack_exception(exception):
+    """
+    :param exception: The exception raised by the function
+    :return: The value to store in the backend, None if the exception can't
+    be pickled
+    """
+    try:
+        return EXCEPTION_MARKER + pickle.dumps(
+            exception, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+
+
+def decode(codec, data):
+    """
+    Decodes a value read from the backend
+    :param codec: Codec of the function
+    :param data: bytes-like object without refresh metadata
+    :return: The cached value, or a CachedException
+    """
+    if data[:1] == EXCEPTION_MARKER:
+        return CachedException(pickle.loads(memoryview(data)[1:]))
+    return codec.loads(data)
+
+
+def raise_cached(value):
+    """
+    :param value: A value read from any cache tier
+    :return: The value, unless it is a CachedException which is raised
+    """
+    if type(value) is CachedException:
+        raise value.exception
+    return value
+
+
+class NegativeCaching(object):
+    """
+    Decides which exceptions are cached, and for how long exceptions and
+    empty results are kept
+    """
+
+    def __init__(self, exceptions=(), exception_ttl=DEFAULT_EXCEPTION_TTL,
+                 empty_ttl=None, empty=is_empty):
+        """
+        :param exceptions: Exception class, or tuple of them, to cache
+        :param exception_ttl: Seconds a cached exception is raised again
+        :param empty_ttl: Seconds an empty result is cached, None to cache
+        it like any other result
+        :param empty: Callable taking a result and returning whether it is
+        empty
+        """
+        self.exceptions = exceptions
+        self.exception_ttl = exception_ttl
+        self.empty_ttl = empty_ttl
+        self.empty = empty
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        Builds the negative caching of a decorator from its options
+        :return: NegativeCaching, or None if no option is given
+        """
+        exceptions = options.get('cache_exceptions', ())
+        empty_ttl = options.get('empty_ttl')
+        if not exceptions and empty_ttl is None:
+            return None
+        if isinstance(exceptions, list):
+            exceptions = tuple(exceptions)
+        return cls(exceptions,
+                   options.get('exception_ttl', DEFAULT_EXCEPTION_TTL),
+                   empty_ttl, options.get('is_empty', is_empty))
+
+    def caches(self, exception):
+        """
+        :return: Whether the exception is cached
+        """
+        return bool(self.exceptions) and \
+            isinstance(exception, self.exceptions)
+
+    def ttl(self, value, expiration):
+        """
+        :param value: A computed result
+        :param expiration: TTL of the function's results
+        :return: TTL in seconds to cache the result for
+        """
+        if self.empty_ttl is not None and self.empty(value):
+            return min(self.empty_ttl, expiration)
+        return expiration
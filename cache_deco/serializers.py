@@ -0,0 +1,305 @@
+"""
+Serializers turning cached values into bytes and back, with optional
+compression. Serialized values start with a one byte header naming the
+serializer and the compression, so values are decoded whatever the reader
+is configured to write
+"""
+import json
+import marshal
+import pickle
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Serialized values at least this many bytes long are compressed
+DEFAULT_COMPRESS_THRESHOLD = 1024
+
+# Header bytes are below 0x20, with the serializer's codec id in bits 2-4
+# and the compressor's in bits 0-1. Pickles start with 0x80 or a printable
+# opcode, so values written without a header are still told apart. 0x00 is
+# the refresh metadata marker
+_HEADER_LIMIT = 0x20
+_MAX_CODEC_ID = 7
+
+
+class Serializer(object):
+    """
+    Turns values into bytes. Subclasses set a codec_id between 1 and 7 that
+    is unique among the serializers in use
+    """
+    codec_id = None
+
+    def dumps(self, value):
+        """
+        :param value: The value to serialize
+        :return: bytes
+        """
+        raise NotImplementedError
+
+    def loads(self, data):
+        """
+        :param data: bytes-like object returned by dumps
+        :return: The deserialized value
+        """
+        raise NotImplementedError
+
+
+class PickleSerializer(Serializer):
+    codec_id = 1
+
+    def __init__(self, protocol=pickle.HIGHEST_PROTOCOL):
+        self.protocol = protocol
+
+    def dumps(self, value):
+        return pickle.dumps(value, self.protocol)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class MarshalSerializer(Serializer):
+    """
+    Fast for builtin types, but the format may change between Python
+    versions
+    """
+    codec_id = 2
+
+    def dumps(self, value):
+        return marshal.dumps(value)
+
+    def loads(self, data):
+        return marshal.loads(data)
+
+
+class JsonSerializer(Serializer):
+    """
+    Tuples come back as lists and dict keys as strings
+    """
+    codec_id = 3
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(bytes(data))
+
+
+class MsgpackSerializer(Serializer):
+    """
+    Requires the msgpack package. Tuples come back as lists
+    """
+    codec_id = 4
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('MsgpackSerializer requires msgpack')
+
+    def dumps(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class RawSerializer(Serializer):
+    """
+    Stores bytes as they are, for functions already returning bytes
+    """
+    codec_id = 5
+
+    def dumps(self, value):
+        if not isinstance(value, (bytes, bytearray, memoryview)):
+            raise TypeError(
+                'RawSerializer can only store bytes, not %s' %
+                type(value).__name__)
+        return bytes(value)
+
+    def loads(self, data):
+        return bytes(data)
+
+
+class Compressor(object):
+    """
+    Compresses serialized values. Subclasses set a compression_id between
+    1 and 3
+    """
+    compression_id = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    compression_id = 1
+
+    def __init__(self, level=1):
+        """
+        :param level: zlib compression level, low levels are much faster for
+        a slightly larger output
+        """
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class Lz4Compressor(Compressor):
+    """
+    Requires the lz4 package
+    """
+    compression_id = 2
+
+    def __init__(self):
+        if lz4_frame is None:
+            raise ImportError('Lz4Compressor requires lz4')
+
+    def compress(self, data):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data):
+        return lz4_frame.decompress(data)
+
+
+SERIALIZERS = {
+    'pickle': PickleSerializer,
+    'marshal': MarshalSerializer,
+    'json': JsonSerializer,
+    'msgpack': MsgpackSerializer,
+    'raw': RawSerializer,
+}
+
+COMPRESSORS = {
+    'zlib': ZlibCompressor,
+    'lz4': Lz4Compressor,
+}
+
+
+def get_serializer(serializer):
+    """
+    :param serializer: A Serializer, or the name of one in SERIALIZERS
+    :return: A Serializer
+    """
+    if isinstance(serializer, Serializer):
+        codec_id = serializer.codec_id
+        if not isinstance(codec_id, int) or \
+                not 1 <= codec_id <= _MAX_CODEC_ID:
+            raise ValueError(
+                'codec_id must be between 1 and %d' % _MAX_CODEC_ID)
+        return serializer
+    if serializer not in SERIALIZERS:
+        raise ValueError('serializer must be a Serializer or one of %s' % (
+            sorted(SERIALIZERS),))
+    return SERIALIZERS[serializer]()
+
+
+def get_compressor(compression):
+    """
+    :param compression: A Compressor, the name of one in COMPRESSORS, or None
+    :return: A Compressor, or None for no compression
+    """
+    if compression is None or isinstance(compression, Compressor):
+        return compression
+    if compression not in COMPRESSORS:
+        raise ValueError('compression must be a Compressor or one of %s' % (
+            sorted(COMPRESSORS),))
+    return COMPRESSORS[compression]()
+
+
+class Codec(object):
+    """
+    Serializes values with a serializer and an optional compressor, and
+    decodes values written by any of them
+    """
+
+    def __init__(self, serializer=None, compression=None,
+                 compress_threshold=DEFAULT_COMPRESS_THRESHOLD):
+        """
+        :param serializer: A Serializer or its name. None writes plain
+        pickles without a header, readable by older releases, unless
+        compression is set
+        :param compression: A Compressor or its name, None to not compress
+        :param compress_threshold: Serialized size in bytes from which
+        values are compressed
+        """
+        self.compressor = get_compressor(compression)
+        self.headerless = serializer is None and self.compressor is None
+        self.serializer = get_serializer(
+            'pickle' if serializer is None else serializer)
+        self.compress_threshold = compress_threshold
+        self._serializers = {self.serializer.codec_id: self.serializer}
+        self._compressors = {}
+        if self.compressor is not None:
+            self._compressors[self.compressor.compression_id] = \
+                self.compressor
+
+    def dumps(self, value):
+        """
+        :param value: The value to serialize
+        :return: bytes to store in the backend
+        """
+        if self.headerless:
+            return pickle.dumps(value)
+        data = self.serializer.dumps(value)
+        compression_id = 0
+        if self.compressor is not None and \
+                len(data) >= self.compress_threshold:
+            compressed = self.compressor.compress(data)
+            # Incompressible data is kept as is
+            if len(compressed) < len(data):
+                data = compressed
+                compression_id = self.compressor.compression_id
+        header = bytes((self.serializer.codec_id << 2 | compression_id,))
+        return header + data
+
+    def loads(self, data):
+        """
+        :param data: bytes-like object read from the backend
+        :return: The deserialized value
+        """
+        header = data[0]
+        if header >= _HEADER_LIMIT:
+            # Written without a header
+            return pickle.loads(data)
+        serializer = self._serializer(header >> 2)
+        body = memoryview(data)[1:]
+        compression_id = header & 3
+        if compression_id:
+            body = self._compressor(compression_id).decompress(body)
+        return serializer.loads(body)
+
+    def _serializer(self, codec_id):
+        serializer = self._serializers.get(codec_id)
+        if serializer is None:
+            for cls in SERIALIZERS.values():
+                if cls.codec_id == codec_id:
+                    serializer = self._serializers[codec_id] = cls()
+                    break
+            else:
+                raise ValueError('Unknown codec id %d' % codec_id)
+        return serializer
+
+    def _compressor(self, compression_id):
+        compressor = self._compressors.get(compression_id)
+        if compressor is None:
+            for cls in COMPRESSORS.values():
+                if cls.compression_id == compression_id:
+                    compressor = self._compressors[compression_id] = cls()
+                    break
+            else:
+                raise ValueError(
+                    'Unknown compression id %d' % compression_id)
+        return compressor
@@ -0,0 +1,68 @@
+from backends.forking import after_fork
+import sys
+import threading
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls for the same key within a process, so only
+    the first caller computes while the others wait for its result
+    """
+
+    def __init__(self):
+        self._reset_after_fork()
+        after_fork(self, SingleFlight._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # The leaders of the parent's flights don't exist in the child
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, compute, timeout=None):
+        """
+        Runs compute unless a call for the same key is already in flight,
+        in which case that call's result is returned, or its exception
+        raised, once it completes
+        :param key: Identifies the computation
+        :param compute: Callable taking no arguments
+        :param timeout: Seconds to wait for an in-flight call before
+        computing anyway, None to wait forever
+        :return: The result of compute
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                return compute()
+            if flight.exc_info is not None:
+                raise flight.exc_info[1].with_traceback(flight.exc_info[2])
+            return flight.result
+
+        try:
+            flight.result = compute()
+        except BaseException:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def in_flight(self):
+        """
+        :return: Number of keys currently being computed
+        """
+        return len(self._flights)
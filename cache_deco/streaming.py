@@ -0,0 +1,61 @@
+"""
+Storage layout of streamed results. The items of an iterable result are
+written in chunks, each under its own key, while the caller consumes them.
+Once the iterable is exhausted a manifest naming the chunks is written under
+the call's cache key, so a partly consumed result is never read back
+"""
+import binascii
+import os
+import struct
+
+# First byte of a manifest. Like the exception marker, codec headers never
+# start with it
+STREAM_MARKER = b'\x02'
+# Marker, write id, number of chunks
+_MANIFEST = struct.Struct('!c8sQ')
+
+# Items per chunk
+DEFAULT_CHUNK_SIZE = 100
+# Chunks fetched per backend round trip when reading a stream
+PREFETCH_CHUNKS = 2
+# Appended to the cache key of streaming functions, so a function switched
+# to streaming never reads values stored as a whole, or the reverse
+KEY_SUFFIX = ':stream'
+
+
+def new_write_id():
+    """
+    :return: Random id naming the chunks of one write, so chunks of
+    concurrent writes of the same key never mix
+    """
+    return os.urandom(8)
+
+
+def chunk_key(key, write_id, index):
+    """
+    :param key: Cache key of the call
+    :param write_id: Id returned by new_write_id
+    :param index: Position of the chunk
+    :return: Key of the chunk
+    """
+    return '%s:%s:%d' % (key, binascii.hexlify(write_id).decode('ascii'),
+                         index)
+
+
+def pack_manifest(write_id, chunks):
+    """
+    :return: The manifest to store under the call's cache key
+    """
+    return _MANIFEST.pack(STREAM_MARKER, write_id, chunks)
+
+
+def unpack_manifest(value):
+    """
+    :param value: Value read from the call's cache key
+    :return: (write id, number of chunks), or None if the value isn't a
+    manifest
+    """
+    if value[:1] != STREAM_MARKER or len(value) != _MANIFEST.size:
+        return None
+    _, write_id, chunks = _MANIFEST.unpack(bytes(value))
+    return write_id, chunks
@@ -0,0 +1,232 @@
+"""
+Cache warming: preloads the results of a decorated function in batches, so
+a cold cache after a deploy or a flush doesn't send every call to the
+upstreams at once. Run `python -m cache_deco.warm module:function calls.jsonl`
+to warm a cache from the command line
+"""
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait)
+import argparse
+import importlib
+import itertools
+import json
+import sys
+import threading
+import time
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_BATCH_SIZE = 100
+
+
+class WarmProgress(object):
+    """
+    Counters of a warming run, passed to the progress callback after every
+    batch
+    """
+
+    def __init__(self):
+        self.batches = 0
+        # Calls looked up, computed because they were missing, already
+        # cached, and lost in batches that raised
+        self.calls = 0
+        self.computed = 0
+        self.cached = 0
+        self.failed = 0
+        self.started = time.time()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    def __repr__(self):
+        return '%d calls, %d computed, %d already cached, %d failed ' \
+               'in %.1fs' % (self.calls, self.computed, self.cached,
+                             self.failed, self.elapsed)
+
+
+class RateLimiter(object):
+    """
+    Token bucket limiting how often the warmed function is called. Callers
+    reserve a token and sleep until it is due, so the limit holds across
+    threads
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: Calls per second
+        :param burst: Calls allowed at once after being idle
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a call is allowed
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            delay = -self._tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+    def __getstate__(self):
+        # Each worker process gets its own bucket
+        return self.rate, self.burst
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+def _batches(args_list, batch_size):
+    calls = iter(args_list)
+    while True:
+        batch = [tuple(args) for args in itertools.islice(calls, batch_size)]
+        if not batch:
+            return
+        yield batch
+
+
+def _warm_batch(fn, batch, limiter):
+    """
+    Runs on a pool worker
+    :return: Number of calls computed
+    """
+    computed = []
+
+    def on_compute():
+        if limiter is not None:
+            limiter.acquire()
+        computed.append(None)
+
+    fn.cache_warm_batch(batch, on_compute)
+    return len(computed)
+
+
+def preload(fn, args_list, concurrency=DEFAULT_CONCURRENCY,
+            batch_size=DEFAULT_BATCH_SIZE, rate=None, processes=False,
+            progress=None):
+    """
+    Computes and writes the results of the calls missing from the cache.
+    Each batch is looked up with one get_many and written with one
+    set_many_and_expire, with the keys the decorated function looks up
+    :param fn: Function decorated by a Cache, not a coroutine function
+    :param args_list: Iterable of tuples of positional arguments, read
+    lazily
+    :param concurrency: Batches computed at once
+    :param batch_size: Calls per batch
+    :param rate: Maximum calls of the function per second, None for no limit
+    :param processes: Compute on a process pool instead of threads. The
+    function must then be importable by name, and the backend shared between
+    processes
+    :param progress: Optional callable taking the WarmProgress after every
+    batch
+    :return: WarmProgress of the finished run
+    """
+    if not callable(getattr(fn, 'cache_warm_batch', None)):
+        raise ValueError('%r is not a function decorated by a Cache, or is '
+                         'a coroutine function' % (fn,))
+    limiter = None
+    if rate is not None:
+        # The process pool splits the rate between its workers
+        limiter = RateLimiter(rate / concurrency if processes else rate)
+    status = WarmProgress()
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            size = pending.pop(future)
+            status.batches += 1
+            status.calls += size
+            try:
+                computed = future.result()
+            except Exception:
+                status.failed += size
+                computed = 0
+            else:
+                status.computed += computed
+                status.cached += size - computed
+            if progress is not None:
+                progress(status)
+
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool_class(concurrency) as pool:
+        for batch in _batches(args_list, batch_size):
+            # Only a few batches are queued, so huge iterables stream
+            if len(pending) >= concurrency * 2:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            pending[pool.submit(_warm_batch, fn, batch, limiter)] = \
+                len(batch)
+        collect(wait(pending).done)
+    return status
+
+
+def load_function(name):
+    """
+    :param name: 'module:function', the function may be an attribute path
+    :return: The function
+    """
+    module_name, _, path = name.partition(':')
+    if not path:
+        raise ValueError('expected module:function, got %r' % name)
+    target = importlib.import_module(module_name)
+    for attribute in path.split('.'):
+        target = getattr(target, attribute)
+    return target
+
+
+def read_calls(lines):
+    """
+    :param lines: Iterable of lines, each a JSON array of positional
+    arguments
+    :return: Iterator of argument tuples
+    """
+    for line in lines:
+        if line.strip():
+            yield tuple(json.loads(line))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m cache_deco.warm',
+        description='Preloads the results of a function decorated by a '
+                    'Cache')
+    parser.add_argument('function',
+                        help='module:function of the decorated function')
+    parser.add_argument('calls', nargs='?', default='-',
+                        help='file with one JSON array of positional '
+                             'arguments per line, - for stdin')
+    parser.add_argument('--concurrency', type=int,
+                        default=DEFAULT_CONCURRENCY,
+                        help='batches computed at once')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='calls per backend round trip')
+    parser.add_argument('--rate', type=float,
+                        help='maximum calls of the function per second')
+    parser.add_argument('--processes', action='store_true',
+                        help='compute on processes instead of threads')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, '')
+    fn = load_function(args.function)
+    calls = sys.stdin if args.calls == '-' else open(args.calls)
+    try:
+        status = preload(
+            fn, read_calls(calls), args.concurrency, args.batch_size,
+            args.rate, args.processes,
+            lambda status: print(status, file=sys.stderr))
+    finally:
+        if calls is not sys.stdin:
+            calls.close()
+    print(status)
+    return 1 if status.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
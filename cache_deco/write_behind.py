@@ -0,0 +1,271 @@
+from backends.forking import after_fork
+from itertools import islice
+import atexit
+import threading
+
+# What submit does when max_pending writes are already queued
+DROP = 'drop'
+BLOCK = 'block'
+POLICIES = (DROP, BLOCK)
+
+DEFAULT_MAX_PENDING = 10000
+# Most writes sent to the backend in one pipelined batch
+DEFAULT_BATCH_SIZE = 100
+
+
+class _Write(object):
+    __slots__ = ('value', 'encode', 'expiration', 'on_written')
+
+    def __init__(self, value, encode, expiration, on_written):
+        self.value = value
+        self.encode = encode
+        self.expiration = expiration
+        self.on_written = on_written
+
+
+class WriteBehind(object):
+    """
+    Writes cache fills to the backend on background threads, so callers
+    don't wait for serialization or the write round trip. Queued writes to
+    the same key are coalesced, and a value is readable with pending() until
+    it is written. Failed writes are counted, never raised
+    """
+
+    def __init__(self, backend, max_pending=DEFAULT_MAX_PENDING,
+                 policy=DROP, block_timeout=None, workers=1,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param backend: The backend to write to
+        :param max_pending: Maximum number of queued writes
+        :param policy: DROP to discard writes while the queue is full, BLOCK
+        to wait for room
+        :param block_timeout: Seconds BLOCK waits before dropping the write,
+        None to wait forever
+        :param workers: Number of writer threads
+        :param batch_size: Most writes sent in one set_many_and_expire call
+        """
+        if policy not in POLICIES:
+            raise ValueError('policy must be one of %s' % (POLICIES,))
+        self.backend = backend
+        self.max_pending = max_pending
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.workers = workers
+        self.batch_size = batch_size
+        self.written = 0
+        self.errors = 0
+        self.dropped = 0
+        self._closed = False
+        self._reset_after_fork()
+        after_fork(self, WriteBehind._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # The writer threads don't survive a fork, they are started again by
+        # the next submit. Writes queued in the parent are left to the
+        # parent, so the child doesn't write them a second time
+        # key -> _Write, in submission order
+        self._pending = {}
+        # key -> _Write being written by a worker
+        self._writing = {}
+        # Keys discarded while being written, deleted once the write lands
+        self._discarded = set()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def submit(self, key, value, encode, expiration, on_written=None):
+        """
+        Queues a write, replacing a queued write to the same key
+        :param key: The cache key
+        :param value: The value, returned by pending() until it is written
+        :param encode: Callable serializing the value to bytes, called on a
+        writer thread. It may return None to skip the write
+        :param expiration: TTL in seconds
+        :param on_written: Optional callable taking the key, the value and
+        the bytes once they are written
+        :return: False if the write was dropped
+        """
+        write = _Write(value, encode, expiration, on_written)
+        with self._changed:
+            if self._closed:
+                self.dropped += 1
+                return False
+            if key not in self._pending and not self._wait_for_room():
+                self.dropped += 1
+                return False
+            self._pending[key] = write
+            if not self._threads:
+                self._start()
+            self._changed.notify_all()
+        return True
+
+    def _wait_for_room(self):
+        # Called with the lock held
+        if len(self._pending) < self.max_pending:
+            return True
+        if self.policy == DROP:
+            return False
+        self._changed.wait_for(
+            lambda: len(self._pending) < self.max_pending or self._closed,
+            self.block_timeout)
+        return len(self._pending) < self.max_pending and not self._closed
+
+    def pending(self, key, default=None):
+        """
+        :param key: The cache key
+        :return: The value of a write to the key not yet completed, or
+        default
+        """
+        write = self._pending.get(key)
+        if write is None and key not in self._discarded:
+            write = self._writing.get(key)
+        if write is None:
+            return default
+        return write.value
+
+    def discard(self, key):
+        """
+        Cancels the writes to a key, for when it is invalidated. A write
+        already sent to the backend is followed by a delete of the key
+        :param key: The cache key
+        """
+        with self._changed:
+            self._pending.pop(key, None)
+            if key in self._writing:
+                self._discarded.add(key)
+            self._changed.notify_all()
+
+    def _start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name='cache-write-behind-%d' % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.close)
+
+    def _take_batch(self):
+        # Called with the lock held. Keys being written by another worker
+        # are left queued, so writes to a key land in order
+        keys = [key for key in islice(self._pending, self.batch_size * 2)
+                if key not in self._writing][:self.batch_size]
+        batch = {}
+        for key in keys:
+            # Moved to _writing before leaving _pending, so pending() finds
+            # the value throughout
+            batch[key] = self._writing[key] = self._pending[key]
+            del self._pending[key]
+        return batch
+
+    def _run(self):
+        while True:
+            with self._changed:
+                batch = self._take_batch()
+                while not batch:
+                    if self._closed and not self._pending:
+                        return
+                    self._changed.wait()
+                    batch = self._take_batch()
+                # Room was made for blocked submitters
+                self._changed.notify_all()
+            written, errors = self._write(batch)
+            with self._changed:
+                discarded = [key for key in batch if key in self._discarded]
+            if discarded:
+                errors += self._delete(discarded)
+            with self._changed:
+                for key, write in batch.items():
+                    if self._writing.get(key) is write:
+                        del self._writing[key]
+                        self._discarded.discard(key)
+                self.written += written
+                self.errors += errors
+                self._changed.notify_all()
+
+    def _delete(self, keys):
+        """
+        Deletes keys whose write was discarded while it was in flight
+        :return: Number of keys that failed to delete
+        """
+        try:
+            self.backend.invalidate_many(keys)
+        except Exception:
+            return len(keys)
+        return 0
+
+    def _write(self, batch):
+        """
+        Serializes and writes a batch, grouping the keys by expiration
+        :return: (number of keys written, number of failed keys)
+        """
+        errors = 0
+        groups = {}
+        for key, write in batch.items():
+            if key in self._discarded:
+                continue
+            try:
+                data = write.encode(write.value)
+            except Exception:
+                errors += 1
+                continue
+            if data is None:
+                continue
+            groups.setdefault(write.expiration, {})[key] = data
+        written = 0
+        for expiration, mapping in groups.items():
+            try:
+                self.backend.set_many_and_expire(mapping, expiration)
+            except Exception:
+                errors += len(mapping)
+                continue
+            written += len(mapping)
+            # Under the lock, so a key discarded meanwhile is either
+            # skipped here or discarded after its callback ran
+            with self._changed:
+                for key, data in mapping.items():
+                    write = batch[key]
+                    if write.on_written is None or key in self._discarded:
+                        continue
+                    try:
+                        write.on_written(key, write.value, data)
+                    except Exception:
+                        pass
+        return written, errors
+
+    def flush(self, timeout=None):
+        """
+        Waits for every queued write to complete
+        :param timeout: Maximum number of seconds to wait, None for no limit
+        :return: True if the queue was drained
+        """
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: not self._pending and not self._writing, timeout)
+
+    def close(self, timeout=None):
+        """
+        Writes the queued values and stops the writer threads. Later writes
+        are dropped
+        :param timeout: Maximum number of seconds to wait, None for no limit
+        :return: True if the queue was drained
+        """
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        drained = self.flush(timeout)
+        for thread in self._threads:
+            thread.join(timeout)
+        return drained
+
+    def stats(self):
+        """
+        :return: Dictionary with the number of queued, written, failed and
+        dropped writes
+        """
+        with self._lock:
+            return {
+                'pending': len(self._pending) + len(self._writing),
+                'written': self.written,
+                'errors': self.errors,
+                'dropped': self.dropped,
+            }
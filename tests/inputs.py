@@ -1,3 +1,8 @@
+from backends.backend_base import AsyncBackend
+from backends.memory.memory_backend import MemoryBackend
+import collections
+
+
 class SimpleObject(object):
 
     def __init__(self, string, number):
@@ -5,4 +10,43 @@ class SimpleObject(object):
         self.number = number
 
     def __eq__(self, other):
+        if not isinstance(other, SimpleObject):
+            return NotImplemented
         return self.string == other.string and self.number == other.number
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.string, self.number))
+
+
+class AsyncMemoryBackend(AsyncBackend):
+    """
+    AsyncBackend storing keys in a MemoryBackend, counting the calls made
+    """
+
+    def __init__(self):
+        super(AsyncMemoryBackend, self).__init__()
+        self.memory = MemoryBackend()
+        self.calls = collections.Counter()
+
+    async def get_cache(self, key):
+        self.calls['get_cache'] += 1
+        return self.memory.get_cache(key)
+
+    async def set_cache_and_expire(self, key, value, expiration):
+        self.calls['set_cache_and_expire'] += 1
+        return self.memory.set_cache_and_expire(key, value, expiration)
+
+    async def invalidate_key(self, key):
+        self.calls['invalidate_key'] += 1
+        return self.memory.invalidate_key(key)
+
+    async def get_many(self, keys):
+        self.calls['get_many'] += 1
+        return self.memory.get_many(keys)
+
+    async def incr(self, key):
+        self.calls['incr'] += 1
+        return self.memory.incr(key)
@@ -0,0 +1,67 @@
+from cache_deco.admission import (
+    AdmissionPolicy, FrequencySketch, FAST, LARGE, VALUE, RARE, MAX_COUNT)
+from unittest import TestCase
+
+
+class TestFrequencySketch(TestCase):
+    """
+    Test cases for FrequencySketch
+    """
+
+    def test_increment(self):
+        """
+        Tests counting keys, rounding the width and saturating counters
+        """
+        sketch = FrequencySketch(1000)
+        self.assertEqual(sketch.width, 1024)
+        self.assertEqual(sketch.estimate('key'), 0)
+        self.assertEqual(sketch.increment('key'), 1)
+        self.assertEqual(sketch.increment('key'), 2)
+        self.assertEqual(sketch.estimate('key'), 2)
+        for _ in range(20):
+            sketch.increment('key')
+        self.assertEqual(sketch.estimate('key'), MAX_COUNT)
+
+    def test_aging(self):
+        """
+        Tests that counters are halved once enough keys were counted
+        """
+        sketch = FrequencySketch(16)
+        for _ in range(8):
+            sketch.increment('key')
+        for i in range(sketch.sample_size - 8):
+            sketch.increment(('other', i % 4))
+        self.assertLessEqual(sketch.estimate('key'), 4)
+        self.assertGreaterEqual(sketch.estimate('key'), 4)
+
+
+class TestAdmissionPolicy(TestCase):
+    """
+    Test cases for AdmissionPolicy
+    """
+
+    def test_from_options(self):
+        """
+        Tests that a policy is only built when an admission option is set
+        """
+        self.assertIsNone(AdmissionPolicy.from_options({'expiration': 10}))
+        policy = AdmissionPolicy.from_options({'admission_sketch': True,
+                                               'min_frequency': 3})
+        self.assertIsInstance(policy.sketch, FrequencySketch)
+        self.assertEqual(policy.min_frequency, 3)
+
+    def test_check(self):
+        """
+        Tests each rejection reason
+        """
+        policy = AdmissionPolicy(min_compute_time=0.1, max_size=10,
+                                 cache_if=lambda value: value is not None)
+        self.assertEqual(policy.check('key', 1, 0.05), FAST)
+        self.assertEqual(policy.check('key', None, 0.5), VALUE)
+        self.assertIsNone(policy.check('key', 1, 0.5))
+        self.assertEqual(policy.check_size(11), LARGE)
+        self.assertIsNone(policy.check_size(10))
+
+        policy = AdmissionPolicy(sketch=FrequencySketch(16))
+        self.assertEqual(policy.check('key', 1, 0), RARE)
+        self.assertIsNone(policy.check('key', 1, 0))
@@ -1,9 +1,18 @@
-from cache_deco import Cache, DEFAULT_EXPIRATION
+from cache_deco import Cache, DEFAULT_EXPIRATION, generations, keys
+from cache_deco.circuit_breaker import CircuitBreaker
+from cache_deco.local_cache import LocalCache
+from cache_deco.write_behind import WriteBehind
 from backends.backend_base import Backend, BackendException
+from backends.memory.memory_backend import MemoryBackend
+from backends.sharded.sharded_backend import ShardedBackend
 from unittest import TestCase
-from mock import Mock
-from inputs import SimpleObject
+from mock import ANY as mock_any, Mock, patch
+from tests.inputs import AsyncMemoryBackend, SimpleObject
+import asyncio
 import collections
+import itertools
+import threading
+import time
 import pickle
 
 
@@ -43,6 +52,24 @@ class TestRedisCache(TestCase):
         mock_client.set_cache_and_expire.assert_called_once_with(
             expected_hash, pickle.dumps(test_param), DEFAULT_EXPIRATION)
 
+    def test_cache_miss_none(self):
+        """
+        Tests that a None response from the backend is a cache miss
+        """
+        mock_client = Mock()
+        redis_cache = Cache(Backend())
+        redis_cache.backend = mock_client
+        redis_cache.backend.get_cache.return_value = None
+
+        @redis_cache.cache()
+        def test_function(a):
+            return a
+
+        self.assertEqual(test_function('input'), 'input')
+        mock_client.set_cache_and_expire.assert_called_once_with(
+            redis_cache._generate_cache_key(test_function, ('input',), {}),
+            pickle.dumps('input'), DEFAULT_EXPIRATION)
+
     def test_cache_miss_kwargs(self):
         """
         Tests a cache miss against a function with kwargs
@@ -403,3 +430,1123 @@ class TestRedisCache(TestCase):
         stateful_instance.state = state2
         return_value_for_state2 = stateful_instance.some_method()
         self.assertNotEqual(return_value_for_state1, return_value_for_state2)
+
+    def test_map(self):
+        """
+        Tests that map resolves all keys at once and computes only misses
+        """
+        mock_client = Mock()
+        redis_cache = Cache(Backend())
+        redis_cache.backend = mock_client
+        calls = []
+
+        @redis_cache.cache(expiration=30)
+        def test_function(a, b):
+            calls.append((a, b))
+            return a + b
+
+        def cache_key_for(*args):
+            return redis_cache._generate_cache_key(test_function, args, {})
+
+        cached = {cache_key_for(1, 2): pickle.dumps(3)}
+        mock_client.get_many.side_effect = \
+            lambda keys: [cached.get(key) for key in keys]
+
+        results = test_function.map([(1, 2), (2, 3), (2, 3), (3, 4)])
+
+        self.assertEqual(results, [3, 5, 5, 7])
+        self.assertEqual(calls, [(2, 3), (3, 4)])
+        mock_client.get_many.assert_called_once_with([
+            cache_key_for(1, 2), cache_key_for(2, 3), cache_key_for(3, 4)])
+        mock_client.set_many_and_expire.assert_called_once_with(
+            {cache_key_for(2, 3): pickle.dumps(5),
+             cache_key_for(3, 4): pickle.dumps(7)}, 30)
+        self.assertEqual(mock_client.get_cache.call_count, 0)
+
+    def test_map_all_hits(self):
+        """
+        Tests that map does not write back when everything is cached
+        """
+        mock_client = Mock()
+        redis_cache = Cache(Backend())
+        redis_cache.backend = mock_client
+        mock_client.get_many.return_value = [pickle.dumps('a'),
+                                             pickle.dumps('b')]
+
+        @redis_cache.cache(invalidator=True)
+        def test_function(a):
+            raise AssertionError('should not be computed')
+
+        results = test_function.map([('a',), ('b',)])
+
+        self.assertEqual([value for value, _ in results], ['a', 'b'])
+        self.assertEqual(mock_client.set_many_and_expire.call_count, 0)
+        results[1][1]()
+        mock_client.invalidate_key.assert_called_once_with(
+            redis_cache._generate_cache_key(test_function, ('b',), {}))
+
+    def test_map_backend_failure(self):
+        """
+        Tests that map computes everything when the backend fails
+        """
+        mock_client = Mock()
+        redis_cache = Cache(Backend())
+        redis_cache.backend = mock_client
+        mock_client.get_many.side_effect = BackendException
+
+        @redis_cache.cache(invalidator=True)
+        def test_function(a):
+            return a * 2
+
+        results = test_function.map([(1,), (2,)])
+
+        self.assertEqual(results, [(2, None), (4, None)])
+        self.assertEqual(mock_client.set_many_and_expire.call_count, 0)
+
+    def test_local_cache(self):
+        """
+        Tests that the in-process tier serves hits without the backend
+        """
+        mock_client = Mock()
+        redis_cache = Cache(Backend(), local_cache=LocalCache())
+        redis_cache.backend = mock_client
+        mock_client.get_cache.return_value = None
+        calls = []
+
+        @redis_cache.cache(invalidator=True)
+        def test_function(a):
+            calls.append(a)
+            return [a]
+
+        first, invalidator = test_function('input')
+        second, _ = test_function('input')
+
+        self.assertEqual(first, ['input'])
+        self.assertIs(second, first)
+        self.assertEqual(calls, ['input'])
+        self.assertEqual(mock_client.get_cache.call_count, 1)
+        self.assertEqual(redis_cache.stats(), {
+            'backend_hits': 0, 'backend_misses': 1,
+            'local_hits': 1, 'local_misses': 1})
+
+        # Invalidating drops the entry from both tiers
+        invalidator()
+        mock_client.get_cache.return_value = pickle.dumps(['cached'])
+        self.assertEqual(test_function('input')[0], ['cached'])
+        self.assertEqual(mock_client.get_cache.call_count, 2)
+        self.assertEqual(redis_cache.stats()['backend_hits'], 1)
+
+    def test_local_cache_per_decorator(self):
+        """
+        Tests that the in-process tier can be chosen or disabled per function
+        """
+        mock_client = Mock()
+        shared = LocalCache()
+        own = LocalCache(ttl=5)
+        redis_cache = Cache(Backend(), local_cache=shared)
+        redis_cache.backend = mock_client
+        mock_client.get_cache.return_value = pickle.dumps('cached')
+
+        @redis_cache.cache(local_cache=False)
+        def remote_only(a):
+            return a
+
+        @redis_cache.cache(local_cache=own, local_ttl=100, expiration=10)
+        def own_tier(a):
+            return a
+
+        remote_only('a')
+        remote_only('a')
+        self.assertEqual(mock_client.get_cache.call_count, 2)
+        self.assertEqual(len(shared), 0)
+
+        own_tier('a')
+        own_tier('a')
+        self.assertEqual(mock_client.get_cache.call_count, 3)
+        self.assertEqual(len(own), 1)
+        self.assertEqual(own.hits, 1)
+
+    def test_map_local_cache(self):
+        """
+        Tests that map only asks the backend for keys missing locally
+        """
+        mock_client = Mock()
+        redis_cache = Cache(Backend(), local_cache=LocalCache())
+        redis_cache.backend = mock_client
+        mock_client.get_many.side_effect = lambda keys: [None] * len(keys)
+
+        @redis_cache.cache()
+        def test_function(a):
+            return a * 2
+
+        self.assertEqual(test_function.map([(1,), (2,)]), [2, 4])
+        self.assertEqual(test_function.map([(1,), (3,)]), [2, 6])
+        mock_client.get_many.assert_called_with(
+            [redis_cache._generate_cache_key(test_function, (3,), {})])
+
+    def test_lean_wrapper(self):
+        """
+        Tests that a function cached in nothing but a backend keeps its
+        metrics, invalidator and fallback on the lean wrapper
+        """
+        backend = Mock(wraps=MemoryBackend())
+        lean_cache = Cache(backend)
+        calls = []
+
+        @lean_cache.cache(invalidator=True)
+        def test_function(a, b=0):
+            calls.append(a)
+            return a + b
+
+        self.assertEqual(test_function(1, b=2)[0], 3)
+        value, invalidator = test_function(1, b=2)
+        self.assertEqual(value, 3)
+        self.assertEqual(test_function.__name__, 'test_function')
+        invalidator()
+        self.assertEqual(test_function(1, b=2)[0], 3)
+        self.assertEqual(calls, [1, 1])
+
+        backend.get_cache.side_effect = BackendException()
+        self.assertEqual(test_function(2), (2, None))
+        metrics = lean_cache.metrics.snapshot()[keys.function_id(
+            test_function)]
+        self.assertEqual(
+            (metrics['hits'], metrics['misses'], metrics['errors'],
+             metrics['invalidations']), (1, 2, 1, 1))
+        self.assertEqual(metrics['backend_latency']['get']['count'], 3)
+
+    def test_memory_backend(self):
+        """
+        Tests the decorator end to end against the in-memory backend
+        """
+        memory_cache = Cache(MemoryBackend())
+        calls = []
+
+        @memory_cache.cache(invalidator=True)
+        def test_function(a):
+            calls.append(a)
+            return SimpleObject(a, len(calls))
+
+        first, invalidator = test_function('input')
+        second, _ = test_function('input')
+        self.assertEqual(first, second)
+        self.assertEqual(calls, ['input'])
+
+        invalidator()
+        test_function('input')
+        self.assertEqual(calls, ['input', 'input'])
+
+    def test_single_flight_local(self):
+        """
+        Tests that concurrent misses in one process compute only once
+        """
+        memory_cache = Cache(MemoryBackend())
+        calls = []
+        started = threading.Barrier(8)
+
+        @memory_cache.cache(single_flight='local')
+        def test_function(a):
+            calls.append(a)
+            time.sleep(0.2)
+            return a
+
+        def worker():
+            started.wait()
+            self.assertEqual(test_function('input'), 'input')
+
+        workers = [threading.Thread(target=worker) for _ in range(8)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        self.assertEqual(calls, ['input'])
+
+    def test_single_flight_distributed(self):
+        """
+        Tests that a process waits for the holder of the backend lock to
+        fill the key instead of computing it
+        """
+        backend = MemoryBackend()
+        memory_cache = Cache(backend)
+
+        @memory_cache.cache(single_flight='distributed')
+        def test_function(a):
+            raise AssertionError('should not be computed')
+
+        fn_hash = memory_cache._generate_cache_key(test_function, ('a',), {})
+        # Another process holds the lock and fills the key shortly after
+        self.assertIsNotNone(backend.acquire_lock(fn_hash + ':lock', 10))
+        filler = threading.Timer(0.05, backend.set_cache_and_expire,
+                                 (fn_hash, pickle.dumps('filled'), 60))
+        filler.start()
+
+        self.assertEqual(test_function('a'), 'filled')
+
+    def test_single_flight_distributed_lock(self):
+        """
+        Tests that the lock is taken and released around the computation,
+        and that waiting gives up after lock_wait
+        """
+        backend = MemoryBackend()
+        memory_cache = Cache(backend)
+        calls = []
+
+        @memory_cache.cache(single_flight='distributed', lock_wait=0.05)
+        def test_function(a):
+            calls.append(a)
+            return a
+
+        lock_key = memory_cache._generate_cache_key(
+            test_function, ('a',), {}) + ':lock'
+        self.assertEqual(test_function('a'), 'a')
+        self.assertIsNotNone(backend.acquire_lock(lock_key, 10))
+
+        # The lock is never released, so the next miss computes anyway
+        lock_key = memory_cache._generate_cache_key(
+            test_function, ('b',), {}) + ':lock'
+        backend.acquire_lock(lock_key, 10)
+        self.assertEqual(test_function('b'), 'b')
+        self.assertEqual(calls, ['a', 'b'])
+
+    def test_single_flight_invalid(self):
+        """
+        Tests that unknown single flight modes are rejected
+        """
+        with self.assertRaises(ValueError):
+            Cache(MemoryBackend()).cache(single_flight='everywhere')
+
+    @patch('cache_deco.time')
+    def test_stale_while_revalidate(self, mock_time):
+        """
+        Tests that a value past its soft expiration is served while it is
+        recomputed in the background
+        """
+        backend = MemoryBackend()
+        memory_cache = Cache(backend)
+        calls = []
+
+        @memory_cache.cache(expiration=100, soft_expiration=10)
+        def test_function(a):
+            calls.append(a)
+            return len(calls)
+
+        mock_time.perf_counter.return_value = 0
+        mock_time.time.return_value = 1000
+        self.assertEqual(test_function('a'), 1)
+        mock_time.time.return_value = 1005
+        self.assertEqual(test_function('a'), 1)
+        self.assertEqual(calls, ['a'])
+
+        mock_time.time.return_value = 1011
+        self.assertEqual(test_function('a'), 1)
+        memory_cache._refresh_executor.shutdown(wait=True)
+        self.assertEqual(calls, ['a', 'a'])
+        self.assertEqual(test_function('a'), 2)
+
+    @patch('cache_deco.random')
+    @patch('cache_deco.time')
+    def test_early_refresh(self, mock_time, mock_random):
+        """
+        Tests that XFetch refreshes before expiry depending on the compute
+        time and the random draw
+        """
+        backend = MemoryBackend()
+        memory_cache = Cache(backend)
+        calls = []
+
+        @memory_cache.cache(expiration=100, early_refresh=True)
+        def test_function(a):
+            calls.append(a)
+            return len(calls)
+
+        mock_time.perf_counter.return_value = 0
+        # The first call takes 2 seconds to compute
+        mock_time.time.side_effect = [1000, 1002]
+        test_function('a')
+        mock_time.time.side_effect = None
+
+        # 1002 + 100 - 2 * ln(1 / 0.5) ~ 1100.6 is before the hard expiry
+        mock_time.time.return_value = 1099
+        mock_random.random.return_value = 0.5
+        test_function('a')
+        self.assertIsNone(memory_cache._refresh_executor)
+
+        mock_time.time.return_value = 1101
+        test_function('a')
+        memory_cache._refresh_executor.shutdown(wait=True)
+        self.assertEqual(len(calls), 2)
+
+    def test_soft_expiration_map(self):
+        """
+        Tests that map reads values stored with refresh metadata
+        """
+        memory_cache = Cache(MemoryBackend())
+
+        @memory_cache.cache(soft_expiration=10)
+        def test_function(a):
+            return [a]
+
+        self.assertEqual(test_function('a'), ['a'])
+        self.assertEqual(test_function.map([('a',), ('b',)]), [['a'], ['b']])
+        self.assertEqual(test_function('b'), ['b'])
+
+    def test_coroutine_function(self):
+        """
+        Tests caching a coroutine function with an AsyncBackend
+        """
+        backend = AsyncMemoryBackend()
+        async_cache = Cache(backend)
+        calls = []
+
+        @async_cache.cache(invalidator=True)
+        async def test_function(a):
+            calls.append(a)
+            await asyncio.sleep(0)
+            return SimpleObject(a, len(calls))
+
+        async def scenario():
+            first, invalidator = await test_function('a')
+            second, _ = await test_function('a')
+            self.assertEqual(first, second)
+            self.assertEqual(calls, ['a'])
+
+            await invalidator()
+            await test_function('a')
+            self.assertEqual(calls, ['a', 'a'])
+        asyncio.run(scenario())
+
+        self.assertEqual(backend.calls['get_cache'], 3)
+        self.assertEqual(backend.calls['invalidate_key'], 1)
+
+    def test_sync_function_async_backend(self):
+        """
+        Tests that a plain function can't be cached in an AsyncBackend
+        """
+        async_cache = Cache(AsyncMemoryBackend())
+
+        def test_function(a):
+            return a
+
+        with self.assertRaises(ValueError):
+            async_cache.cache()(test_function)
+        with self.assertRaises(ValueError):
+            async_cache.cache(stream=True)(test_function)
+        with self.assertRaises(ValueError):
+            Cache(AsyncMemoryBackend(), max_value_size=10).cache()(
+                test_function)
+
+    def test_coroutine_function_sync_backend(self):
+        """
+        Tests caching a coroutine function with a non-blocking Backend and
+        the in-process tier
+        """
+        async_cache = Cache(MemoryBackend(), local_cache=LocalCache())
+        calls = []
+
+        @async_cache.cache()
+        async def test_function(a):
+            calls.append(a)
+            return a
+
+        async def scenario():
+            self.assertEqual(await test_function('a'), 'a')
+            self.assertEqual(await test_function('a'), 'a')
+        asyncio.run(scenario())
+
+        self.assertEqual(calls, ['a'])
+        self.assertEqual(async_cache.local_cache.hits, 1)
+
+    def test_coroutine_function_backend_failure(self):
+        """
+        Tests that a failing backend falls back to awaiting the function
+        """
+        backend = AsyncMemoryBackend()
+        async_cache = Cache(backend)
+
+        async def get_cache(key):
+            raise BackendException()
+        backend.get_cache = get_cache
+
+        @async_cache.cache(invalidator=True)
+        async def test_function(a):
+            return a
+
+        self.assertEqual(asyncio.run(test_function('a')), ('a', None))
+
+    def test_coroutine_map(self):
+        """
+        Tests that map on a coroutine function computes misses concurrently
+        """
+        backend = AsyncMemoryBackend()
+        async_cache = Cache(backend)
+        running = []
+        peak = []
+
+        @async_cache.cache()
+        async def test_function(a):
+            running.append(a)
+            await asyncio.sleep(0.01)
+            peak.append(len(running))
+            running.remove(a)
+            return a * 2
+
+        async def scenario():
+            self.assertEqual(await test_function(1), 2)
+            self.assertEqual(
+                await test_function.map([(1,), (2,), (3,)]), [2, 4, 6])
+        asyncio.run(scenario())
+
+        # Both misses were running at the same time
+        self.assertEqual(peak, [1, 2, 1])
+        self.assertEqual(backend.calls['get_many'], 1)
+
+    def test_coroutine_unsupported_options(self):
+        """
+        Tests that options needing threads are rejected for coroutines
+        """
+        with self.assertRaises(ValueError):
+            @Cache(MemoryBackend()).cache(single_flight='local')
+            async def test_function(a):
+                return a
+
+    def test_serializer_options(self):
+        """
+        Tests that the Cache serializer can be overridden per decorator
+        """
+        backend = MemoryBackend()
+        json_cache = Cache(backend, serializer='json', compression='zlib',
+                           compress_threshold=10)
+
+        @json_cache.cache()
+        def compressed(a):
+            return ['x'] * a
+
+        @json_cache.cache(serializer='raw', compression=None)
+        def raw(a):
+            return b'raw' * a
+
+        self.assertEqual(compressed(100), ['x'] * 100)
+        self.assertEqual(raw(2), b'rawraw')
+
+        stored = backend.get_cache(
+            json_cache._generate_cache_key(compressed, (100,), {}))
+        self.assertEqual(stored[0], 3 << 2 | 1)
+        stored = backend.get_cache(
+            json_cache._generate_cache_key(raw, (2,), {}))
+        self.assertEqual(stored, b'\x14rawraw')
+
+        # Served from the backend
+        self.assertEqual(compressed(100), ['x'] * 100)
+        self.assertEqual(raw(2), b'rawraw')
+        self.assertEqual(json_cache.backend_hits, 2)
+
+    def test_metrics(self):
+        """
+        Tests the per-function counters and histograms
+        """
+        memory_cache = Cache(MemoryBackend(), local_cache=LocalCache())
+        observer = Mock()
+        memory_cache.metrics.add_observer(observer)
+
+        @memory_cache.cache(invalidator=True, local_cache=False)
+        def test_function(a):
+            return a
+
+        @memory_cache.cache()
+        def local_function(a):
+            return a
+
+        test_function('a')
+        _, invalidator = test_function('a')
+        invalidator()
+        local_function('a')
+        local_function('a')
+
+        memory_cache.backend = Mock()
+        memory_cache.backend.get_cache.side_effect = BackendException()
+        test_function('b')
+
+        snapshot = memory_cache.metrics.snapshot()
+        name = 'tests.test_cache_deco.TestRedisCache.test_metrics.' \
+            '<locals>.test_function'
+        metrics = snapshot[name]
+        self.assertEqual(
+            (metrics['hits'], metrics['misses'], metrics['errors'],
+             metrics['invalidations']), (1, 1, 1, 1))
+        self.assertEqual(metrics['backend_latency']['get']['count'], 2)
+        self.assertEqual(metrics['backend_latency']['set']['count'], 1)
+        self.assertEqual(metrics['compute_time']['count'], 1)
+        self.assertEqual(metrics['serialized_size']['count'], 1)
+
+        local_metrics = snapshot[name.replace('test_function',
+                                              'local_function')]
+        self.assertEqual(local_metrics['local_hits'], 1)
+        observer.hit.assert_any_call(name, 'backend')
+        observer.error.assert_called_once_with(
+            name, memory_cache.backend.get_cache.side_effect)
+
+    def test_circuit_breaker(self):
+        """
+        Tests that an open circuit skips the backend until a probe succeeds
+        """
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+        mock_client = Mock()
+        mock_client.get_cache.side_effect = BackendException()
+        breaker_cache = Cache(mock_client, circuit_breaker=breaker)
+
+        @breaker_cache.cache()
+        def test_function(a):
+            return a
+
+        self.assertEqual(test_function('a'), 'a')
+        self.assertEqual(test_function('a'), 'a')
+        self.assertEqual(mock_client.get_cache.call_count, 2)
+        self.assertEqual(breaker_cache.stats()['circuit_trips'], 1)
+
+        breaker.reset_timeout = 60
+        self.assertEqual(test_function('a'), 'a')
+        self.assertEqual(mock_client.get_cache.call_count, 2)
+        self.assertEqual(breaker_cache.stats()['circuit_state'], 'open')
+        self.assertEqual(test_function.map([('a',)]), ['a'])
+        mock_client.get_many.assert_not_called()
+
+        # The probe succeeds and closes the circuit
+        breaker.reset_timeout = 0
+        mock_client.get_cache.side_effect = None
+        mock_client.get_cache.return_value = pickle.dumps('cached')
+        self.assertEqual(test_function('a'), 'cached')
+        self.assertEqual(breaker_cache.stats()['circuit_state'], 'closed')
+
+        metrics = list(breaker_cache.metrics.snapshot().values())[0]
+        self.assertEqual(metrics['errors'], 2)
+        self.assertEqual(metrics['short_circuits'], 2)
+
+    def test_circuit_breaker_local_map(self):
+        """
+        Tests that a map served from the in-process tier leaves a half open
+        circuit's probe to a call that reaches the backend
+        """
+        async def test_coroutine(a):
+            return a
+
+        for backend, fn, run in (
+                (MemoryBackend(), lambda a: a, lambda result: result),
+                (AsyncMemoryBackend(), test_coroutine, asyncio.run)):
+            breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+            local_cache = Cache(backend, local_cache=LocalCache(),
+                                circuit_breaker=breaker)
+            test_function = local_cache.cache()(fn)
+
+            self.assertEqual(run(test_function.map([('a',)])), ['a'])
+            breaker.record_failure()
+            self.assertEqual(run(test_function.map([('a',)])), ['a'])
+            self.assertEqual(breaker.state, 'half_open')
+            self.assertEqual(breaker._probes, 0)
+
+    def test_write_behind(self):
+        """
+        Tests that misses are returned before they are written, served from
+        the write queue meanwhile, and written in the background
+        """
+        backend = MemoryBackend()
+        write_behind = WriteBehind(backend)
+        behind_cache = Cache(backend, write_behind=write_behind,
+                             local_cache=LocalCache())
+        calls = []
+
+        @behind_cache.cache()
+        def test_function(a):
+            calls.append(a)
+            return a * 2
+
+        @behind_cache.cache(write_behind=False)
+        def inline_function(a):
+            return a * 3
+
+        self.assertEqual(test_function(1), 2)
+        self.assertEqual(test_function(1), 2)
+        self.assertEqual(test_function.map([(1,), (2,)]), [2, 4])
+        self.assertEqual(inline_function(1), 3)
+        self.assertEqual(calls, [1, 2])
+
+        self.assertTrue(write_behind.flush(5))
+        self.assertEqual(len(backend), 3)
+        self.assertEqual(behind_cache.stats()['write_behind_written'], 2)
+        # Written values went to the in-process tier
+        self.assertEqual(len(behind_cache.local_cache), 3)
+        write_behind.close()
+
+    def test_write_behind_invalidate(self):
+        """
+        Tests that invalidating a key cancels its queued write, so the old
+        value is neither served nor written afterwards
+        """
+        backend = MemoryBackend()
+        write = backend.set_many_and_expire
+        release = threading.Event()
+
+        def slow_write(mapping, expiration):
+            release.wait(5)
+            return write(mapping, expiration)
+        backend.set_many_and_expire = slow_write
+        write_behind = WriteBehind(backend)
+        self.addCleanup(write_behind.close)
+        behind_cache = Cache(backend, write_behind=write_behind)
+        calls = []
+
+        @behind_cache.cache(invalidator=True)
+        def test_function(a):
+            calls.append(a)
+            return len(calls)
+
+        value, invalidator = test_function(1)
+        self.assertEqual(value, 1)
+        invalidator()
+        self.assertEqual(test_function(1)[0], 2)
+        release.set()
+        self.assertTrue(write_behind.flush(5))
+        self.assertEqual(test_function(1)[0], 2)
+        self.assertEqual(calls, [1, 1])
+
+    def test_write_behind_invalidate_in_flight(self):
+        """
+        Tests that a write landing after its key was invalidated doesn't put
+        the old value back in the in-process tier
+        """
+        backend = MemoryBackend()
+        write = backend.set_many_and_expire
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_write(mapping, expiration):
+            started.set()
+            release.wait(5)
+            return write(mapping, expiration)
+        backend.set_many_and_expire = slow_write
+        write_behind = WriteBehind(backend)
+        self.addCleanup(write_behind.close)
+        behind_cache = Cache(backend, write_behind=write_behind,
+                             local_cache=LocalCache())
+        calls = []
+
+        @behind_cache.cache(invalidator=True)
+        def test_function(a):
+            calls.append(a)
+            return len(calls)
+
+        _, invalidator = test_function(1)
+        self.assertTrue(started.wait(5))
+        invalidator()
+        release.set()
+        self.assertTrue(write_behind.flush(5))
+        self.assertEqual(len(backend), 0)
+        self.assertEqual(len(behind_cache.local_cache), 0)
+        self.assertEqual(test_function(1)[0], 2)
+
+    def test_invalidate_function(self):
+        """
+        Tests that bumping a namespace invalidates every result of the
+        functions sharing it, and only those
+        """
+        namespace_cache = Cache(MemoryBackend(), local_cache=LocalCache())
+        calls = []
+
+        @namespace_cache.cache(namespace=True)
+        def test_function(a):
+            calls.append(('test', a))
+            return a
+
+        @namespace_cache.cache(namespace='shared')
+        def shared_function(a):
+            calls.append(('shared', a))
+            return a
+
+        @namespace_cache.cache()
+        def plain_function(a):
+            calls.append(('plain', a))
+            return a
+
+        for _ in range(2):
+            test_function(1)
+            test_function(2)
+            shared_function(1)
+            plain_function(1)
+        self.assertEqual(len(calls), 4)
+
+        namespace_cache.invalidate_function(test_function)
+        test_function(1)
+        test_function(2)
+        shared_function(1)
+        self.assertEqual(calls[4:], [('test', 1), ('test', 2)])
+
+        namespace_cache.invalidate_namespace('shared')
+        shared_function(1)
+        self.assertEqual(calls[6:], [('shared', 1)])
+        snapshot = namespace_cache.metrics.snapshot()
+        name = 'tests.test_cache_deco.TestRedisCache.' \
+            'test_invalidate_function.<locals>.test_function'
+        self.assertEqual(snapshot[name]['invalidations'], 1)
+
+        with self.assertRaises(ValueError):
+            namespace_cache.invalidate_function(plain_function)
+
+    def test_invalidate_tag(self):
+        """
+        Tests that tags, static or computed from the arguments, invalidate
+        results across functions, including through map
+        """
+        backend = MemoryBackend()
+        tag_cache = Cache(backend)
+        calls = []
+
+        @tag_cache.cache(tags=lambda user_id: ['user:%s' % user_id])
+        def profile(user_id):
+            calls.append(('profile', user_id))
+            return user_id
+
+        @tag_cache.cache(tags=('users',))
+        def user_count():
+            calls.append(('count',))
+            return 2
+
+        self.assertEqual(profile.map([(1,), (2,)]), [1, 2])
+        profile(1)
+        user_count()
+        user_count()
+        self.assertEqual(len(calls), 3)
+
+        tag_cache.invalidate_tag('user:1')
+        self.assertEqual(profile.map([(1,), (2,)]), [1, 2])
+        user_count()
+        self.assertEqual(calls[3:], [('profile', 1)])
+
+        tag_cache.invalidate_tag('users')
+        user_count()
+        self.assertEqual(calls[4:], [('count',)])
+
+    def test_generations_failure(self):
+        """
+        Tests that a function with tags is called uncached when its
+        generations can't be read, and skips the backend while the circuit
+        is open
+        """
+        backend = Mock()
+        backend.get_counters.side_effect = BackendException()
+        breaker = CircuitBreaker(failure_threshold=1)
+        tag_cache = Cache(backend, circuit_breaker=breaker)
+
+        @tag_cache.cache(tags='tag', invalidator=True)
+        def test_function(a):
+            return a
+
+        self.assertEqual(test_function(1), (1, None))
+        self.assertEqual(test_function.map([(1,), (2,)]),
+                         [(1, None), (2, None)])
+        self.assertEqual(backend.get_counters.call_count, 1)
+        self.assertEqual(backend.get_many.call_count, 0)
+        self.assertEqual(backend.get_cache.call_count, 0)
+
+    def test_generations_shard_down(self):
+        """
+        Tests that a namespace invalidation holds while the shard of its
+        generation counter is down: calls go uncached rather than reading
+        generation 0 from another shard
+        """
+        backend = ShardedBackend([MemoryBackend() for _ in range(4)])
+        namespace_cache = Cache(backend)
+        calls = []
+
+        @namespace_cache.cache(namespace='users')
+        def test_function(a):
+            calls.append(a)
+            return len(calls)
+
+        self.assertEqual(test_function('x'), 1)
+        namespace_cache.invalidate_namespace('users')
+        self.assertEqual(test_function('x'), 2)
+        self.assertEqual(test_function('x'), 2)
+
+        backend.mark_down(backend.shard_for(
+            generations.KEY_PREFIX + generations.namespace_name('users')))
+        self.assertEqual(test_function('x'), 3)
+        self.assertEqual(test_function('x'), 4)
+
+    def test_coroutine_invalidate_tag(self):
+        """
+        Tests namespaces and tags on a coroutine function
+        """
+        backend = AsyncMemoryBackend()
+        async_cache = Cache(backend, generation_ttl=60)
+        calls = []
+
+        @async_cache.cache(namespace=True, tags=lambda a: [a])
+        async def test_function(a):
+            calls.append(a)
+            return a
+
+        async def scenario():
+            await test_function('a')
+            await test_function.map([('a',), ('b',)])
+            await async_cache.invalidate_tag_async('a')
+            await test_function('a')
+            await test_function('b')
+            await async_cache.invalidate_function_async(test_function)
+            await test_function('b')
+        asyncio.run(scenario())
+
+        self.assertEqual(calls, ['a', 'b', 'a', 'b'])
+        # Generations were read once per name and then reused
+        self.assertEqual(backend.calls['incr'], 2)
+
+    def test_admission(self):
+        """
+        Tests that results rejected by the admission options are returned
+        but not cached, and counted in the metrics
+        """
+        admission_cache = Cache(MemoryBackend())
+        calls = []
+
+        @admission_cache.cache(cache_if=lambda value: value is not None,
+                               max_size=100)
+        def lookup(a):
+            calls.append(a)
+            return None if a == 'none' else a
+
+        @admission_cache.cache(min_compute_time=60)
+        def fast(a):
+            calls.append(('fast', a))
+            return a
+
+        @admission_cache.cache(admission_sketch=True)
+        def rare(a):
+            calls.append(('rare', a))
+            return a
+
+        for _ in range(2):
+            self.assertIsNone(lookup('none'))
+            self.assertEqual(lookup('x' * 200), 'x' * 200)
+            self.assertEqual(lookup('a'), 'a')
+            self.assertEqual(fast(1), 1)
+        self.assertEqual(calls.count('none'), 2)
+        self.assertEqual(calls.count('x' * 200), 2)
+        self.assertEqual(calls.count('a'), 1)
+        self.assertEqual(calls.count(('fast', 1)), 2)
+
+        # A key is cached on its second miss
+        self.assertEqual(rare.map([(1,), (2,)]), [1, 2])
+        rare(1)
+        rare(1)
+        self.assertEqual(calls.count(('rare', 1)), 2)
+
+        snapshot = admission_cache.metrics.snapshot()
+        prefix = 'tests.test_cache_deco.TestRedisCache.test_admission.' \
+            '<locals>.'
+        self.assertEqual(snapshot[prefix + 'lookup']['rejected_value'], 2)
+        self.assertEqual(snapshot[prefix + 'lookup']['rejected_large'], 2)
+        self.assertEqual(snapshot[prefix + 'fast']['rejected_fast'], 2)
+        self.assertEqual(snapshot[prefix + 'rare']['rejected_rare'], 2)
+
+    def test_cache_exceptions(self):
+        """
+        Tests that listed exceptions are cached for exception_ttl and raised
+        again on hits from either tier, and that other exceptions are not
+        """
+        for local_cache in (None, LocalCache()):
+            backend = Mock(wraps=MemoryBackend())
+            negative_cache = Cache(backend, local_cache=local_cache)
+            calls = []
+
+            @negative_cache.cache(cache_exceptions=(KeyError,),
+                                  exception_ttl=3)
+            def test_function(a):
+                calls.append(a)
+                if a == 'value':
+                    raise ValueError(a)
+                raise KeyError(a)
+
+            for _ in range(2):
+                with self.assertRaises(KeyError):
+                    test_function('key')
+                with self.assertRaises(ValueError):
+                    test_function('value')
+            self.assertEqual(calls, ['key', 'value', 'value'])
+            with self.assertRaises(KeyError):
+                test_function.map([('key',)])
+            self.assertEqual(len(calls), 3)
+            backend.set_cache_and_expire.assert_called_once_with(
+                mock_any, mock_any, 3)
+
+    def test_empty_ttl(self):
+        """
+        Tests that empty results are cached, for empty_ttl seconds
+        """
+        backend = Mock(wraps=MemoryBackend())
+        negative_cache = Cache(backend)
+        calls = []
+
+        @negative_cache.cache(expiration=60, empty_ttl=5)
+        def test_function(a):
+            calls.append(a)
+            return a or None
+
+        for _ in range(2):
+            self.assertIsNone(test_function(0))
+            self.assertEqual(test_function(1), 1)
+        self.assertEqual(calls, [0, 1])
+        self.assertEqual(
+            [call[0][2] for call in
+             backend.set_cache_and_expire.call_args_list], [5, 60])
+
+        self.assertEqual(test_function.map([(2,), ('',)]), [2, None])
+        self.assertEqual(
+            sorted(call[0][1] for call in
+                   backend.set_many_and_expire.call_args_list), [5, 60])
+
+    def test_coroutine_cache_exceptions(self):
+        """
+        Tests exception caching on a coroutine function
+        """
+        backend = AsyncMemoryBackend()
+        async_cache = Cache(backend, local_cache=LocalCache())
+        calls = []
+
+        @async_cache.cache(cache_exceptions=KeyError, empty_ttl=5)
+        async def test_function(a):
+            calls.append(a)
+            if a:
+                raise KeyError(a)
+            return []
+
+        async def scenario():
+            for _ in range(2):
+                with self.assertRaises(KeyError):
+                    await test_function('key')
+                self.assertEqual(await test_function(''), [])
+            async_cache.local_cache.clear()
+            with self.assertRaises(KeyError):
+                await test_function.map([('',), ('key',)])
+        asyncio.run(scenario())
+
+        self.assertEqual(calls, ['key', ''])
+
+    def test_stream(self):
+        """
+        Tests that generator results are written in chunks as they are
+        consumed, and read back lazily
+        """
+        backend = Mock(wraps=MemoryBackend())
+        stream_cache = Cache(backend)
+        calls = []
+
+        @stream_cache.cache(stream=2)
+        def numbers(count):
+            calls.append(count)
+            for i in range(count):
+                yield i
+
+        # A result consumed partly is not cached
+        self.assertEqual(list(itertools.islice(numbers(10), 3)), [0, 1, 2])
+        self.assertEqual(list(numbers(10)), list(range(10)))
+        self.assertEqual(calls, [10, 10])
+        # One chunk of the partly consumed result, left to expire, then five
+        # chunks and the manifest
+        self.assertEqual(backend.set_cache_and_expire.call_count, 6)
+        self.assertEqual(backend.set_many_and_expire.call_count, 1)
+
+        self.assertEqual(list(numbers(10)), list(range(10)))
+        self.assertEqual(list(itertools.islice(numbers(10), 3)), [0, 1, 2])
+        self.assertEqual(calls, [10, 10])
+        # Reading 3 items only fetched the first chunks
+        self.assertEqual(backend.get_many.call_count, 3 + 1)
+
+        self.assertEqual(list(numbers(0)), [])
+        self.assertEqual(list(numbers(0)), [])
+        self.assertEqual(calls, [10, 10, 0])
+
+        with self.assertRaises(ValueError):
+            @stream_cache.cache(stream=True)
+            async def coroutine():
+                pass
+
+    def test_stream_missing_chunk(self):
+        """
+        Tests that a stream missing a chunk is computed again from that
+        chunk and stored again
+        """
+        backend = MemoryBackend()
+        stream_cache = Cache(backend)
+        calls = []
+
+        @stream_cache.cache(stream=3, invalidator=True)
+        def letters():
+            calls.append(None)
+            return iter('abcdefgh')
+
+        items, invalidate = letters()
+        self.assertEqual(''.join(items), 'abcdefgh')
+        chunk_keys = [key for key in backend._entries if key.endswith(':1')]
+        self.assertEqual(len(chunk_keys), 1)
+        backend.invalidate_key(chunk_keys[0])
+
+        self.assertEqual(''.join(letters()[0]), 'abcdefgh')
+        self.assertEqual(''.join(letters()[0]), 'abcdefgh')
+        self.assertEqual(len(calls), 2)
+
+        invalidate()
+        self.assertEqual(''.join(letters()[0]), 'abcdefgh')
+        self.assertEqual(len(calls), 3)
+
+    def test_max_value_size(self):
+        """
+        Tests that large results are stored in chunks through the decorator,
+        map and write-behind
+        """
+        memory = MemoryBackend()
+        write_behind = WriteBehind(memory)
+        self.addCleanup(write_behind.close)
+        chunked_cache = Cache(memory, max_value_size=64,
+                              write_behind=write_behind)
+        self.assertIs(write_behind.backend, chunked_cache.backend)
+        calls = []
+
+        @chunked_cache.cache(write_behind=False)
+        def test_function(a):
+            calls.append(a)
+            return 'x' * a
+
+        @chunked_cache.cache()
+        def behind(a):
+            calls.append(a)
+            return 'y' * a
+
+        for _ in range(2):
+            self.assertEqual(test_function(500), 'x' * 500)
+            self.assertEqual(test_function.map([(10,), (300,)]),
+                             ['x' * 10, 'x' * 300])
+        behind(200)
+        write_behind.flush(5)
+        self.assertEqual(behind(200), 'y' * 200)
+        self.assertEqual(calls, [500, 10, 300, 200])
+        self.assertGreater(len(memory), 10)
+
+    def test_coroutine_admission(self):
+        """
+        Tests the admission options on a coroutine function
+        """
+        backend = AsyncMemoryBackend()
+        async_cache = Cache(backend)
+        calls = []
+
+        @async_cache.cache(cache_if=lambda value: value is not None)
+        async def test_function(a):
+            calls.append(a)
+            return a or None
+
+        async def scenario():
+            await test_function(0)
+            await test_function(1)
+            await test_function.map([(0,), (1,), (2,)])
+        asyncio.run(scenario())
+
+        self.assertEqual(calls, [0, 1, 0, 2])
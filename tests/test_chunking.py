@@ -0,0 +1,80 @@
+from backends.memory.memory_backend import MemoryBackend
+from cache_deco import chunking
+from unittest import TestCase
+from mock import Mock
+from tests.inputs import AsyncMemoryBackend
+import asyncio
+import os
+
+
+class TestChunking(TestCase):
+    """
+    Test cases for chunking.py
+    """
+
+    def test_split_and_join(self):
+        """
+        Tests that a value round trips through its chunks, and that missing
+        or altered chunks are rejected
+        """
+        value = os.urandom(1000)
+        self.assertIsNone(chunking.split('key', value, 1000))
+        chunks, manifest = chunking.split('key', value, 300)
+        names = chunking.chunk_keys('key', manifest)
+        self.assertEqual(names, list(chunks))
+        self.assertEqual([len(chunks[name]) for name in names],
+                         [300, 300, 300, 100])
+
+        parts = [chunks[name] for name in names]
+        self.assertEqual(chunking.join(manifest, parts), value)
+        self.assertIsNone(chunking.join(manifest, parts[:3] + [None]))
+        self.assertIsNone(chunking.join(manifest, parts[:3]))
+        altered = parts[:3] + [bytes(100)]
+        self.assertIsNone(chunking.join(manifest, altered))
+
+        self.assertIsNone(chunking.chunk_keys('key', value))
+        self.assertIsNone(chunking.chunk_keys('key', None))
+
+    def test_chunked_backend(self):
+        """
+        Tests storing large values in chunks through any backend
+        """
+        memory = MemoryBackend()
+        backend = chunking.ChunkedBackend(Mock(wraps=memory), 100)
+        large, small = os.urandom(250), b'small'
+        backend.set_cache_and_expire('large', large, 60)
+        backend.set_many_and_expire({'many': large, 'small': small}, 60)
+        backend.set_cache('forever', large)
+        self.assertEqual(len(memory.get_cache('large')),
+                         chunking._MANIFEST.size)
+
+        self.assertEqual(backend.get_cache('large'), large)
+        self.assertEqual(backend.get_cache('forever'), large)
+        backend.backend.get_many.reset_mock()
+        self.assertEqual(backend.get_many(['large', 'small', 'x', 'many']),
+                         [large, small, None, large])
+        # The chunks of every value are fetched together
+        self.assertEqual(backend.backend.get_many.call_count, 2)
+
+        names = chunking.chunk_keys('large', memory.get_cache('large'))
+        memory.invalidate_key(names[1])
+        self.assertIsNone(backend.get_cache('large'))
+        self.assertEqual(backend.get_many(['large', 'many']), [None, large])
+
+        # Methods of the wrapped backend are reachable
+        self.assertIs(chunking.ChunkedBackend(memory, 100)._entries,
+                      memory._entries)
+
+    def test_async_chunked_backend(self):
+        """
+        Tests the AsyncBackend version
+        """
+        backend = chunking.AsyncChunkedBackend(AsyncMemoryBackend(), 100)
+        large = os.urandom(250)
+
+        async def scenario():
+            await backend.set_cache_and_expire('large', large, 60)
+            await backend.set_many_and_expire({'many': large}, 60)
+            return (await backend.get_cache('large'),
+                    await backend.get_many(['many', 'missing']))
+        self.assertEqual(asyncio.run(scenario()), (large, [large, None]))
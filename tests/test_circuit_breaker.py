@@ -0,0 +1,86 @@
+from cache_deco.circuit_breaker import (
+    CircuitBreaker, CLOSED, HALF_OPEN, OPEN)
+from unittest import TestCase
+from mock import patch
+
+
+class TestCircuitBreaker(TestCase):
+    """
+    Test cases for circuit_breaker.py
+    """
+
+    def test_consecutive_failures(self):
+        """
+        Tests that the circuit opens after consecutive failures only
+        """
+        breaker = CircuitBreaker(failure_threshold=3,
+                                 error_rate_threshold=None)
+        for _ in range(2):
+            breaker.record_failure()
+        breaker.record_success()
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.trips, 1)
+
+    def test_error_rate(self):
+        """
+        Tests that the circuit opens on the error rate once enough calls
+        were made
+        """
+        breaker = CircuitBreaker(failure_threshold=None,
+                                 error_rate_threshold=0.5, window_size=10,
+                                 minimum_calls=4)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_window_slides(self):
+        """
+        Tests that failures older than the window are forgotten
+        """
+        breaker = CircuitBreaker(failure_threshold=None,
+                                 error_rate_threshold=0.5, window_size=4,
+                                 minimum_calls=4)
+        breaker.record_failure()
+        for _ in range(6):
+            breaker.record_success()
+        self.assertEqual(breaker.stats()['error_rate'], 0.0)
+        breaker.record_failure()
+        self.assertEqual(breaker.stats()['error_rate'], 0.25)
+        self.assertEqual(breaker.state, CLOSED)
+
+    @patch('cache_deco.circuit_breaker.time')
+    def test_half_open(self, mock_time):
+        """
+        Tests that after the reset timeout a single probe is let through,
+        and that its outcome closes or reopens the circuit
+        """
+        mock_time.monotonic.return_value = 100
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure()
+        mock_time.monotonic.return_value = 109
+        self.assertFalse(breaker.allow())
+
+        mock_time.monotonic.return_value = 110
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.trips, 2)
+
+        mock_time.monotonic.return_value = 120
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.stats()['consecutive_failures'], 0)
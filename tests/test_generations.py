@@ -0,0 +1,69 @@
+from backends.memory.memory_backend import MemoryBackend
+from cache_deco.generations import Generations, KEY_PREFIX
+from tests.inputs import AsyncMemoryBackend
+from unittest import TestCase
+from mock import Mock, patch
+import asyncio
+
+
+class TestGenerations(TestCase):
+    """
+    Test cases for generations.py
+    """
+
+    def test_fetch_and_bump(self):
+        """
+        Tests that unknown generations are 0 and bumps increment them
+        """
+        backend = MemoryBackend()
+        generations = Generations(backend)
+        self.assertEqual(generations.fetch(['ns:a', 'tag:b']),
+                         {'ns:a': 0, 'tag:b': 0})
+        self.assertEqual(generations.bump('tag:b'), 1)
+        self.assertEqual(generations.bump('tag:b'), 2)
+        self.assertEqual(backend.get_cache(KEY_PREFIX + 'tag:b'), b'2')
+        self.assertEqual(generations.fetch(['ns:a', 'tag:b']),
+                         {'ns:a': 0, 'tag:b': 2})
+        self.assertIsNone(generations.cached(['tag:b']))
+
+    def test_scope(self):
+        """
+        Tests that generations are appended to the key in the given order
+        """
+        self.assertEqual(
+            Generations.scope('abc', ['ns:a', 'tag:b'],
+                              {'tag:b': 3, 'ns:a': 1}),
+            'abc:1.3')
+
+    @patch('cache_deco.generations.time')
+    def test_ttl(self, mock_time):
+        """
+        Tests that fetched and bumped generations are reused for ttl seconds
+        """
+        mock_time.monotonic.return_value = 100
+        backend = Mock()
+        backend.get_counters.return_value = [b'4', None]
+        backend.incr.return_value = 1
+        generations = Generations(backend, ttl=5)
+
+        self.assertIsNone(generations.cached(['ns:a', 'tag:b']))
+        generations.fetch(['ns:a', 'tag:b'])
+        self.assertEqual(generations.cached(['ns:a', 'tag:b']),
+                         {'ns:a': 4, 'tag:b': 0})
+        generations.bump('tag:b')
+        self.assertEqual(generations.cached(['tag:b']), {'tag:b': 1})
+        self.assertIsNone(generations.cached(['ns:a', 'tag:c']))
+
+        mock_time.monotonic.return_value = 105
+        self.assertIsNone(generations.cached(['ns:a']))
+
+    def test_async(self):
+        """
+        Tests fetching and bumping through an AsyncBackend
+        """
+        generations = Generations(AsyncMemoryBackend())
+
+        async def scenario():
+            self.assertEqual(await generations.bump_async('ns:a'), 1)
+            return await generations.fetch_async(['ns:a'])
+        self.assertEqual(asyncio.run(scenario()), {'ns:a': 1})
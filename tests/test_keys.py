@@ -0,0 +1,186 @@
+from cache_deco import keys
+from tests.inputs import SimpleObject
+from unittest import TestCase, skipUnless
+import collections
+import os
+import subprocess
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def sample_function(a, b=None):
+    return a
+
+
+class Namespace(object):
+
+    @staticmethod
+    def sample_function(a, b=None):
+        return a
+
+
+class Described(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return 'Described(%s)' % self.value
+
+
+class TestKeys(TestCase):
+    """
+    Test cases for keys.py
+    """
+
+    def key(self, *args, **kwargs):
+        return keys.make_key(keys.new_hasher(sample_function), args, kwargs)
+
+    def test_format(self):
+        """
+        Tests that keys are fixed length hex digests
+        """
+        key = self.key(1, 'two', b=[3])
+        self.assertEqual(len(key), 2 * keys.KEY_DIGEST_SIZE)
+        int(key, 16)
+
+    def test_deterministic_across_processes(self):
+        """
+        Tests that keys don't depend on the per-process hash seed
+        """
+        script = (
+            'from tests.test_keys import sample_function; '
+            'from cache_deco import keys; '
+            'print(keys.make_key(keys.new_hasher(sample_function), '
+            '("a", 1.5, {"x": {1, 2}}, frozenset(["y", "z"])), {}))')
+        outputs = set()
+        for seed in ('1', '2', '3'):
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            outputs.add(subprocess.check_output(
+                [sys.executable, '-c', script], env=env).strip())
+        self.assertEqual(len(outputs), 1)
+        self.assertEqual(
+            outputs.pop().decode(),
+            self.key('a', 1.5, {'x': {1, 2}}, frozenset(['y', 'z'])))
+
+    def test_function_identity(self):
+        """
+        Tests that functions with the same name in different namespaces get
+        different keys
+        """
+        other = keys.make_key(
+            keys.new_hasher(Namespace.sample_function), (1,), {})
+        self.assertNotEqual(self.key(1), other)
+        self.assertEqual(keys.function_id(Namespace.sample_function),
+                         'tests.test_keys.Namespace.sample_function')
+
+    def test_types_are_distinguished(self):
+        """
+        Tests that values that print the same but differ get distinct keys
+        """
+        values = [1, '1', 1.0, True, b'1', None, 'None', (1,), [1], {1},
+                  ('a', 'b'), ('ab',), ('a,b',), {'a': 1}, [('a', 1)]]
+        generated = [self.key(value) for value in values]
+        self.assertEqual(len(set(generated)), len(values))
+        self.assertNotEqual(self.key('a', 'b'), self.key('ab'))
+
+    def test_unordered_collections(self):
+        """
+        Tests that dict, set and keyword argument order don't matter
+        """
+        self.assertEqual(self.key({'a': 1, 'b': 2}),
+                         self.key({'b': 2, 'a': 1}))
+        self.assertEqual(self.key({3, 'x', (1,)}), self.key({(1,), 'x', 3}))
+        self.assertEqual(self.key({1: 'a', 'b': 2}),
+                         self.key({'b': 2, 1: 'a'}))
+        self.assertEqual(self.key(1, b=2, c=3), self.key(1, c=3, b=2))
+        self.assertNotEqual(self.key(1, b=2), self.key(1, 2))
+
+    def test_subclasses(self):
+        """
+        Tests that subclasses of builtins are told apart from their base
+        """
+        self.assertNotEqual(self.key({'a': 1}),
+                            self.key(collections.OrderedDict(a=1)))
+        self.assertEqual(
+            self.key(collections.defaultdict(int, a=1)),
+            self.key(collections.defaultdict(int, a=1)))
+
+    def test_objects(self):
+        """
+        Tests that objects are keyed by __str__ when they define it, and by
+        their state otherwise
+        """
+        self.assertEqual(self.key(Described(1)), self.key(Described(1)))
+        self.assertNotEqual(self.key(Described(1)), self.key(Described(2)))
+
+        first = SimpleObject('a', 1)
+        self.assertEqual(self.key(first), self.key(SimpleObject('a', 1)))
+        self.assertNotEqual(self.key(first), self.key(SimpleObject('a', 2)))
+        nested = SimpleObject(SimpleObject('a', 1), 1)
+        key = self.key(nested)
+        nested.string.number = 2
+        self.assertNotEqual(self.key(nested), key)
+
+    def test_string_sequences(self):
+        """
+        Tests that long sequences of strings keep their boundaries
+        """
+        padding = ['x'] * keys.BULK_MIN_LENGTH
+        self.assertNotEqual(self.key(['ab', 'c'] + padding),
+                            self.key(['a', 'bc'] + padding))
+        self.assertNotEqual(self.key(['\u00e9', ''] + padding),
+                            self.key(['', '\u00e9'] + padding))
+        names = dict(('key%d' % i, 'value%d' % i) for i in range(20))
+        self.assertEqual(self.key(names), self.key(dict(names)))
+        names['key0'] = 'value'
+        self.assertNotEqual(self.key(names), self.key(dict(
+            ('key%d' % i, 'value%d' % i) for i in range(20))))
+
+    def test_short_arguments(self):
+        """
+        Tests that the fast path for a few positional arguments encodes them
+        like any other sequence, so keys are unchanged
+        """
+        for args in ((), (1, 'two'), ('\u00e9' * 10, -3, ''),
+                     ('x' * (keys.INLINE_TEXT + 1),), (1, 2.5, 'three'),
+                     tuple(range(keys.BULK_MIN_LENGTH))):
+            hasher = keys.new_hasher(sample_function)
+            out = keys._Output(hasher)
+            keys._feed_sequence(out, b'(', args)
+            out.flush()
+            self.assertEqual(self.key(*args), hasher.hexdigest())
+
+    def test_signature_key(self):
+        """
+        Tests keys built from custom signatures
+        """
+        hasher = keys.new_hasher(sample_function)
+        self.assertEqual(keys.make_signature_key(hasher, 'sig'),
+                         keys.make_signature_key(hasher, 'sig'))
+        self.assertNotEqual(keys.make_signature_key(hasher, 'sig'),
+                            keys.make_key(hasher, ('sig',), {}))
+
+    @skipUnless(numpy, 'numpy is not installed')
+    def test_numpy_arrays(self):
+        """
+        Tests that arrays are keyed by dtype, shape and contents
+        """
+        array = numpy.arange(12, dtype=numpy.int64).reshape(3, 4)
+        self.assertEqual(self.key(array), self.key(array.copy()))
+        self.assertEqual(self.key(array.T), self.key(array.T.copy()))
+        self.assertNotEqual(self.key(array), self.key(array.reshape(4, 3)))
+        self.assertNotEqual(self.key(array),
+                            self.key(array.astype(numpy.int32)))
+        changed = array.copy()
+        changed[2, 3] = 0
+        self.assertNotEqual(self.key(array), self.key(changed))
+
+        objects = numpy.array([SimpleObject('a', 1), None], dtype=object)
+        self.assertEqual(
+            self.key(objects),
+            self.key(numpy.array([SimpleObject('a', 1), None], dtype=object)))
@@ -0,0 +1,89 @@
+from cache_deco.local_cache import LocalCache
+from unittest import TestCase
+from mock import patch
+
+
+class TestLocalCache(TestCase):
+    """
+    Test cases for local_cache.py
+    """
+
+    def test_get_set(self):
+        """
+        Tests storing and reading entries, including None values
+        """
+        cache = LocalCache()
+        cache.set('key', None, 1, 10)
+        missing = object()
+
+        self.assertIsNone(cache.get('key', missing))
+        self.assertIs(cache.get('other', missing), missing)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lru_eviction_by_entries(self):
+        """
+        Tests that the least recently used entry is evicted first
+        """
+        cache = LocalCache(max_entries=2)
+        cache.set('a', 1, 1, 10)
+        cache.set('b', 2, 1, 10)
+        cache.get('a')
+        cache.set('c', 3, 1, 10)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_eviction_by_bytes(self):
+        """
+        Tests that the byte bound evicts entries and rejects oversized ones
+        """
+        cache = LocalCache(max_bytes=100)
+        cache.set('a', 1, 60, 10)
+        cache.set('b', 2, 60, 10)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 60)
+
+        cache.set('huge', 3, 101, 10)
+        self.assertIsNone(cache.get('huge'))
+        self.assertEqual(cache.get('b'), 2)
+
+        cache.set('b', 4, 10, 10)
+        self.assertEqual(cache.size, 10)
+
+    @patch('cache_deco.local_cache.time')
+    def test_ttl(self, mock_time):
+        """
+        Tests that entries expire, with the TTL capped by the cache's own
+        """
+        mock_time.monotonic.return_value = 100
+        cache = LocalCache(ttl=5)
+        cache.set('short', 1, 1, 2)
+        cache.set('capped', 2, 1, 60)
+
+        mock_time.monotonic.return_value = 103
+        self.assertIsNone(cache.get('short'))
+        self.assertEqual(cache.get('capped'), 2)
+
+        mock_time.monotonic.return_value = 106
+        self.assertIsNone(cache.get('capped'))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_invalidate_and_clear(self):
+        """
+        Tests removing entries
+        """
+        cache = LocalCache()
+        cache.set('a', 1, 5, 10)
+        cache.set('b', 2, 5, 10)
+
+        cache.invalidate('a')
+        cache.invalidate('missing')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 5)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
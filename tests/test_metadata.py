@@ -0,0 +1,29 @@
+from cache_deco import metadata
+from unittest import TestCase
+import pickle
+
+
+class TestMetadata(TestCase):
+    """
+    Test cases for metadata.py
+    """
+
+    def test_round_trip(self):
+        """
+        Tests that packed metadata is read back with the payload
+        """
+        payload = pickle.dumps({'a': 1})
+        packed = metadata.pack(payload, 1234.5, 0.25)
+
+        unpacked, soft_expires_at, compute_time = metadata.unpack(packed)
+        self.assertEqual(bytes(unpacked), payload)
+        self.assertEqual(soft_expires_at, 1234.5)
+        self.assertEqual(compute_time, 0.25)
+
+    def test_plain_value(self):
+        """
+        Tests that values stored without metadata are passed through
+        """
+        payload = pickle.dumps({'a': 1}, protocol=0)
+        self.assertEqual(metadata.unpack(payload), (payload, None, None))
+        self.assertEqual(metadata.unpack(b'\x00'), (b'\x00', None, None))
@@ -0,0 +1,78 @@
+from cache_deco.metrics import (
+    CacheObserver, FunctionMetrics, Histogram, Metrics)
+from unittest import TestCase
+from mock import Mock
+import threading
+
+
+class TestMetrics(TestCase):
+    """
+    Test cases for metrics.py
+    """
+
+    def test_histogram(self):
+        """
+        Tests bucketing, including the overflow bucket
+        """
+        histogram = Histogram((1, 10))
+        for value in (0.5, 1, 5, 50):
+            histogram.observe(value)
+        self.assertEqual(histogram.as_dict(), {
+            'count': 4,
+            'sum': 56.5,
+            'buckets': [(1, 2), (10, 1), (None, 1)],
+        })
+
+    def test_threads_are_summed(self):
+        """
+        Tests that counts recorded by several threads, including finished
+        ones, all appear in snapshots
+        """
+        fn_metrics = FunctionMetrics('module.function', [])
+
+        def record():
+            for _ in range(1000):
+                fn_metrics.hit('backend')
+            fn_metrics.backend_latency('get', 0.002)
+
+        workers = [threading.Thread(target=record) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        fn_metrics.hit('local')
+        fn_metrics.computed(0.5, 2048)
+
+        snapshot = fn_metrics.snapshot()
+        self.assertEqual(snapshot['hits'], 4001)
+        self.assertEqual(snapshot['local_hits'], 1)
+        self.assertEqual(snapshot['backend_latency']['get']['count'], 4)
+        self.assertEqual(snapshot['compute_time']['sum'], 0.5)
+        self.assertEqual(snapshot['serialized_size']['count'], 1)
+        # Shards of finished threads were folded together
+        self.assertEqual(len(fn_metrics._shards), 1)
+        self.assertEqual(fn_metrics.snapshot()['hits'], 4001)
+
+    def test_observers(self):
+        """
+        Tests that events are forwarded to observers added at any time
+        """
+        metrics = Metrics()
+        fn_metrics = metrics.for_function('module.function')
+        self.assertIs(metrics.for_function('module.function'), fn_metrics)
+        observer = Mock(spec=CacheObserver)
+        metrics.add_observer(observer)
+
+        fn_metrics.miss()
+        error = Exception('down')
+        fn_metrics.error(error)
+        fn_metrics.invalidation()
+
+        observer.miss.assert_called_once_with('module.function')
+        observer.error.assert_called_once_with('module.function', error)
+        observer.invalidation.assert_called_once_with('module.function')
+
+        metrics.remove_observer(observer)
+        fn_metrics.miss()
+        self.assertEqual(observer.miss.call_count, 1)
+        self.assertEqual(metrics.snapshot()['module.function']['misses'], 2)
@@ -0,0 +1,55 @@
+from cache_deco.negative import (
+    CachedException, NegativeCaching, decode, is_empty, pack_exception,
+    raise_cached)
+from cache_deco.serializers import Codec
+from unittest import TestCase
+import threading
+
+
+class TestNegative(TestCase):
+    """
+    Test cases for negative.py
+    """
+
+    def test_exception_round_trip(self):
+        """
+        Tests that an exception is told apart from values of any codec
+        """
+        data = pack_exception(KeyError('missing'))
+        cached = decode(Codec(), data)
+        self.assertIsInstance(cached, CachedException)
+        with self.assertRaises(KeyError):
+            raise_cached(cached)
+
+        for codec in (Codec(), Codec('json'), Codec('pickle', 'zlib', 0)):
+            self.assertIsNone(decode(codec, codec.dumps(None)))
+            self.assertEqual(raise_cached(decode(codec, codec.dumps(''))), '')
+
+        # Exceptions that can't be pickled aren't cached
+        self.assertIsNone(pack_exception(ValueError(threading.Lock())))
+
+    def test_is_empty(self):
+        """
+        Tests the default test for empty results
+        """
+        for value in (None, '', b'', [], (), {}, set()):
+            self.assertTrue(is_empty(value))
+        for value in (0, False, 'a', [None], object()):
+            self.assertFalse(is_empty(value))
+
+    def test_options(self):
+        """
+        Tests building the policy from decorator options
+        """
+        self.assertIsNone(NegativeCaching.from_options({'expiration': 10}))
+        policy = NegativeCaching.from_options({
+            'cache_exceptions': [KeyError], 'exception_ttl': 3,
+            'empty_ttl': 5})
+        self.assertTrue(policy.caches(KeyError()))
+        self.assertFalse(policy.caches(ValueError()))
+        self.assertEqual(policy.exception_ttl, 3)
+        self.assertEqual(policy.ttl([], 60), 5)
+        self.assertEqual(policy.ttl([], 2), 2)
+        self.assertEqual(policy.ttl([1], 60), 60)
+        self.assertFalse(NegativeCaching.from_options(
+            {'empty_ttl': 5}).caches(KeyError()))
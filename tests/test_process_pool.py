@@ -0,0 +1,91 @@
+from backends.memory.memory_backend import MemoryBackend
+from backends.redis.redis_backend import RedisBackend
+from benchmarks.redis_server import RedisStandIn
+from cache_deco import Cache
+from concurrent.futures import ProcessPoolExecutor
+from unittest import TestCase, skipUnless
+import multiprocessing
+import os
+
+# Pointed at the Redis stand-in by the tests, and by use_redis in spawned
+# workers, which import this module again
+process_cache = Cache(MemoryBackend())
+ARGUMENTS = ('text', 2.5, frozenset(['a', 'b', 'c']), {'x': 1, 'y': [2, 3]})
+
+
+@process_cache.cache()
+def tag(a):
+    # The pid tells which process computed the value
+    return a, os.getpid()
+
+
+def use_redis(port):
+    process_cache.backend = RedisBackend('127.0.0.1', port)
+
+
+def key_of(arguments):
+    return process_cache._generate_cache_key(tag, arguments, {})
+
+
+def inherited_connections(_=None):
+    return len(process_cache.backend.pool._idle)
+
+
+def call(a):
+    return tag(a)
+
+
+class TestProcessPool(TestCase):
+    """
+    Test cases for a Cache shared by the workers of a process pool
+    """
+
+    def setUp(self):
+        self.server = RedisStandIn().start()
+        self.addCleanup(self.server.stop)
+        self.backend = RedisBackend('127.0.0.1', self.server.port)
+        self.addCleanup(self.backend.disconnect)
+        process_cache.backend = self.backend
+
+    def run_pool(self, method, function, arguments, initializer=None,
+                 initargs=()):
+        context = multiprocessing.get_context(method)
+        with ProcessPoolExecutor(2, mp_context=context,
+                                 initializer=initializer,
+                                 initargs=initargs) as pool:
+            return list(pool.map(function, arguments))
+
+    def assert_shared(self, method, initializer=None, initargs=()):
+        parent = tag(1)
+        self.assertEqual(parent, (1, os.getpid()))
+        results = self.run_pool(method, call, [1, 2, 3, 4], initializer,
+                                initargs)
+
+        self.assertEqual(results[0], parent)
+        for a, (value, pid) in zip([2, 3, 4], results[1:]):
+            self.assertEqual(value, a)
+            self.assertNotEqual(pid, os.getpid())
+        # Values computed by the workers are read back by the parent
+        self.assertEqual([tag(a) for a in [2, 3, 4]], results[1:])
+
+    @skipUnless(hasattr(os, 'register_at_fork'), 'requires os.fork')
+    def test_fork(self):
+        """
+        Tests that forked workers open their own connections and share the
+        cached values
+        """
+        tag(0)
+        self.assertEqual(inherited_connections(), 1)
+        self.assertEqual(self.run_pool('fork', inherited_connections,
+                                       range(2)), [0, 0])
+        self.assert_shared('fork')
+
+    def test_spawn(self):
+        """
+        Tests that workers started from a fresh interpreter, with another
+        hash seed, generate the parent's keys and share the cached values
+        """
+        keys = self.run_pool('spawn', key_of, [ARGUMENTS], use_redis,
+                             (self.server.port,))
+        self.assertEqual(keys, [key_of(ARGUMENTS)])
+        self.assert_shared('spawn', use_redis, (self.server.port,))
@@ -0,0 +1,115 @@
+from cache_deco import serializers
+from cache_deco.serializers import Codec
+from unittest import TestCase, skipUnless
+import os
+import pickle
+
+VALUE = [{'id': i, 'name': 'row%d' % i, 'score': i / 2.0}
+         for i in range(200)]
+
+
+class TestCodec(TestCase):
+    """
+    Test cases for serializers.py
+    """
+
+    def test_headerless_default(self):
+        """
+        Tests that the default codec writes plain pickles
+        """
+        codec = Codec()
+        self.assertEqual(codec.dumps(VALUE), pickle.dumps(VALUE))
+        self.assertEqual(codec.loads(pickle.dumps(VALUE)), VALUE)
+
+    def test_round_trips(self):
+        """
+        Tests every builtin serializer, with and without compression
+        """
+        for name in ('pickle', 'marshal', 'json'):
+            for compression in (None, 'zlib'):
+                codec = Codec(name, compression)
+                data = codec.dumps(VALUE)
+                self.assertLess(data[0], 0x20)
+                self.assertEqual(codec.loads(data), VALUE)
+                self.assertEqual(codec.loads(bytearray(data)), VALUE)
+                self.assertEqual(codec.loads(memoryview(data)), VALUE)
+
+    def test_raw(self):
+        """
+        Tests that the raw serializer passes bytes through and rejects other
+        values
+        """
+        codec = Codec('raw')
+        self.assertEqual(codec.dumps(b'abc'), b'\x14abc')
+        self.assertEqual(codec.loads(b'\x14abc'), b'abc')
+        with self.assertRaises(TypeError):
+            codec.dumps('abc')
+
+    def test_compress_threshold(self):
+        """
+        Tests that only values over the threshold are compressed, and only
+        when that makes them smaller
+        """
+        codec = Codec('pickle', 'zlib', compress_threshold=100)
+        small = codec.dumps('x' * 10)
+        large = codec.dumps('x' * 1000)
+        self.assertEqual(small[0] & 3, 0)
+        self.assertEqual(large[0] & 3, 1)
+        self.assertLess(len(large), 100)
+
+        incompressible = codec.dumps(os.urandom(1000))
+        self.assertEqual(incompressible[0] & 3, 0)
+
+    def test_reads_other_codecs(self):
+        """
+        Tests that a codec decodes values written by another one, so the
+        serializer can be changed without flushing the cache
+        """
+        written = Codec('marshal', 'zlib', compress_threshold=0).dumps(VALUE)
+        self.assertEqual(Codec().loads(written), VALUE)
+        self.assertEqual(Codec('json').loads(written), VALUE)
+
+    def test_unknown(self):
+        """
+        Tests unknown serializer names and header bytes
+        """
+        with self.assertRaises(ValueError):
+            Codec('yaml')
+        with self.assertRaises(ValueError):
+            Codec(compression='bz2')
+        with self.assertRaises(ValueError):
+            Codec().loads(b'\x1cdata')
+
+    def test_custom_serializer(self):
+        """
+        Tests a user defined serializer
+        """
+        class Upper(serializers.Serializer):
+            codec_id = 7
+
+            def dumps(self, value):
+                return value.upper().encode('ascii')
+
+            def loads(self, data):
+                return bytes(data).decode('ascii')
+
+        codec = Codec(Upper())
+        self.assertEqual(codec.loads(codec.dumps('abc')), 'ABC')
+
+        class Invalid(Upper):
+            codec_id = 8
+
+        with self.assertRaises(ValueError):
+            Codec(Invalid())
+
+    @skipUnless(serializers.msgpack, 'msgpack is not installed')
+    def test_msgpack(self):
+        codec = Codec('msgpack', 'zlib')
+        self.assertEqual(codec.loads(codec.dumps(VALUE)), VALUE)
+
+    @skipUnless(serializers.lz4_frame, 'lz4 is not installed')
+    def test_lz4(self):
+        codec = Codec('pickle', 'lz4')
+        data = codec.dumps(VALUE)
+        self.assertEqual(data[0] & 3, 2)
+        self.assertEqual(codec.loads(data), VALUE)
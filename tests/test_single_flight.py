@@ -0,0 +1,98 @@
+from cache_deco.single_flight import SingleFlight
+from unittest import TestCase
+import threading
+
+
+class TestSingleFlight(TestCase):
+    """
+    Test cases for single_flight.py
+    """
+
+    def _run_concurrently(self, group, compute, count=8, timeout=None):
+        started = threading.Barrier(count)
+        results = []
+        errors = []
+
+        def worker():
+            started.wait()
+            try:
+                results.append(group.run('key', compute, timeout))
+            except ValueError as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=worker) for _ in range(count)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return results, errors
+
+    def test_collapses_concurrent_calls(self):
+        """
+        Tests that concurrent callers share a single computation
+        """
+        group = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        results, _ = self._run_concurrently(group, compute)
+
+        self.assertEqual(results, ['result'] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(group.in_flight(), 0)
+
+    def test_shares_exceptions(self):
+        """
+        Tests that waiting callers see the computation's exception
+        """
+        group = SingleFlight()
+        release = threading.Event()
+
+        def compute():
+            release.wait(5)
+            raise ValueError('failed')
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        results, errors = self._run_concurrently(group, compute)
+
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 8)
+        self.assertEqual(group.in_flight(), 0)
+
+    def test_wait_timeout(self):
+        """
+        Tests that callers stop waiting after the timeout and compute
+        """
+        group = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait(5)
+            return len(calls)
+
+        timer = threading.Timer(0.5, release.set)
+        timer.start()
+        results, _ = self._run_concurrently(
+            group, compute, count=2, timeout=0.05)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sorted(results), [2, 2])
+
+    def test_sequential_calls(self):
+        """
+        Tests that calls after completion compute again
+        """
+        group = SingleFlight()
+        self.assertEqual(group.run('key', lambda: 1), 1)
+        self.assertEqual(group.run('key', lambda: 2), 2)
@@ -0,0 +1,31 @@
+from cache_deco import streaming
+from unittest import TestCase
+
+
+class TestStreaming(TestCase):
+    """
+    Test cases for streaming.py
+    """
+
+    def test_manifest(self):
+        """
+        Tests that manifests round trip and other values aren't taken for
+        one
+        """
+        write_id = streaming.new_write_id()
+        manifest = streaming.pack_manifest(write_id, 3)
+        self.assertEqual(streaming.unpack_manifest(manifest), (write_id, 3))
+        self.assertEqual(streaming.unpack_manifest(bytearray(manifest)),
+                         (write_id, 3))
+        self.assertIsNone(streaming.unpack_manifest(b'\x80\x04N.'))
+        self.assertIsNone(streaming.unpack_manifest(manifest[:-1]))
+
+    def test_chunk_keys(self):
+        """
+        Tests that chunks of different writes get different keys
+        """
+        first, second = streaming.new_write_id(), streaming.new_write_id()
+        self.assertNotEqual(streaming.chunk_key('key', first, 0),
+                            streaming.chunk_key('key', second, 0))
+        self.assertNotEqual(streaming.chunk_key('key', first, 0),
+                            streaming.chunk_key('key', first, 1))
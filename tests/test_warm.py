@@ -0,0 +1,123 @@
+from backends.backend_base import BackendException
+from backends.memory.memory_backend import MemoryBackend
+from backends.shared_memory.shared_memory_backend import SharedMemoryBackend
+from cache_deco import Cache
+from cache_deco.warm import RateLimiter, main, preload
+from unittest import TestCase
+from mock import Mock, patch
+import os
+import shutil
+import tempfile
+
+warm_cache = Cache(MemoryBackend())
+
+
+@warm_cache.cache()
+def square(a):
+    if a < 0:
+        raise ValueError(a)
+    return a * a
+
+
+class TestWarm(TestCase):
+    """
+    Test cases for warm.py
+    """
+
+    def setUp(self):
+        self.backend = Mock(wraps=MemoryBackend())
+        warm_cache.backend = self.backend
+
+    def test_warm(self):
+        """
+        Tests that missing results are computed in batches and written with
+        the keys the wrapper looks up
+        """
+        square(3)
+        updates = []
+        status = warm_cache.warm(
+            square, [(i,) for i in range(10)], concurrency=2, batch_size=4,
+            progress=lambda status: updates.append(status.calls))
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(updates[-1], 10)
+        self.assertEqual((status.batches, status.calls, status.computed,
+                          status.cached, status.failed), (3, 10, 9, 1, 0))
+        self.assertEqual(self.backend.get_many.call_count, 3)
+        self.assertEqual(self.backend.set_many_and_expire.call_count, 3)
+
+        hits = warm_cache.backend_hits
+        self.assertEqual(square(9), 81)
+        self.assertEqual(warm_cache.backend_hits, hits + 1)
+        self.assertEqual(preload(square, [(9,), (3,)]).computed, 0)
+
+    def test_failed_batch(self):
+        """
+        Tests that a batch raising is counted and the others are written
+        """
+        status = preload(square, [(1,), (-1,), (2,), (3,)], batch_size=2)
+        self.assertEqual((status.computed, status.failed), (2, 2))
+        self.assertEqual(self.backend.set_many_and_expire.call_count, 1)
+
+    def test_backend_down(self):
+        """
+        Tests that batches that can't be looked up or written fail without
+        loading the function
+        """
+        self.backend.get_many.side_effect = BackendException('down')
+        status = preload(square, [(i,) for i in range(10)], batch_size=4)
+        self.assertEqual((status.computed, status.failed), (0, 10))
+
+        self.backend.get_many.side_effect = None
+        self.backend.set_many_and_expire.side_effect = BackendException('down')
+        status = preload(square, [(i,) for i in range(10)], batch_size=4)
+        self.assertEqual((status.computed, status.cached, status.failed),
+                         (0, 0, 10))
+
+    def test_not_decorated(self):
+        """
+        Tests that only functions decorated by a Cache can be warmed
+        """
+        with self.assertRaises(ValueError):
+            preload(len, [('a',)])
+
+    @patch('cache_deco.warm.time')
+    def test_rate_limiter(self, mock_time):
+        """
+        Tests that callers sleep until their call is due
+        """
+        mock_time.monotonic.return_value = 100
+        limiter = RateLimiter(10)
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual([call[0][0] for call in
+                          mock_time.sleep.call_args_list],
+                         [0.1, 0.2])
+
+    def test_processes(self):
+        """
+        Tests warming on a process pool writing to a shared backend
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        backend = SharedMemoryBackend(os.path.join(directory, 'cache'))
+        self.addCleanup(backend.close)
+        warm_cache.backend = backend
+        status = preload(square, [(i,) for i in range(20)], concurrency=2,
+                         batch_size=5, rate=1000, processes=True)
+        self.assertEqual(status.computed, 20)
+        self.assertEqual(len(backend), 20)
+
+    def test_main(self):
+        """
+        Tests the command line
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'calls.jsonl')
+        with open(path, 'w') as calls:
+            calls.write('[1]\n\n[2]\n[2]\n')
+        with patch('sys.stdout'), patch('sys.stderr'):
+            self.assertEqual(main(['tests.test_warm:square', path]), 0)
+        self.assertEqual(self.backend.get_many(
+            [warm_cache._generate_cache_key(square, (a,)) for a in (1, 2)]),
+            [warm_cache.codec.dumps(1), warm_cache.codec.dumps(4)])
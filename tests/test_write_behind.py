@@ -0,0 +1,189 @@
+from backends.memory.memory_backend import MemoryBackend
+from cache_deco.write_behind import WriteBehind, BLOCK
+from unittest import TestCase
+from mock import Mock
+import threading
+
+
+def encode(value):
+    return value.encode('ascii')
+
+
+class TestWriteBehind(TestCase):
+    """
+    Test cases for write_behind.py
+    """
+
+    def test_write_and_flush(self):
+        """
+        Tests that queued writes reach the backend, grouped by expiration
+        """
+        backend = Mock()
+        write_behind = WriteBehind(backend)
+        written = []
+        write_behind.submit('a', 'one', encode, 10,
+                            lambda *args: written.append(args))
+        write_behind.submit('b', 'two', encode, 10)
+        write_behind.submit('c', 'three', encode, 20)
+        self.assertTrue(write_behind.flush(5))
+
+        calls = [call[0] for call in
+                 backend.set_many_and_expire.call_args_list]
+        self.assertEqual(sorted(
+            (expiration, sorted(mapping.items()))
+            for mapping, expiration in calls), [
+            (10, [('a', b'one'), ('b', b'two')]),
+            (20, [('c', b'three')])])
+        self.assertEqual(written, [('a', 'one', b'one')])
+        self.assertEqual(write_behind.stats()['written'], 3)
+        write_behind.close()
+
+    def test_coalesce_and_pending(self):
+        """
+        Tests that queued writes to a key are coalesced, and readable until
+        written
+        """
+        release = threading.Event()
+        backend = MemoryBackend()
+        write_behind = WriteBehind(backend)
+
+        def blocking_encode(value):
+            release.wait(5)
+            return encode(value)
+
+        write_behind.submit('first', 'x', blocking_encode, 10)
+        write_behind.submit('a', 'one', encode, 10)
+        write_behind.submit('a', 'two', encode, 10)
+        self.assertEqual(write_behind.pending('a'), 'two')
+        self.assertEqual(write_behind.pending('first'), 'x')
+        self.assertIsNone(write_behind.pending('missing'))
+
+        release.set()
+        write_behind.flush(5)
+        self.assertEqual(backend.get_cache('a'), b'two')
+        self.assertIsNone(write_behind.pending('a'))
+        self.assertEqual(write_behind.stats()['written'], 2)
+        write_behind.close()
+
+    def test_errors_are_counted(self):
+        """
+        Tests that failed encodes and writes are counted, not raised
+        """
+        backend = Mock()
+        backend.set_many_and_expire.side_effect = Exception('down')
+        write_behind = WriteBehind(backend)
+
+        def failing_encode(value):
+            raise TypeError('not serializable')
+
+        write_behind.submit('a', 'one', failing_encode, 10)
+        write_behind.submit('b', 'two', encode, 10)
+        write_behind.flush(5)
+        self.assertEqual(write_behind.stats()['errors'], 2)
+        self.assertEqual(write_behind.stats()['written'], 0)
+        write_behind.close()
+
+    def test_skipped_write(self):
+        """
+        Tests that a value encoded to None is not written
+        """
+        backend = Mock()
+        write_behind = WriteBehind(backend)
+        write_behind.submit('a', 'one', lambda value: None, 10)
+        write_behind.submit('b', 'two', encode, 10)
+        write_behind.flush(5)
+        backend.set_many_and_expire.assert_called_once_with({'b': b'two'}, 10)
+        self.assertEqual(write_behind.stats()['errors'], 0)
+        write_behind.close()
+
+    def test_backpressure(self):
+        """
+        Tests the drop and block policies when the queue is full
+        """
+        release = threading.Event()
+
+        def blocking_encode(value):
+            release.wait(5)
+            return encode(value)
+
+        for policy in ('drop', BLOCK):
+            release.clear()
+            write_behind = WriteBehind(Mock(), max_pending=1, policy=policy,
+                                       block_timeout=0.01)
+            # The first write is taken by the worker, the second fills the
+            # queue
+            write_behind.submit('a', 'one', blocking_encode, 10)
+            write_behind.flush(0.05)
+            self.assertTrue(write_behind.submit('b', 'two', encode, 10))
+            self.assertTrue(write_behind.submit('b', 'three', encode, 10))
+            self.assertFalse(write_behind.submit('c', 'four', encode, 10))
+            self.assertEqual(write_behind.stats()['dropped'], 1)
+            release.set()
+            write_behind.close(5)
+
+    def test_discard(self):
+        """
+        Tests that a discarded queued write is dropped, and a discarded
+        write in flight is deleted once it lands
+        """
+        backend = MemoryBackend()
+        write = backend.set_many_and_expire
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_write(mapping, expiration):
+            started.set()
+            release.wait(5)
+            return write(mapping, expiration)
+        backend.set_many_and_expire = slow_write
+        write_behind = WriteBehind(backend)
+        write_behind.submit('a', 'one', encode, 10)
+        self.assertTrue(started.wait(5))
+        write_behind.submit('b', 'two', encode, 10)
+
+        write_behind.discard('a')
+        write_behind.discard('b')
+        self.assertIsNone(write_behind.pending('a'))
+        self.assertIsNone(write_behind.pending('b'))
+        release.set()
+        self.assertTrue(write_behind.flush(5))
+        self.assertEqual(len(backend), 0)
+
+        # A later write to the key is kept
+        write_behind.submit('a', 'three', encode, 10)
+        self.assertTrue(write_behind.close(5))
+        self.assertEqual(backend.get_cache('a'), b'three')
+
+    def test_close(self):
+        """
+        Tests that close writes the queue and later writes are dropped
+        """
+        backend = MemoryBackend()
+        write_behind = WriteBehind(backend)
+        write_behind.submit('a', 'one', encode, 10)
+        self.assertTrue(write_behind.close(5))
+        self.assertEqual(backend.get_cache('a'), b'one')
+        self.assertFalse(write_behind.submit('b', 'two', encode, 10))
+        self.assertFalse(any(thread.is_alive()
+                             for thread in write_behind._threads))
+
+    def test_reset_after_fork(self):
+        """
+        Tests that a child restarts the writer threads and drops the writes
+        queued by its parent
+        """
+        release = threading.Event()
+        backend = Mock()
+        backend.set_many_and_expire.side_effect = \
+            lambda mapping, expiration: release.wait(5)
+        write_behind = WriteBehind(backend)
+        write_behind.submit('a', 'one', encode, 10)
+
+        write_behind._reset_after_fork()
+
+        self.assertIsNone(write_behind.pending('a'))
+        release.set()
+        write_behind.submit('b', 'two', encode, 10)
+        self.assertTrue(write_behind.flush(5))
+        self.assertEqual(len(write_behind._threads), 1)
+        backend.set_many_and_expire.assert_called_with({'b': b'two'}, 10)